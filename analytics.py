@@ -0,0 +1,262 @@
+"""Columnar snapshots of activity data for offline reporting.
+
+`flask analytics-snapshot` copies users, messages, likes and follows into
+ANALYTICS_DIR as zlib-compressed typed arrays, one file per column, so
+reports read a few local files instead of querying the primary. Ids are
+stored as 32-bit ints and timestamps as 64-bit UTC epoch seconds.
+
+Users, messages and likes only gain rows with higher ids, so each run reads
+the rows past each table's id watermark (kept in manifest.json) and appends
+them as a new segment. Follows have no id and are only two ints per edge,
+so each run replaces them. Rows deleted after they were copied stay in the
+snapshot, and a row whose transaction commits after a later id was copied
+is skipped; run with --full now and then to rebuild everything.
+
+The query functions at the bottom work on whole columns at once (map,
+zip and Counter over arrays) rather than row by row.
+"""
+
+import calendar
+import json
+import os
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from datetime import date
+from itertools import repeat
+from operator import floordiv, itemgetter
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from files import write_file
+from models import db, Follows, Like, Message, User
+
+ANALYTICS_BATCH_SIZE = 10_000
+
+TABLES = {
+    'users': (User.id,),
+    'messages': (Message.id, Message.user_id, Message.timestamp),
+    'likes': (Like.id, Like.user_id, Like.message_id, Like.created_at),
+    'follows': (Follows.user_being_followed_id, Follows.user_following_id),
+}
+
+MANIFEST = 'manifest.json'
+
+DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def typecode(column):
+    return 'q' if isinstance(column.type, db.DateTime) else 'i'
+
+
+def epoch(timestamp):
+    """Naive UTC datetime -> epoch seconds."""
+
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+def day_to_date(day):
+    return date.fromordinal(EPOCH_ORDINAL + day)
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'byteorder': sys.byteorder, 'sequence': 0, 'tables': {}}
+
+
+def column_path(directory, table, segment, key):
+    return os.path.join(directory, table, f"{segment}.{key}.z")
+
+
+def read_table(columns, after=None):
+    """Columns of a table (rows with id > `after`, if given) as arrays."""
+
+    query = (select(*columns)
+             .order_by(*columns[0].table.primary_key.columns)
+             .execution_options(yield_per=ANALYTICS_BATCH_SIZE))
+    if after is not None:
+        query = query.where(columns[0] > after)
+
+    # Arrays can't hold NULL: leave out rows missing any of their values
+    query = query.where(*(column.is_not(None) for column in columns if column.nullable))
+
+    arrays = [array(typecode(column)) for column in columns]
+    converters = [epoch if typecode(column) == 'q' else None for column in columns]
+
+    for rows in db.session.execute(query).partitions():
+        for values, converter, out in zip(zip(*rows), converters, arrays):
+            out.extend(map(converter, values) if converter else values)
+
+    return {column.key: out for column, out in zip(columns, arrays)}
+
+
+def take_snapshot(directory, full=False):
+    """Copy new rows of every table into `directory`.
+
+    Returns {table: rows copied}. With `full`, every table is copied from
+    scratch and the old segments are removed.
+    """
+
+    manifest = read_manifest(directory)
+    if manifest['byteorder'] != sys.byteorder:
+        full = True
+        manifest['byteorder'] = sys.byteorder
+
+    copied = {}
+    for table, columns in TABLES.items():
+        incremental = columns[0].key == 'id' and not full
+        state = manifest['tables'].get(table) if incremental else None
+        state = state or {'watermark': 0, 'segments': [], 'rows': 0}
+
+        arrays = read_table(columns, state['watermark'] if incremental else None)
+        rows = len(arrays[columns[0].key])
+        copied[table] = rows
+
+        if not incremental:
+            state = {'watermark': 0, 'segments': [], 'rows': 0}
+        if rows:
+            manifest['sequence'] += 1
+            segment = f"{manifest['sequence']:06d}"
+            for key, values in arrays.items():
+                write_file(column_path(directory, table, segment, key),
+                           zlib.compress(values.tobytes()))
+            state['segments'].append(segment)
+            state['rows'] += rows
+            if 'id' in arrays:
+                state['watermark'] = arrays['id'][-1]
+
+        state['columns'] = {column.key: typecode(column) for column in columns}
+        manifest['tables'][table] = state
+
+    manifest['taken_at'] = int(time.time())
+    write_file(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2).encode())
+    remove_unlisted(directory, manifest)
+
+    return copied
+
+
+def remove_unlisted(directory, manifest):
+    """Delete segment files the manifest no longer refers to."""
+
+    for table, state in manifest['tables'].items():
+        path = os.path.join(directory, table)
+        if not os.path.isdir(path):
+            continue
+
+        listed = set(state['segments'])
+        for name in os.listdir(path):
+            if name.split('.', 1)[0] not in listed:
+                os.remove(os.path.join(path, name))
+
+
+class Snapshot:
+    """Read-only view of a snapshot directory; columns load on first use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        self.columns = {}
+
+    @property
+    def taken_at(self):
+        return self.manifest.get('taken_at')
+
+    def column(self, table, key):
+        """Every segment of `table`.`key`, as one array."""
+
+        if (table, key) not in self.columns:
+            state = self.manifest['tables'].get(table)
+            if state is None:
+                column = next(column for column in TABLES[table] if column.key == key)
+                state = {'columns': {key: typecode(column)}, 'segments': []}
+
+            values = array(state['columns'][key])
+            for segment in state['segments']:
+                with open(column_path(self.directory, table, segment, key), 'rb') as file:
+                    values.frombytes(zlib.decompress(file.read()))
+            self.columns[table, key] = values
+
+        return self.columns[table, key]
+
+    def days(self, table, key):
+        """`table`.`key` timestamps as day numbers since the epoch."""
+
+        return map(floordiv, self.column(table, key), repeat(DAY))
+
+
+def daily_actives(snapshot):
+    """{date: users who posted or liked something that day}."""
+
+    active = set(zip(snapshot.days('messages', 'timestamp'),
+                     snapshot.column('messages', 'user_id')))
+    active.update(zip(snapshot.days('likes', 'created_at'),
+                      snapshot.column('likes', 'user_id')))
+
+    counts = Counter(map(itemgetter(0), active))
+    return {day_to_date(day): counts[day] for day in sorted(counts)}
+
+
+def posting_rates(snapshot):
+    """{date: messages posted that day}."""
+
+    counts = Counter(snapshot.days('messages', 'timestamp'))
+    return {day_to_date(day): counts[day] for day in sorted(counts)}
+
+
+def follower_distribution(snapshot):
+    """{follower count: users with that many followers}, zero included."""
+
+    followers = Counter(snapshot.column('follows', 'user_being_followed_id'))
+    histogram = Counter(followers.values())
+
+    unfollowed = len(snapshot.column('users', 'id')) - len(followers)
+    if unfollowed > 0:
+        histogram[0] = unfollowed
+
+    return dict(sorted(histogram.items()))
+
+
+def analytics_dir(app):
+    return app.config['ANALYTICS_DIR'] or os.path.join(app.instance_path, 'analytics')
+
+
+@click.command('analytics-snapshot')
+@click.option('--full', is_flag=True, help='Copy every row again, not just new ones.')
+@with_appcontext
+def analytics_snapshot_command(full):
+    """Copy new activity rows into the columnar analytics snapshot."""
+
+    directory = analytics_dir(current_app)
+    for table, rows in take_snapshot(directory, full).items():
+        click.echo(f"{table}: {rows} rows")
+    click.echo(f"Wrote {directory}")
+
+
+@click.command('analytics-report')
+@click.option('--days', default=7, help='How many recent days to show.')
+@with_appcontext
+def analytics_report_command(days):
+    """Print daily actives, posting rates and followers from the snapshot."""
+
+    snapshot = Snapshot(analytics_dir(current_app))
+    if snapshot.taken_at is None:
+        raise click.ClickException("No snapshot yet; run `flask analytics-snapshot`")
+
+    actives = daily_actives(snapshot)
+    posts = posting_rates(snapshot)
+    click.echo("date        actives  posts")
+    for day in sorted(actives.keys() | posts.keys())[-days:]:
+        click.echo(f"{day}  {actives.get(day, 0):7}  {posts.get(day, 0):5}")
+
+    click.echo("\nfollowers  users")
+    for followers, users in follower_distribution(snapshot).items():
+        click.echo(f"{followers:9}  {users:5}")
@@ -1,38 +1,113 @@
 import os
+from datetime import datetime, timezone
+
+import click
 from dotenv import load_dotenv
-from urllib.parse import urlparse
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, url_for
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Blueprint, Flask, Response, abort, current_app, render_template, stream_template,
+                   stream_with_context, request, flash, get_flashed_messages, redirect, session, g, jsonify,
+                   send_file, send_from_directory)
+from flask.cli import with_appcontext
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
-
-from forms import UserAddForm, LoginForm, MessageForm, CSRFProtectForm, UserEditForm
-from models import db, connect_db, User, Message, DEFAULT_HEADER_IMAGE_URL, DEFAULT_IMAGE_URL
+from wtforms import ValidationError
+
+from analytics import analytics_report_command, analytics_snapshot_command
+from assets import build_assets_command, init_assets
+from compression import init_compression
+from config import CONFIGS, DEFAULT_CONFIG
+from exports import EXPORTS, FORMATS, export_chunks, export_command
+from forms import (UserAddForm, LoginForm, MessageForm, CSRFProtectForm, UserEditForm,
+                   mask_token, unmask_token)
+from images import image_source, image_url, init_images
+from graph import (following_ids, init_follow_graph, record_follow, record_unfollow,
+                   record_user_deleted)
+from models import db, connect_db, User, Message, Follows, Like, DEFAULT_HEADER_IMAGE_URL, DEFAULT_IMAGE_URL
+from permalinks import get_message, init_permalinks, message_changed, user_changed
+from pubsub import TooManySubscribers, event_stream, init_pubsub
+from ratelimit import init_ratelimit, purge_ratelimits_command
+from recommendations import (follows_changed, likes_changed, likes_deleted, recommend_command,
+                             recommended_users)
+from search import create_search_index, index_tags, reindex_search_command, search_messages
+from sessions import CURR_USER_KEY, init_sessions, purge_sessions_command
+from templating import init_templates
+from timelines import (feed_changed, init_timelines, messages_deleted, take_feed,
+                       timeline_metrics, timeline_rows, warm_feed)
+from trending import init_trending, record_deleted, record_like
+from queries import (feed_query, liked_messages_query, messages_query, to_dict,
+                     user_messages_query, user_query, users_page_query, users_query)
 
 load_dotenv()
 
-CURR_USER_KEY = "curr_user"
+bp = Blueprint('warbler', __name__)
+
+
+def create_app(config_name=None):
+    """Create and configure a Warbler app.
 
-app = Flask(__name__)
+    `config_name` picks a profile from config.CONFIGS; defaults to the
+    WARBLER_CONFIG environment variable, then to development.
+    """
+
+    config_name = config_name or os.environ.get('WARBLER_CONFIG', DEFAULT_CONFIG)
+
+    app = Flask(__name__)
+    app.config.from_object(CONFIGS[config_name])
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+    app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+
+    # Only pay for the toolbar's imports and response wrapping when asked
+    if app.config['DEBUG_TB_ENABLED']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    app.register_blueprint(bp)
+    app.cli.add_command(init_db)
+    app.cli.add_command(export_command)
+    app.cli.add_command(recommend_command)
+    app.cli.add_command(reindex_search_command)
+    app.cli.add_command(purge_sessions_command)
+    app.cli.add_command(purge_ratelimits_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(analytics_snapshot_command)
+    app.cli.add_command(analytics_report_command)
+    init_assets(app)
+    init_images(app)
+    init_templates(app)
+
+    connect_db(app)
+    init_sessions(app)
+    init_pubsub(app)
+    init_follow_graph(app)
+    init_trending(app)
+    init_permalinks(app)
+    init_timelines(app)
+    init_ratelimit(app)
+    init_compression(app)
+
+    return app
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db():
+    """Create any missing tables and the message search index."""
+
+    db.create_all()
+    create_search_index(db.session.connection())
+    db.session.commit()
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
-# TODO: Update docstring format
-connect_db(app)
-db.create_all()
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
@@ -42,14 +117,49 @@ def add_user_to_g():
     else:
         g.user = None
 
-@app.before_request
+@bp.before_app_request
 def create_csrf_form():
     '''Create empty csrf form'''
 
     form = CSRFProtectForm()
     g.csrf_form = form
 
-@app.before_request
+    # Streamed pages render after the session is saved, so store the
+    # page's token in it now
+    if g.user and request.method == 'GET':
+        generate_csrf()
+
+@bp.app_template_global()
+def csrf_token():
+    """The page's CSRF token, masked afresh (see forms.mask_token).
+
+    One token per page: <meta name="csrf-token"> in base.html, which
+    script.js sends back as an X-CSRFToken header.
+    """
+
+    return mask_token(generate_csrf())
+
+
+def csrf_errors():
+    '''Errors with the request's CSRF token, or None if it's valid.
+
+    Takes the page token from an X-CSRFToken header, else a csrf_token
+    field in the form or JSON body.
+    '''
+
+    token = request.headers.get('X-CSRFToken')
+    if token is None:
+        return None if g.csrf_form.validate() else g.csrf_form.errors
+
+    if not current_app.config['WTF_CSRF_ENABLED']:
+        return None
+    try:
+        validate_csrf(unmask_token(token))
+    except ValidationError as error:
+        return {'csrf_token': [str(error)]}
+    return None
+
+@bp.before_app_request
 def create_message_form():
     '''Create empty message form'''
 
@@ -57,20 +167,39 @@ def create_message_form():
     g.message_form = form
 
 def do_login(user):
-    """Log in user."""
+    """Log in user and start warming their home feed.
 
+    Starts from an empty session, which server-side sessions also save
+    under a new id, so nothing from before login carries over.
+    """
+
+    session.clear()
     session[CURR_USER_KEY] = user.id
+    warm_feed(user.id)
+
+
+def stream_page(template, **context):
+    """Render `template` as a streamed response.
+
+    The layout goes out as soon as it renders while the message loop is
+    still iterating its query. Flashed messages are popped here, while
+    the session cookie can still be updated; the template then reads them
+    from the request's cache.
+    """
+
+    get_flashed_messages()
+    return Response(stream_template(template, **context))
 
 
 def do_logout():
-    """Log out user."""
+    """Log out user (dropping their CSRF token along with the rest of the
+    session)."""
 
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+    session.clear()
 
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -108,7 +237,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login and redirect to homepage on success."""
 
@@ -129,7 +258,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@bp.post('/logout')
 def logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -155,7 +284,7 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@bp.get('/users')
 def list_users():
     """Page with listing of users.
 
@@ -168,15 +297,47 @@ def list_users():
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    # Plain column rows off a server-side cursor, not User objects
+    users = db.session.execute(
+        users_query(search)
+        .execution_options(yield_per=current_app.config['TIMELINE_YIELD_PER']))
 
-    return render_template('users/index.html', users=users)
+    return stream_page('users/index.html', users=users,
+                       following_ids=following_ids(g.user.id))
 
 
-@app.get('/users/<int:user_id>')
+@bp.get('/admin/export/<table>.<fmt>')
+def export_table(table, fmt):
+    """Download users, messages or follows as CSV or NDJSON (admins only).
+
+    Streamed from a server-side cursor; password hashes are left out.
+    """
+
+    if not g.user or g.user.username not in current_app.config['ADMIN_USERNAMES']:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if table not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+
+    return Response(
+        stream_with_context(export_chunks(table, fmt)),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'},
+    )
+
+
+@bp.get('/admin/metrics/timelines')
+def show_timeline_metrics():
+    """Feed warm-up counters for this worker (admins only)."""
+
+    if not g.user or g.user.username not in current_app.config['ADMIN_USERNAMES']:
+        return jsonify(message='Access unauthorized.'), 401
+
+    return jsonify(timeline_metrics())
+
+
+@bp.get('/users/<int:user_id>')
 def show_user(user_id):
     """Show user profile."""
 
@@ -190,12 +351,21 @@ def show_user(user_id):
                     .filter(Message.user_id == user_id)
                     .order_by(Message.timestamp.desc())
                     .limit(100)
-                    .all())
+                    .yield_per(current_app.config['TIMELINE_YIELD_PER']))
 
-    return render_template('users/show.html', user=user, messages=messages)
+    if user_id == g.user.id:
+        # Your own messages have no like button
+        liked_ids = set()
+    else:
+        liked_ids = {message_id for (message_id,) in db.session
+                     .query(Like.message_id)
+                     .filter(Like.user_id == g.user.id,
+                             Like.message_id.in_(messages.with_entities(Message.id)))}
 
+    return stream_page('users/show.html', user=user, messages=messages, liked_ids=liked_ids)
 
-@app.get('/users/<int:user_id>/following')
+
+@bp.get('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -207,7 +377,7 @@ def show_following(user_id):
     return render_template('users/following.html', user=user)
 
 
-@app.get('/users/<int:user_id>/followers')
+@bp.get('/users/<int:user_id>/followers')
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -219,7 +389,7 @@ def show_followers(user_id):
     return render_template('users/followers.html', user=user)
 
 
-@app.post('/users/follow/<int:follow_id>')
+@bp.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -232,12 +402,15 @@ def start_following(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    follows_changed(g.user.id)
     db.session.commit()
+    record_follow(g.user.id, followed_user.id)
+    feed_changed(g.user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@bp.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -248,14 +421,20 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
+    followed_user = User.query.get_or_404(follow_id)
+    if followed_user not in g.user.following:
+        return redirect(f"/users/{g.user.id}/following")
+
     g.user.following.remove(followed_user)
+    follows_changed(g.user.id)
     db.session.commit()
+    record_unfollow(g.user.id, followed_user.id)
+    feed_changed(g.user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def edit_profile():
     """Update profile for current user."""
 
@@ -269,13 +448,25 @@ def edit_profile():
 
     if form.validate_on_submit():
         if user.authenticate(user.username, form.password.data):
+            images = current_app.extensions['images']
+            try:
+                image_upload = form.image_file.data and images.save_upload(form.image_file.data)
+                header_upload = (form.header_image_file.data
+                                 and images.save_upload(form.header_image_file.data))
+            except ValueError:
+                flash("Images can be at most "
+                      f"{current_app.config['IMAGE_MAX_BYTES'] // (1024 * 1024)} MB.", 'danger')
+                return render_template("users/edit.html", form=form, user_id=user.id)
+
             user.username = form.username.data
             user.email = form.email.data
-            user.image_url = form.image_url.data or DEFAULT_IMAGE_URL
-            user.header_image_url = form.header_image_url.data or DEFAULT_HEADER_IMAGE_URL
+            user.image_url = image_upload or form.image_url.data or DEFAULT_IMAGE_URL
+            user.header_image_url = (header_upload or form.header_image_url.data
+                                     or DEFAULT_HEADER_IMAGE_URL)
             user.bio = form.bio.data
 
             db.session.commit()
+            user_changed(user.id)
 
             return redirect(f'/users/{user.id}')
         else:
@@ -283,7 +474,7 @@ def edit_profile():
 
     return render_template("users/edit.html", form=form, user_id=user.id)
 
-@app.post('/users/delete')
+@bp.post('/users/delete')
 def delete_user():
     """Delete user.
 
@@ -300,18 +491,49 @@ def delete_user():
 
         User.query.filter_by(id=g.user.id).delete()
         db.session.commit()
+        record_user_deleted(g.user.id)
+        user_changed(g.user.id)
 
     return redirect("/signup")
 
 
+##############################################################################
+# Image routes:
+
+@bp.get('/images/uploads/<name>')
+def show_upload(name):
+    """Serve an uploaded image as uploaded."""
+
+    return send_from_directory(current_app.extensions['images'].upload_dir, name,
+                               max_age=current_app.config['IMAGE_MAX_AGE'])
+
+
+@bp.get('/images/<variant>/<token>')
+def show_image(variant, token):
+    """Serve a resized image, or redirect to the original if it can't be
+    resized."""
+
+    source = image_source(variant, token)
+    path = current_app.extensions['images'].get(source, variant)
+
+    if path is None:
+        return redirect(source)
+
+    return send_file(path, mimetype='image/jpeg', max_age=current_app.config['IMAGE_MAX_AGE'])
+
+
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def add_message():
     """Add a message:
 
-    TODO: Update: Show form if GET. If valid, update message and redirect to user page.
+    Show form if GET. If valid, insert the message and answer with its JSON
+    (for the AJAX form) or redirect to the user page (for the plain form).
+
+    New messages are pushed to the feeds of the author and their followers
+    over /stream.
     """
 
     if not g.user:
@@ -320,27 +542,141 @@ def add_message():
 
     form = MessageForm()
 
-    if form.validate:
-        location = urlparse(request.json.get("location")).path
-        msg = Message(text=request.json.get("text"))
-        g.user.messages.append(msg)
+    if form.validate_on_submit():
+        [row] = Message.insert_many(g.user.id, [form.text.data])
+        index_tags([row])
         db.session.commit()
 
+        publish_messages(g.user, [row])
+
+        # AJAX posters already have their feed on screen (and /stream)
+        if not request.is_json:
+            warm_feed(g.user.id)
+            return redirect(f"/users/{g.user.id}")
+
         data = {
             'user': g.user.serialize(),
-            'msg': msg.serialize(),
-            'modify_DOM': False
+            'msg': {
+                'id': row.id,
+                'text': row.text,
+                'timestamp': row.timestamp,
+                'user_id': g.user.id,
+            },
         }
 
-        if location == url_for("homepage") or location == url_for("show_user", user_id=g.user.id):
-            data['modify_DOM'] = True
-
         return jsonify(data)
 
+    if request.is_json:
+        return jsonify(errors=form.errors), 400
+
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@bp.post('/api/messages/bulk')
+def add_messages_bulk():
+    """Add many messages at once for API clients and import tools.
+
+    Takes JSON {"csrf_token": ..., "messages": [{"text": ...}, ...]}. Valid
+    messages are inserted in a single statement; the response lists, in
+    input order, either the new message's id and timestamp or the item's
+    validation errors.
+    """
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    if not g.csrf_form.validate():
+        return jsonify(g.csrf_form.errors), 400
+
+    items = (request.get_json(silent=True) or {}).get('messages')
+    max_items = current_app.config['BULK_MESSAGES_MAX']
+
+    if not isinstance(items, list) or not 0 < len(items) <= max_items:
+        return jsonify(message=f'Send "messages" as a list of 1 to {max_items} items.'), 400
+
+    results = []
+    texts = []
+
+    for item in items:
+        form = MessageForm(
+            formdata=None,
+            data={'text': item.get('text') if isinstance(item, dict) else None},
+            meta={'csrf': False},
+        )
+
+        if form.validate():
+            texts.append(form.text.data)
+            results.append(None)
+        else:
+            results.append({'errors': form.errors})
+
+    rows = Message.insert_many(g.user.id, texts) if texts else []
+    index_tags(rows)
+    db.session.commit()
+
+    publish_messages(g.user, rows)
+
+    inserted = iter(rows)
+    for index, result in enumerate(results):
+        if result is None:
+            row = next(inserted)
+            results[index] = {'id': row.id, 'timestamp': row.timestamp.isoformat()}
+
+    return jsonify(created=len(rows), results=results)
+
+
+def publish_messages(user, rows):
+    """Push new messages by `user` to their own and their followers' live feeds.
+
+    `rows` have id, text and timestamp, as returned by Message.insert_many.
+    """
+
+    if not rows:
+        return
+
+    followers = (db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == user.id))
+    recipients = [user_id for (user_id,) in followers] + [user.id]
+
+    pubsub = current_app.extensions['pubsub']
+
+    for row in rows:
+        pubsub.publish(recipients, {
+            'id': row.id,
+            'text': row.text,
+            'timestamp': row.timestamp.isoformat(),
+            'user_id': user.id,
+            'username': user.username,
+            'image_url': user.image_url,
+            'thumb_url': image_url(user.image_url, 'thumb'),
+        })
+
+
+@bp.get('/stream')
+def stream():
+    """Server-Sent Events stream of new messages for the current user's feed."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    try:
+        subscription = current_app.extensions['pubsub'].subscribe(g.user.id)
+    except TooManySubscribers:
+        return jsonify(message='Too many connections.'), 503, {'Retry-After': '30'}
+
+    response = Response(
+        event_stream(subscription, current_app.config['SSE_HEARTBEAT_SECONDS']),
+        mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'},
+    )
+    # A response that's never iterated (e.g. to HEAD) never runs the
+    # generator's cleanup, but the server always closes it
+    response.call_on_close(subscription.close)
+    return response
+
+
+@bp.get('/messages/<int:message_id>')
 def show_message(message_id):
     """Show a message."""
 
@@ -348,15 +684,22 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    # A cached snapshot row (message and author), not a Message
+    msg = get_message(message_id)
+    if msg is None:
+        abort(404)
 
+    liked = Like.query.filter_by(user_id=g.user.id, message_id=message_id).first() is not None
 
-@app.post('/messages/<int:message_id>/delete')
+    return render_template('messages/show.html', message=msg, liked=liked,
+                           following_ids=following_ids(g.user.id))
+
+
+@bp.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
-    Check that this message was written by the current user.
+    Only deletes it if it was written by the current user.
     Redirect to user page on success.
     """
 
@@ -367,18 +710,91 @@ def delete_message(message_id):
     form = g.csrf_form
 
     if form.validate_on_submit():
-        msg = Message.query.get_or_404(message_id)
-        Message.query.filter_by(id=msg.id).delete()
-        db.session.commit()
-        flash("Message deleted")
+        if delete_own_messages([message_id]):
+            flash("Message deleted")
+        else:
+            flash("Access unauthorized.", "danger")
 
     return redirect(f"/users/{g.user.id}")
 
 
+@bp.post('/api/messages/delete')
+def delete_messages_bulk():
+    """Delete the current user's messages from a time range.
+
+    Takes JSON {"csrf_token": ..., "start": ..., "end": ...} with ISO 8601
+    UTC timestamps; deletes messages from `start` up to (not including)
+    `end`, oldest first, in chunks of MESSAGE_DELETE_CHUNK. At most
+    MESSAGE_DELETE_MAX go per request: "more" says whether to call again.
+    """
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    if not g.csrf_form.validate():
+        return jsonify(g.csrf_form.errors), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        start, end = (parse_timestamp(data[key]) for key in ('start', 'end'))
+    except (KeyError, TypeError, ValueError):
+        return jsonify(message='Send "start" and "end" as ISO 8601 timestamps.'), 400
+
+    chunk = current_app.config['MESSAGE_DELETE_CHUNK']
+    remaining = current_app.config['MESSAGE_DELETE_MAX']
+    deleted = 0
+
+    while remaining:
+        message_ids = db.session.scalars(
+            select(Message.id)
+            .where(Message.user_id == g.user.id,
+                   Message.timestamp >= start,
+                   Message.timestamp < end)
+            .order_by(Message.timestamp, Message.id)
+            .limit(min(chunk, remaining))
+        ).all()
+        if not message_ids:
+            break
+
+        deleted += len(delete_own_messages(message_ids))
+        remaining -= len(message_ids)
+
+    return jsonify(deleted=deleted, more=not remaining)
+
+
+def parse_timestamp(value):
+    """An ISO 8601 string as naive UTC, like Message.timestamp."""
+
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def delete_own_messages(message_ids):
+    """Delete those of `message_ids` written by the current user, in one
+    transaction, and update the caches and counters that refer to them.
+
+    Returns the ids deleted.
+    """
+
+    owned = select(Message.id).where(Message.user_id == g.user.id, Message.id.in_(message_ids))
+    likes_deleted(owned)
+    deleted = Message.delete_owned(g.user.id, message_ids)
+    db.session.commit()
+
+    record_deleted(deleted)
+    messages_deleted(deleted)
+    for message_id in deleted:
+        message_changed(message_id)
+
+    return deleted
+
+
 ##############################################################################
 # Like routes
 
-@app.post('/messages/<int:message_id>/like')
+@bp.post('/messages/<int:message_id>/like')
 def handle_like(message_id):
     '''
     If message is liked by user, unlikes; if message is not liked by user, likes
@@ -389,42 +805,45 @@ def handle_like(message_id):
         return redirect("/")
 
     user = g.user
-    form = g.csrf_form
-
-    # location = request.form.get("location")
 
-    if form.validate():
-        message = Message.query.get_or_404(message_id)
-        if message in user.messages:
-            return
+    errors = csrf_errors()
+    if errors:
+        return jsonify(errors), 400
 
-        if message in user.liked_messages:
-            user.liked_messages.remove(message)
+    message = Message.query.get_or_404(message_id)
+    if message in user.messages:
+        return jsonify(message="You can't like your own message."), 403
 
-        else:
-            user.liked_messages.append(message)
+    if message in user.liked_messages:
+        user.liked_messages.remove(message)
+        delta = -1
 
-        db.session.commit()
+    else:
+        user.liked_messages.append(message)
+        delta = 1
 
-        return "Success!"
+    likes_changed(user.id, message.id)
+    db.session.commit()
+    record_like(message.id, delta)
+    feed_changed(user.id)
 
-    return jsonify(form.errors), 400
+    return "Success!"
 
 # AJAX one
-@app.post('/messages/<int:message_id>/likes')
+@bp.post('/messages/<int:message_id>/likes')
 def handle_likes(message_id):
     '''If message is liked by user, unlikes; if message is not liked by user, likes
 
     Redirects to the page the user is currently on assuming valid authentication'''
 
-    # if not g.user:
-    #     flash("Access unauthorized.", "danger")
-    #     return redirect("/")
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
 
     user = g.user
-    # form = g.csrf_form
 
-    # location = request.form.get("location")
+    errors = csrf_errors()
+    if errors:
+        return jsonify(errors), 400
 
     message = Message.query.get_or_404(message_id)
     if message in user.messages:
@@ -433,12 +852,17 @@ def handle_likes(message_id):
     if message in user.liked_messages:
         user.liked_messages.remove(message)
         success_message = 'Like removed'
+        delta = -1
 
     else:
         user.liked_messages.append(message)
         success_message = 'Like added'
+        delta = 1
 
+    likes_changed(user.id, message.id)
     db.session.commit()
+    record_like(message.id, delta)
+    feed_changed(user.id)
 
     return jsonify(message=success_message)
 
@@ -447,24 +871,215 @@ def handle_likes(message_id):
 
 
 
-@app.get('/users/<int:user_id>/likes')
+@bp.get('/users/<int:user_id>/likes')
 def show_likes(user_id):
-    '''Show a user's likes page'''
+    '''Show a page of a user's likes, most recent first'''
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = g.user
+    user = User.query.get_or_404(user_id)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['LIKES_PAGE_SIZE']
+
+    # One row past the page tells the template there's a next one
+    messages = db.session.execute(
+        liked_messages_query(user_id, g.user.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .execution_options(yield_per=current_app.config['TIMELINE_YIELD_PER']))
+
+    return stream_page("users/likes.html", user=user, messages=messages,
+                       page=page, per_page=per_page)
+
+
+@bp.app_template_global()
+def like_count(user):
+    """How many messages `user` has liked."""
+
+    return db.session.scalar(select(func.count()).where(Like.user_id == user.id))
+
+
+@bp.app_template_global()
+def message_count(user):
+    """How many messages `user` has posted."""
+
+    return db.session.scalar(select(func.count()).where(Message.user_id == user.id))
+
+
+##############################################################################
+# Search routes
+
+def search_page():
+    """(query, page number) from the 'q' and 'page' params."""
+
+    return request.args.get('q', '').strip(), max(request.args.get('page', 1, type=int), 1)
+
+
+@bp.get('/search')
+def search():
+    """Page of messages matching the 'q' param, best match first."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    q, page = search_page()
+    messages, has_next = (search_messages(q, page, current_app.config['SEARCH_PAGE_SIZE'])
+                          if q else ([], False))
+
+    return render_template('messages/search.html', q=q, page=page,
+                           messages=messages, has_next=has_next)
+
+
+@bp.get('/api/search')
+def api_search():
+    """JSON of messages matching the 'q' param, a page at a time."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    q, page = search_page()
+    if not q:
+        return jsonify(message='Send a search in "q".'), 400
+
+    rows, has_next = search_messages(q, page, current_app.config['SEARCH_PAGE_SIZE'])
+    return jsonify(page=page, has_next=has_next, messages=[to_dict(row) for row in rows])
+
+
+##############################################################################
+# Trending routes
+
+def trending_window():
+    """The trending window named by the 'window' param (404 if unknown)."""
+
+    windows = current_app.config['TRENDING_WINDOWS']
+    window = request.args.get('window', next(iter(windows)))
+
+    if window not in windows:
+        abort(404)
+
+    return window
+
+
+def trending_rows(window):
+    """(message row, score) pairs for the hottest messages in `window`."""
+
+    ranked = current_app.extensions['trending'].top(window, current_app.config['TRENDING_SIZE'])
+    rows = {row.id: row for row in
+            db.session.execute(messages_query([message_id for message_id, _ in ranked]))}
+
+    return [(rows[message_id], score) for message_id, score in ranked if message_id in rows]
+
+
+@bp.get('/trending')
+def show_trending():
+    """Page of the most liked recent messages, optionally ?window=<name>."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    window = trending_window()
+    messages = trending_rows(window)
+
+    liked_ids = {message_id for (message_id,) in db.session
+                 .query(Like.message_id)
+                 .filter(Like.user_id == g.user.id,
+                         Like.message_id.in_([row.id for row, _ in messages]))}
+
+    return render_template('messages/trending.html', messages=messages, liked_ids=liked_ids,
+                           window=window, windows=current_app.config['TRENDING_WINDOWS'])
+
+
+@bp.get('/api/trending')
+def api_trending():
+    """JSON of the most liked recent messages, optionally ?window=<name>."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    window = trending_window()
+    return jsonify(window=window, messages=[
+        {**to_dict(row), 'score': round(score, 3)} for row, score in trending_rows(window)])
+
+
+##############################################################################
+# JSON API routes (also served natively async by asgi.py)
+
+@bp.get('/api/feed')
+def api_feed():
+    """JSON of the 100 most recent messages from followed users and self."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    rows = db.session.execute(feed_query(g.user.id))
+    return jsonify(messages=[to_dict(row) for row in rows])
+
+
+def users_page(params, config):
+    """(page, limit) for /api/users from the 'page' and 'limit' params (a
+    mapping of strings). Missing or bad values get the defaults, and
+    `limit` is capped at USERS_PAGE_MAX."""
+
+    def number(name, default):
+        value = params.get(name, '')
+        return int(value) if value.isdigit() and int(value) > 0 else default
+
+    return (number('page', 1),
+            min(number('limit', config['USERS_PAGE_SIZE']), config['USERS_PAGE_MAX']))
 
-    return render_template("users/likes.html", user=user)
+
+@bp.get('/api/users')
+def api_list_users():
+    """JSON of users, optionally filtered by the 'q' querystring param, a
+    page at a time."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    page, limit = users_page(request.args, current_app.config)
+    rows = db.session.execute(users_page_query(request.args.get('q'), page, limit)).all()
+    return jsonify(page=page, has_next=len(rows) > limit,
+                   users=[to_dict(row) for row in rows[:limit]])
+
+
+@bp.get('/api/users/<int:user_id>')
+def api_show_user(user_id):
+    """JSON of a user profile and their 100 most recent messages."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    user = db.session.execute(user_query(user_id)).first()
+    if user is None:
+        return jsonify(message='Not found.'), 404
+
+    rows = db.session.execute(user_messages_query(user_id))
+    return jsonify(user=to_dict(user), messages=[to_dict(row) for row in rows])
+
+
+@bp.get('/api/messages/<int:message_id>')
+def api_show_message(message_id):
+    """JSON of a single message and its author."""
+
+    if not g.user:
+        return jsonify(message='Access unauthorized.'), 401
+
+    msg = get_message(message_id)
+    if msg is None:
+        return jsonify(message='Not found.'), 404
+
+    return jsonify(message=to_dict(msg))
 
 
 ##############################################################################
 # Homepage and error pages
 
 
-@app.get('/')
+@bp.get('/')
 def homepage():
     """Show homepage:
 
@@ -473,32 +1088,28 @@ def homepage():
     """
 
     if g.user:
-        following_and_self = [following.id for following in g.user.following] + [g.user.id]
-
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_and_self))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # Warmed up after login or posting, if it's ready
+        feed = take_feed(g.user.id)
+        messages = timeline_rows(g.user.id) if feed is None else ()
 
-        return render_template('home.html', messages=messages)
+        return stream_page('home.html', feed=feed, messages=messages, viewer_id=g.user.id,
+                           recommendations=recommended_users(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Turn off caching in Flask, except for responses that set their own
+# max-age (built static assets and resized images)
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers unless the view chose how to cache."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if response.cache_control.max_age is None:
+        response.cache_control.no_store = True
     return response
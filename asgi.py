@@ -0,0 +1,309 @@
+"""ASGI entry point: async JSON read API in front of the Flask app.
+
+    uvicorn asgi:app --workers 4
+
+GET requests to the JSON read endpoints (/api/feed, /api/users,
+/api/users/<id>, /api/messages/<id>) are answered on the event loop with an
+async SQLAlchemy engine, so a request waiting on the database doesn't hold a
+thread. Everything else (HTML pages, forms, writes) is handed to the Flask
+app through asgiref's WSGI adapter, which runs it in a thread pool.
+
+The realtime feed (/stream) is also served here: an open stream waits on
+the event loop rather than holding one of the adapter's threads for as
+long as the tab stays open, so SSE_MAX_CONNECTIONS_ASYNC applies instead
+of the thread-sized SSE_MAX_CONNECTIONS.
+
+The HTML views stay on the WSGI path. Their reads are already single
+Core statements, and the permalink page reads through the permalink cache,
+so they spend their time rendering and compressing, not waiting on the
+database. benchmarks/concurrency.py drives the home feed and a permalink
+on both servers: with one worker, each page's throughput and median
+latency are the same either way, within noise. (A single-CPU run
+measured about 30ms per home page and 10ms per permalink on both.) Moving
+a page here would also mean redoing outside Flask what its request cycle
+does for it:
+- loading and saving the session (a page's CSRF token and flashed
+  messages are both written to it);
+- the before_request hooks (load shedding, g.user);
+- template globals that query (follow_counts, like_count and the like);
+- warmed feeds;
+- the after_request hooks (compression, cache headers).
+The rendering would still need a thread, or it would block the loop.
+"""
+
+import asyncio
+import json
+import os
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import parse_accept_header
+
+from app import CURR_USER_KEY, create_app, users_page
+from compression import compress, negotiate
+from pubsub import TooManySubscribers, async_event_stream, subscribe_async
+from sessions import ServerSessionInterface
+from queries import (feed_query, message_query, to_dict, user_exists_query,
+                     user_messages_query, user_query, users_page_query)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+flask_app = create_app(os.environ.get('WARBLER_CONFIG', 'production'))
+wsgi_app = WsgiToAsgi(flask_app)
+
+# Streams here don't hold threads, so the worker can keep more of them open
+flask_app.extensions['pubsub'].max_connections = flask_app.config['SSE_MAX_CONNECTIONS_ASYNC']
+
+# Created on first use, so each (possibly forked) worker gets its own pool
+engine = None
+
+
+def async_url(url):
+    """Swap the sync driver in a database URL for its asyncio counterpart."""
+
+    scheme, rest = url.split('://', 1)
+    return f"{ASYNC_DRIVERS[scheme.split('+')[0]]}://{rest}"
+
+
+def get_engine():
+    """Return this process's async engine, creating it if needed."""
+
+    global engine
+
+    if engine is None:
+        engine = create_async_engine(
+            async_url(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+            echo=flask_app.config['SQLALCHEMY_ECHO'],
+        )
+
+    return engine
+
+
+def load_session(sid):
+    """Server-side session `sid` (for use off the event loop)."""
+
+    with flask_app.app_context():
+        return flask_app.session_interface.load(sid)
+
+
+async def current_user_id(scope):
+    """Logged-in user id from the Flask session cookie, or None.
+
+    With server-side sessions the cookie is a session id: a session this
+    worker has cached is used as is, otherwise it's loaded in a thread.
+    """
+
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+
+    morsel = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+
+    interface = flask_app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        session = interface.cached(morsel.value)
+        if session is None:
+            session = await asyncio.to_thread(load_session, morsel.value)
+        return None if session is None else session.get(CURR_USER_KEY)
+
+    serializer = interface.get_signing_serializer(flask_app)
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+
+    try:
+        session = serializer.loads(morsel.value, max_age=max_age)
+    except BadSignature:
+        return None
+
+    return session.get(CURR_USER_KEY)
+
+
+##############################################################################
+# Async handlers: each returns (status, JSON-ready body)
+
+async def feed(conn, user_id, params):
+    rows = await conn.execute(feed_query(user_id))
+    return 200, {'messages': [to_dict(row) for row in rows]}
+
+
+async def list_users(conn, user_id, params):
+    search = params.get('q', [None])[0]
+    page, limit = users_page({name: values[0] for name, values in params.items()},
+                             flask_app.config)
+    rows = (await conn.execute(users_page_query(search, page, limit))).all()
+    return 200, {'page': page, 'has_next': len(rows) > limit,
+                 'users': [to_dict(row) for row in rows[:limit]]}
+
+
+async def show_user(conn, user_id, params, profile_id):
+    user = (await conn.execute(user_query(int(profile_id)))).first()
+    if user is None:
+        return 404, {'message': 'Not found.'}
+
+    rows = await conn.execute(user_messages_query(int(profile_id)))
+    return 200, {'user': to_dict(user), 'messages': [to_dict(row) for row in rows]}
+
+
+async def show_message(conn, user_id, params, message_id):
+    message_id = int(message_id)
+
+    async def load():
+        return (await conn.execute(message_query(message_id))).first()
+
+    # Shares the Flask app's permalink cache, and its coalescing of misses
+    msg = await flask_app.extensions['permalinks'].get_async(message_id, load)
+    if msg is None:
+        return 404, {'message': 'Not found.'}
+
+    return 200, {'message': to_dict(msg)}
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_events(send, events):
+    async for chunk in events:
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def stream(scope, receive, send, user_id):
+    """Server-Sent Events stream of the user's feed, until either side
+    ends it."""
+
+    try:
+        subscription, ready = subscribe_async(flask_app.extensions['pubsub'], user_id)
+    except TooManySubscribers:
+        return await send_json(scope, send, 503, {'message': 'Too many connections.'},
+                               [(b'retry-after', b'30')])
+
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-store'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        events = async_event_stream(
+            subscription, ready, flask_app.config['SSE_HEARTBEAT_SECONDS'])
+        tasks = {asyncio.ensure_future(send_events(send, events)),
+                 asyncio.ensure_future(wait_for_disconnect(receive))}
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    finally:
+        subscription.close()
+
+
+ROUTES = [
+    (re.compile(r'/api/feed'), feed),
+    (re.compile(r'/api/users'), list_users),
+    (re.compile(r'/api/users/(\d+)'), show_user),
+    (re.compile(r'/api/messages/(\d+)'), show_message),
+    (re.compile(r'/stream'), stream),
+]
+
+
+def match_route(scope):
+    """Async handler and path args for this request, or (None, None)."""
+
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None, None
+
+    for pattern, handler in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match:
+            return handler, match.groups()
+
+    return None, None
+
+
+def response_encoding(scope, payload):
+    """Encoding to compress `payload` with, as the Flask app would, or None."""
+
+    config = flask_app.config
+    if not config['COMPRESS_ENABLED'] or len(payload) < config['COMPRESS_MIN_SIZE']:
+        return None
+
+    accept = b','.join(value for name, value in scope['headers'] if name == b'accept-encoding')
+    return negotiate(parse_accept_header(accept.decode('latin-1')))
+
+
+async def send_json(scope, send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'cache-control', b'no-store'),
+        (b'vary', b'Accept-Encoding'),
+        *headers,
+    ]
+
+    encoding = response_encoding(scope, payload)
+    if encoding is not None:
+        payload = compress(payload, encoding, flask_app.config)
+        headers.append((b'content-encoding', encoding.encode()))
+
+    headers.append((b'content-length', str(len(payload)).encode()))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def lifespan(receive, send):
+    """Dispose the async pool when the server shuts down."""
+
+    while True:
+        event = await receive()
+
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif event['type'] == 'lifespan.shutdown':
+            if engine is not None:
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application."""
+
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    handler, args = match_route(scope)
+    if handler is None:
+        return await wsgi_app(scope, receive, send)
+
+    user_id = await current_user_id(scope)
+    params = parse_qs(scope['query_string'].decode())
+
+    async with get_engine().connect() as conn:
+        if (user_id is None
+                or (await conn.execute(user_exists_query(user_id))).first() is None):
+            return await send_json(scope, send, 401, {'message': 'Access unauthorized.'})
+
+        if handler is not stream:
+            status, body = await handler(conn, user_id, params, *args)
+
+    # Outside the `with`, so an open stream doesn't hold a connection
+    if handler is stream:
+        return await stream(scope, receive, send, user_id)
+
+    await send_json(scope, send, status, body)
@@ -0,0 +1,210 @@
+"""Fingerprinted and precompressed static assets.
+
+`flask build-assets` copies every file in static/ into static/dist/ under
+a name containing a hash of its contents (style.css becomes
+style.3f2a1b4c.css). CSS is minified and its url()s are pointed at the
+fingerprinted files. Text assets also get a .gz copy (and a .br copy when
+the brotli package is installed), and manifest.json maps each original
+name to its built one.
+
+With ASSET_MANIFEST on and a build present, url_for('static', ...) links
+to the built files. Those are served precompressed when the client
+accepts it, with an immutable Cache-Control, since a changed file gets a
+new name. A front proxy can serve static/dist/ itself instead (e.g.
+nginx's gzip_static), keeping static requests off the workers entirely.
+
+Build again whenever a static file changes. Old builds are kept, so pages
+rendered before a deploy still find their assets, until --clean.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+# Served encodings, best first: (Accept-Encoding name, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,])\s*')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def minify_css(css):
+    """Drop comments and needless whitespace.
+
+    Deliberately conservative: spaces around ':' and '>' are kept, since
+    they can be significant in selectors.
+    """
+
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(' ', css)
+    css = CSS_PUNCTUATION.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def fingerprint(name, data):
+    """`name` with a hash of `data` before its extension."""
+
+    root, ext = posixpath.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:8]}{ext}"
+
+
+def rewrite_css_urls(css, name, manifest, static_url_path):
+    """Point url()s in stylesheet `name` at built files, relative to it
+    (built files keep their directory, so relative to `name` too)."""
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(static_url_path + '/'):
+            target = url[len(static_url_path) + 1:]
+        elif '://' in url or url.startswith(('/', 'data:', '#')):
+            return match.group(0)
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(name), url))
+
+        if target not in manifest:
+            return match.group(0)
+
+        built = posixpath.relpath(manifest[target], posixpath.dirname(name) or '.')
+        return f'url("{built}")'
+
+    return CSS_URL.sub(replace, css)
+
+
+def write_built(build_dir, built, data):
+    """Write a built file, plus compressed copies that come out smaller."""
+
+    path = os.path.join(build_dir, built)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    if posixpath.splitext(built)[1] not in COMPRESSIBLE:
+        return
+
+    compressed = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(data, quality=11)
+
+    for suffix, body in compressed.items():
+        if len(body) < len(data):
+            with open(path + suffix, 'wb') as file:
+                file.write(body)
+
+
+def build_assets(static_folder, static_url_path='/static', clean=False):
+    """Build static_folder into its dist/ directory; returns the manifest."""
+
+    build_dir = os.path.join(static_folder, BUILD_DIR)
+    if clean:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    sources = {}
+    for root, dirs, names in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [name for name in dirs if name != BUILD_DIR]
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as file:
+                sources[os.path.relpath(path, static_folder).replace(os.sep, '/')] = file.read()
+
+    # Stylesheets go last, so the files they refer to are already named
+    manifest = {}
+    for name in sorted(sources, key=lambda name: name.endswith('.css')):
+        data = sources[name]
+
+        if name.endswith('.css'):
+            css = minify_css(data.decode())
+            data = rewrite_css_urls(css, name, manifest, static_url_path).encode()
+
+        manifest[name] = fingerprint(name, data)
+        write_built(build_dir, manifest[name], data)
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def init_assets(app):
+    """Link to and serve built assets, if configured and built."""
+
+    if not app.config['ASSET_MANIFEST']:
+        return
+
+    try:
+        with open(os.path.join(app.static_folder, BUILD_DIR, MANIFEST)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        app.logger.warning("No static asset build found; run `flask build-assets`")
+        return
+
+    app.extensions['assets'] = manifest
+    app.url_defaults(fingerprinted_url)
+    app.view_functions['static'] = send_asset
+
+
+def fingerprinted_url(endpoint, values):
+    """url_defaults hook: link static files to their built copies."""
+
+    if endpoint == 'static':
+        built = current_app.extensions['assets'].get(values.get('filename'))
+        if built is not None:
+            values['filename'] = f"{BUILD_DIR}/{built}"
+
+
+def send_asset(filename):
+    """Static view: built files precompressed and cached for good."""
+
+    if not filename.startswith(BUILD_DIR + '/'):
+        return current_app.send_static_file(filename)
+
+    static_folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0]
+
+    for encoding, suffix in ENCODINGS:
+        if (request.accept_encodings[encoding]
+                and os.path.exists(os.path.join(static_folder, filename + suffix))):
+            response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(static_folder, filename)
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['ASSET_MAX_AGE']
+    response.cache_control.immutable = True
+
+    return response
+
+
+@click.command('build-assets')
+@click.option('--clean', is_flag=True, help="Delete earlier builds first.")
+@with_appcontext
+def build_assets_command(clean):
+    """Fingerprint, minify and precompress static files."""
+
+    manifest = build_assets(current_app.static_folder, current_app.static_url_path, clean)
+    click.echo(f"Built {len(manifest)} static files into "
+               f"{os.path.join(current_app.static_folder, BUILD_DIR)}")
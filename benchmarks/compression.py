@@ -0,0 +1,106 @@
+"""Benchmark response compression: CPU time against bytes saved.
+
+Renders a home timeline and the JSON feed with 100 messages each, then
+for every gzip level (and brotli quality, if the brotli package is
+installed) reports the compressed size, the ratio to the raw page and the
+median time to compress it. The streamed rows compress the page in
+template-sized chunks with a flush every COMPRESS_STREAM_FLUSH bytes, as
+streamed timelines are sent.
+
+Pages are rendered from in-memory model objects, so no database is needed
+(DATABASE_URL just has to be set). Run from the project root:
+
+    python benchmarks/compression.py [--messages 100] [--runs 20]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import g, render_template, stream_template
+
+from app import create_app
+from compression import ENCODINGS, Encoder, compress, compress_stream
+from forms import CSRFProtectForm, MessageForm
+from render import fake_data, feed_rows
+
+LEVELS = {'gzip': range(1, 10), 'br': range(0, 12)}
+LEVEL_SETTING = {'gzip': 'COMPRESS_GZIP_LEVEL', 'br': 'COMPRESS_BROTLI_QUALITY'}
+
+
+def median_ms(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1000
+
+
+def pages(app, size):
+    """{name: (whole body, body as the template streams it)}"""
+
+    viewer, author = fake_data(size)
+
+    with app.test_request_context('/'):
+        g.user = viewer
+        g.csrf_form = CSRFProtectForm()
+        g.message_form = MessageForm()
+
+        context = {'feed': None, 'messages': feed_rows(viewer, author), 'viewer_id': viewer.id}
+        html = render_template('home.html', **context).encode()
+        chunks = [chunk.encode() for chunk in stream_template('home.html', **context)]
+
+    feed = json.dumps({'messages': [
+        {'id': msg.id, 'text': msg.text, 'timestamp': msg.timestamp.isoformat(),
+         'user_id': author.id, 'username': author.username, 'image_url': author.image_url}
+        for msg in author.messages
+    ]}).encode()
+
+    return {'home.html': (html, chunks), 'api/feed': (feed, [feed])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    config = dict(app.config)
+
+    print(f"{'page':<10} {'encoding':<16} {'bytes':>8} {'ratio':>6} {'time':>9}")
+
+    for name, (body, chunks) in pages(app, args.messages).items():
+        print(f"{name:<10} {'none':<16} {len(body):>8} {1:>6.2f} {0:>7.2f}ms")
+
+        for encoding in reversed(ENCODINGS):
+            for level in LEVELS[encoding]:
+                config[LEVEL_SETTING[encoding]] = level
+                size = len(compress(body, encoding, config))
+                ms = median_ms(lambda: compress(body, encoding, config), args.runs)
+                print(f"{name:<10} {f'{encoding}-{level}':<16} {size:>8} "
+                      f"{size / len(body):>6.2f} {ms:>7.2f}ms")
+
+            # Streamed at the default level
+            config = dict(app.config)
+            flush = config['COMPRESS_STREAM_FLUSH']
+
+            def streamed():
+                return b''.join(compress_stream(chunks, Encoder(encoding, config), flush))
+
+            size = len(streamed())
+            ms = median_ms(streamed, args.runs)
+            label = f"{encoding}-{config[LEVEL_SETTING[encoding]]} streamed"
+            print(f"{name:<10} {label:<16} {size:>8} {size / len(body):>6.2f} {ms:>7.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
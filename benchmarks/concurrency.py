@@ -0,0 +1,157 @@
+"""Compare per-process concurrency of the sync and async deployments.
+
+Starts each server with a single worker process against DATABASE_URL, then
+drives each path at increasing numbers of concurrent clients and reports
+throughput and latency percentiles:
+
+- sync:  gunicorn -c gunicorn.conf.py   (one threaded worker)
+- async: uvicorn asgi:app               (one event loop)
+
+The default paths are the async JSON feed and the two busiest HTML pages,
+the home feed and a message permalink, which the async server hands to
+Flask in a thread. The database needs data to read (run seed.py or
+benchmarks/load.py --seed first). Run from the project root:
+
+    python benchmarks/concurrency.py [--paths /api/feed / /messages/1]
+        [--duration 10] [--concurrency 1 10 50 100] [--user-id 1]
+"""
+
+import argparse
+import http.client
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from app import CURR_USER_KEY, create_app
+
+SERVERS = {
+    'sync': ['gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{port}'],
+    'async': ['uvicorn', 'asgi:app', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+def session_cookie(user_id):
+    """Flask session cookie that logs in as `user_id`.
+
+    It carries a CSRF token already. Otherwise the first page would add
+    one, and the saved session would get a new id that the other clients,
+    replaying this cookie, don't have.
+    """
+
+    app = create_app('production')
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+        sess['csrf_token'] = secrets.token_hex(20)
+
+    [cookie] = client.cookie_jar
+    return f"{cookie.name}={cookie.value}"
+
+
+def start_server(name, port):
+    """Launch server `name` with one worker and wait for its port to open."""
+
+    cmd = [part.format(port=port) for part in SERVERS[name]]
+    env = {**os.environ, 'WEB_CONCURRENCY': '1', 'WARBLER_CONFIG': 'production'}
+    proc = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+
+    proc.kill()
+    raise RuntimeError(f"{name} server didn't start on port {port}")
+
+
+def run_load(port, path, cookie, concurrency, duration):
+    """Hammer `path` from `concurrency` threads; return (latencies, errors)."""
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    # As a browser sends them
+    headers = {'Cookie': cookie, 'Accept-Encoding': 'gzip', 'Connection': 'close'}
+
+    def client():
+        nonlocal errors
+        mine = []
+        failed = 0
+
+        while time.monotonic() < stop_at:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status == 200:
+                    mine.append(time.perf_counter() - start)
+                else:
+                    failed += 1
+            except OSError:
+                failed += 1
+            finally:
+                conn.close()
+
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors
+
+
+def percentile(values, pct):
+    return statistics.quantiles(values, n=100)[pct - 1] * 1000 if len(values) > 1 else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paths', nargs='+', default=['/api/feed', '/', '/messages/1'])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    cookie = session_cookie(args.user_id)
+
+    print(f"{'server':<6} {'path':<12} {'clients':>7} {'req/s':>8} {'p50':>8} {'p99':>8} "
+          f"{'errors':>6}")
+    for name in SERVERS:
+        proc = start_server(name, args.port)
+        try:
+            for path in args.paths:
+                for concurrency in args.concurrency:
+                    latencies, errors = run_load(
+                        args.port, path, cookie, concurrency, args.duration)
+                    print(f"{name:<6} {path:<12} {concurrency:>7} "
+                          f"{len(latencies) / args.duration:>8.1f} "
+                          f"{percentile(latencies, 50):>6.1f}ms "
+                          f"{percentile(latencies, 99):>6.1f}ms {errors:>6}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
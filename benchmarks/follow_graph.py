@@ -0,0 +1,122 @@
+"""Benchmark the in-memory follow graph against plain Python sets.
+
+Builds a random follow graph (power-law-ish: a few users have most of the
+followers) and reports, for the packed CSR index in graph.py and for a
+dict of sets per direction:
+
+- memory per follow edge (tracemalloc, both directions)
+- build time
+- median lookup times for is-following, follower counts, mutual follows
+  and "followed by people you follow"
+
+No database is needed. Run from the
+project root:
+
+    python benchmarks/follow_graph.py [--users 100000] [--edges 1000000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from graph import FollowGraph
+
+
+class SetGraph:
+    """The obvious alternative: a set of neighbours per user and direction."""
+
+    def __init__(self, follows):
+        self.following = defaultdict(set)
+        self.followers = defaultdict(set)
+        for follower, followed in follows:
+            self.following[follower].add(followed)
+            self.followers[followed].add(follower)
+
+    def is_following(self, follower_id, followed_id):
+        return followed_id in self.following.get(follower_id, ())
+
+    def follower_count(self, user_id):
+        return len(self.followers.get(user_id, ()))
+
+    def mutual_ids(self, user_id):
+        return self.following.get(user_id, set()) & self.followers.get(user_id, set())
+
+    def followed_by_followees(self, viewer_id, user_id):
+        return self.following.get(viewer_id, set()) & self.followers.get(user_id, set())
+
+
+def random_follows(users, edges, seed=0):
+    rand = random.Random(seed)
+    follows = set()
+    while len(follows) < edges:
+        follower = rand.randrange(1, users + 1)
+        # Pareto-distributed targets give a handful of very popular users
+        followed = min(int(rand.paretovariate(1.2)), users)
+        followed = (followed * 7919) % users + 1
+        if follower != followed:
+            follows.add((follower, followed))
+    return list(follows)
+
+
+def measure_build(cls, follows):
+    """(index, bytes allocated, seconds) for building `cls` from `follows`."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = cls(follows)
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return index, size, seconds
+
+
+def median_us(func, args, runs):
+    timings = []
+    for arg in args[:runs]:
+        start = time.perf_counter()
+        func(*arg)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--edges', type=int, default=1_000_000)
+    parser.add_argument('--runs', type=int, default=2000)
+    args = parser.parse_args()
+
+    follows = random_follows(args.users, args.edges)
+    rand = random.Random(1)
+    pairs = [(rand.randrange(1, args.users + 1), rand.randrange(1, args.users + 1))
+             for _ in range(args.runs)]
+    users = [(user_id,) for user_id, _ in pairs]
+
+    print(f"{args.users:,} users, {len(follows):,} follows")
+    print(f"{'index':<8} {'bytes/edge':>10} {'build':>8} {'is_following':>13} "
+          f"{'followers':>10} {'mutuals':>9} {'followed_by':>12}")
+
+    for name, cls in (('csr', FollowGraph), ('sets', SetGraph)):
+        index, size, seconds = measure_build(cls, follows)
+
+        print(f"{name:<8} {size / len(follows):>10.1f} {seconds:>7.2f}s "
+              f"{median_us(index.is_following, pairs, args.runs):>11.2f}us "
+              f"{median_us(index.follower_count, users, args.runs):>8.2f}us "
+              f"{median_us(index.mutual_ids, users, args.runs):>7.2f}us "
+              f"{median_us(index.followed_by_followees, pairs, args.runs):>10.2f}us")
+
+        del index
+
+
+if __name__ == '__main__':
+    main()
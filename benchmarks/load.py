@@ -0,0 +1,369 @@
+"""Load test Warbler with a realistic traffic mix.
+
+Drives a weighted mix of feed, profile, search, like and post requests from
+concurrent simulated users and reports throughput and p50/p95/p99 latency
+per endpoint. Requests go through the Flask test client (the same way the
+view tests do) or, with --url, to a running server such as a local gunicorn.
+
+--seed DROPS AND RECREATES every table in DATABASE_URL, then fills it with a
+synthetic dataset of the requested size. Point it at a scratch database.
+
+    python benchmarks/load.py --seed --users 1000
+    python benchmarks/load.py --duration 30 --concurrency 8
+    python benchmarks/load.py --url http://127.0.0.1:8000
+
+Save a baseline, then have CI fail when a later run regresses against it:
+
+    python benchmarks/load.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load.py --compare benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookiejar import Cookie, CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlparse
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import text
+
+from app import CURR_USER_KEY, create_app
+from models import Follows, Like, Message, User, bcrypt, db
+
+# Relative share of each kind of request in the traffic mix
+DEFAULT_MIX = {
+    'feed': 40,
+    'profile': 20,
+    'search': 10,
+    'like': 20,
+    'post': 10,
+}
+
+CSRF_RE = re.compile(r'id="csrf_token" name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Dataset
+
+def seed(users, messages_per_user, follows_per_user, likes_per_user, rng):
+    """Replace the database contents with a synthetic dataset."""
+
+    db.drop_all()
+    db.create_all()
+
+    # Hashing is the slow part of signup; every seeded user shares one hash
+    password = bcrypt.generate_password_hash('password').decode('UTF-8')
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password': password}
+        for i in range(1, users + 1)
+    ])
+
+    start = datetime.utcnow() - timedelta(days=365)
+    total_messages = users * messages_per_user
+    db.session.execute(Message.__table__.insert(), [
+        {'id': i, 'text': f'warble {i}', 'user_id': rng.randint(1, users),
+         'timestamp': start + timedelta(seconds=rng.randint(0, 365 * 86400))}
+        for i in range(1, total_messages + 1)
+    ])
+
+    db.session.execute(Follows.__table__.insert(), [
+        {'user_following_id': follower, 'user_being_followed_id': followed}
+        for follower in range(1, users + 1)
+        for followed in rng.sample(range(1, users + 1), min(follows_per_user, users))
+        if followed != follower
+    ])
+
+    db.session.execute(Like.__table__.insert(), [
+        {'user_id': liker, 'message_id': message_id}
+        for liker in range(1, users + 1)
+        for message_id in rng.sample(range(1, total_messages + 1),
+                                     min(likes_per_user, total_messages))
+    ])
+
+    # Explicit ids above don't advance Postgres sequences
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('users', 'messages', 'likes'):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT MAX(id) FROM {table}))"))
+
+    db.session.commit()
+
+
+##############################################################################
+# Clients: one per simulated user
+
+class TestClient:
+    """Logged-in Flask test client."""
+
+    def __init__(self, app, user_id):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, form=None, json_body=None):
+        return self.client.post(path, data=form, json=json_body).status_code
+
+
+class HttpClient:
+    """Logged-in client for a running server, carrying a CSRF token."""
+
+    def __init__(self, app, base_url, user_id):
+        self.base_url = base_url.rstrip('/')
+        [session] = TestClient(app, user_id).client.cookie_jar
+
+        jar = CookieJar()
+        jar.set_cookie(Cookie(
+            0, app.config['SESSION_COOKIE_NAME'],
+            session.value,
+            None, False, urlparse(self.base_url).hostname, False, False,
+            '/', True, False, None, False, None, None, {}))
+        self.opener = build_opener(HTTPCookieProcessor(jar))
+
+        # The token is stored in the session, whose cookie the jar keeps
+        html = self.opener.open(self.base_url + '/').read().decode()
+        match = CSRF_RE.search(html)
+        self.csrf_token = match.group(1) if match else ''
+
+    def _send(self, request):
+        try:
+            with self.opener.open(request) as resp:
+                resp.read()
+                return resp.status
+        except HTTPError as err:
+            return err.code
+
+    def get(self, path):
+        return self._send(Request(self.base_url + path))
+
+    def post(self, path, form=None, json_body=None):
+        if json_body is not None:
+            body = json.dumps({**json_body, 'csrf_token': self.csrf_token}).encode()
+            content_type = 'application/json'
+        else:
+            body = urlencode({**(form or {}), 'csrf_token': self.csrf_token}).encode()
+            content_type = 'application/x-www-form-urlencoded'
+
+        return self._send(Request(self.base_url + path, data=body,
+                                  headers={'Content-Type': content_type}))
+
+
+##############################################################################
+# Traffic
+
+def pick_request(kind, user_ids, likeable, rng):
+    """(method, path, kwargs) for one request of `kind`."""
+
+    if kind == 'feed':
+        return 'get', '/', {}
+    if kind == 'profile':
+        return 'get', f'/users/{rng.choice(user_ids)}', {}
+    if kind == 'search':
+        return 'get', '/search?' + urlencode({'q': f'warble {rng.randint(1, 9999)}'}), {}
+    if kind == 'like':
+        return 'post', f'/messages/{rng.choice(likeable)}/like', {'form': {}}
+    if kind == 'post':
+        return 'post', '/messages/new', {'json_body': {'text': f'load test {rng.random()}'}}
+
+    raise ValueError(kind)
+
+
+def run(make_client, mix, concurrency, duration, seed_value):
+    """Run the mix from `concurrency` users; return {kind: (latencies, errors)}."""
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    if len(user_ids) < concurrency:
+        raise SystemExit("Not enough users in the database; run with --seed")
+
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    results = {kind: ([], 0) for kind in kinds}
+    lock = threading.Lock()
+
+    rng = random.Random(seed_value)
+    workers = []
+    for user_id in rng.sample(user_ids, concurrency):
+        # Liking your own message isn't allowed; only sample others' messages
+        likeable = [message_id for (message_id,) in db.session
+                    .query(Message.id)
+                    .filter(Message.user_id != user_id)
+                    .limit(1000)]
+        workers.append((user_id, likeable, random.Random(rng.random())))
+
+    db.session.remove()
+    stop_at = time.monotonic() + duration
+
+    def simulate(user_id, likeable, user_rng):
+        client = make_client(user_id)
+        mine = {kind: ([], 0) for kind in kinds}
+
+        while time.monotonic() < stop_at:
+            kind = user_rng.choices(kinds, weights)[0]
+            method, path, kwargs = pick_request(kind, user_ids, likeable, user_rng)
+
+            start = time.perf_counter()
+            status = getattr(client, method)(path, **kwargs)
+            elapsed = time.perf_counter() - start
+
+            latencies, errors = mine[kind]
+            if status < 400:
+                latencies.append(elapsed)
+            else:
+                mine[kind] = (latencies, errors + 1)
+
+        with lock:
+            for kind, (latencies, errors) in mine.items():
+                total, total_errors = results[kind]
+                total.extend(latencies)
+                results[kind] = (total, total_errors + errors)
+
+    threads = [threading.Thread(target=simulate, args=worker) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def summarize(results, duration):
+    """Per-endpoint throughput and latency percentiles (ms)."""
+
+    summary = {}
+    for kind, (latencies, errors) in results.items():
+        cuts = (statistics.quantiles(latencies, n=100)
+                if len(latencies) > 1 else [0] * 99)
+        summary[kind] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': round(len(latencies) / duration, 2),
+            'p50': round(cuts[49] * 1000, 2),
+            'p95': round(cuts[94] * 1000, 2),
+            'p99': round(cuts[98] * 1000, 2),
+        }
+
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """Regressions beyond `tolerance` (a fraction) against `baseline`."""
+
+    problems = []
+    for kind, base in baseline['endpoints'].items():
+        current = summary.get(kind)
+        if current is None:
+            continue
+
+        if current['p95'] > base['p95'] * (1 + tolerance):
+            problems.append(f"{kind}: p95 {current['p95']:.1f}ms vs baseline {base['p95']:.1f}ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            problems.append(f"{kind}: {current['rps']:.1f} req/s vs baseline {base['rps']:.1f} req/s")
+        if current['errors'] > base['errors']:
+            problems.append(f"{kind}: {current['errors']} errors vs baseline {base['errors']}")
+
+    return problems
+
+
+def current_commit():
+    """The checked-out commit, marked dirty if there are local changes,
+    so a baseline says what it measured."""
+
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text):
+    """Parse 'feed=40,post=10' into a mix dictionary."""
+
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown request kind: {kind}")
+        mix[kind] = int(weight)
+
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', action='store_true',
+                        help='drop all tables and load a synthetic dataset first')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages-per-user', type=int, default=20)
+    parser.add_argument('--follows-per-user', type=int, default=50)
+    parser.add_argument('--likes-per-user', type=int, default=20)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='weights, e.g. feed=40,profile=20,search=10,like=20,post=10')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--url', help='load a running server instead of the test client')
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    args = parser.parse_args()
+
+    app = create_app('testing' if args.url is None else 'production')
+    app.app_context().push()
+
+    if args.seed:
+        seed(args.users, args.messages_per_user, args.follows_per_user,
+             args.likes_per_user, random.Random(args.random_seed))
+
+    if args.url is None:
+        make_client = lambda user_id: TestClient(app, user_id)
+    else:
+        make_client = lambda user_id: HttpClient(app, args.url, user_id)
+
+    dataset = {'users': User.query.count(), 'messages': Message.query.count()}
+    results = run(make_client, args.mix, args.concurrency, args.duration, args.random_seed)
+    summary = summarize(results, args.duration)
+
+    print(f"{'endpoint':<8} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for kind, row in summary.items():
+        print(f"{kind:<8} {row['requests']:>6} {row['errors']:>4} {row['rps']:>8.1f} "
+              f"{row['p50']:>6.1f}ms {row['p95']:>6.1f}ms {row['p99']:>6.1f}ms")
+
+    if args.save_baseline:
+        # Before opening the file, which would make the tree look changed
+        commit = current_commit()
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({'commit': commit, **dataset,
+                       'concurrency': args.concurrency, 'duration': args.duration,
+                       'mix': args.mix, 'endpoints': summary},
+                      baseline_file, indent=2)
+            baseline_file.write('\n')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            problems = compare(summary, json.load(baseline_file), args.tolerance)
+
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
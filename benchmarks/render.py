@@ -0,0 +1,143 @@
+"""Micro-benchmark template compilation and rendering.
+
+For each page template this reports:
+
+- compile: parse + compile from source (what a cold worker pays today)
+- cached:  load from a warm FileSystemBytecodeCache
+- render:  median time to render the page with 100 and 1,000 messages
+
+Pages are rendered from in-memory model objects, so no database is needed
+(DATABASE_URL just has to be set). Run from the project root:
+
+    python benchmarks/render.py [--sizes 100 1000] [--runs 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import g, render_template
+from jinja2 import FileSystemBytecodeCache
+
+from app import create_app
+from forms import CSRFProtectForm, MessageForm
+from models import Message, User
+
+PAGES = {
+    'home.html': lambda viewer, author: {
+        'feed': None, 'messages': feed_rows(viewer, author), 'viewer_id': viewer.id},
+    'users/show.html': lambda viewer, author: {
+        'user': author, 'messages': author.messages,
+        'liked_ids': {msg.id for msg in viewer.liked_messages}},
+    'users/likes.html': lambda viewer, author: {
+        'user': viewer, 'messages': [{**snapshot(msg), 'liked': True} for msg in viewer.liked_messages],
+        'page': 1, 'per_page': len(viewer.liked_messages)},
+    'messages/show.html': lambda viewer, author: {
+        'message': snapshot(author.messages[0]), 'liked': True, 'following_ids': {author.id}},
+    'users/index.html': lambda viewer, author: {'users': viewer.following},
+}
+
+
+def fake_data(size):
+    """Viewer following and liking every message of an author with `size` messages."""
+
+    viewer = User(id=1, username='viewer', email='viewer@example.com',
+                  image_url='/static/images/default-pic.png',
+                  header_image_url='/static/images/warbler-hero.jpg')
+    author = User(id=2, username='author', email='author@example.com',
+                  image_url='/static/images/default-pic.png',
+                  header_image_url='/static/images/warbler-hero.jpg')
+
+    author.messages = [
+        Message(id=i, text=f'warble number {i} ' * 5, timestamp=datetime.utcnow(), user=author)
+        for i in range(1, size + 1)
+    ]
+    viewer.following = [author]
+    viewer.liked_messages = author.messages[::2]
+
+    return viewer, author
+
+
+def snapshot(msg):
+    """`msg` as the message_query row that likes and permalink pages get."""
+
+    return {'id': msg.id, 'text': msg.text, 'timestamp': msg.timestamp, 'user_id': msg.user.id,
+            'username': msg.user.username, 'image_url': msg.user.image_url}
+
+
+def feed_rows(viewer, author):
+    """`author`'s messages as the timeline_query rows the home page gets."""
+
+    liked_ids = {msg.id for msg in viewer.liked_messages}
+    return [{**snapshot(msg), 'liked': msg.id in liked_ids} for msg in author.messages]
+
+
+def median_ms(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1000
+
+
+def compile_times(app, name, runs):
+    """(compile from source, load from bytecode cache) medians in ms."""
+
+    source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+    compile_ms = median_ms(lambda: app.jinja_env.compile(source, name), runs)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def load():
+            env = app.jinja_env.overlay(bytecode_cache=FileSystemBytecodeCache(cache_dir))
+            env.cache = None
+            env.get_template(name)
+
+        load()
+        cached_ms = median_ms(load, runs)
+
+    return compile_ms, cached_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+
+    header = f"{'template':<20} {'compile':>9} {'cached':>9}"
+    header += ''.join(f" {f'render@{size}':>12}" for size in args.sizes)
+    print(header)
+
+    for name, context in PAGES.items():
+        compile_ms, cached_ms = compile_times(app, name, args.runs)
+        row = f"{name:<20} {compile_ms:>7.2f}ms {cached_ms:>7.2f}ms"
+
+        for size in args.sizes:
+            viewer, author = fake_data(size)
+
+            with app.test_request_context('/'):
+                g.user = viewer
+                g.csrf_form = CSRFProtectForm()
+                g.message_form = MessageForm()
+
+                render_ms = median_ms(
+                    lambda: render_template(name, **context(viewer, author)), args.runs)
+
+            row += f" {render_ms:>10.2f}ms"
+
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
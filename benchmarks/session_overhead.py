@@ -0,0 +1,128 @@
+"""Benchmark per-request session overhead.
+
+For Flask's signed cookie and for server-side sessions (cached in the
+worker, and loaded from the database every time) this reports:
+
+- cookie:  bytes of session cookie sent with every request
+- read:    median time to open the session on a request that doesn't
+           change it (most requests)
+- write:   median time to open it, flash a message and save it
+
+each for a logged-in session alone and carrying three flashed messages.
+Server-side sessions are stored in DATABASE_URL (tables are created if
+missing). Run from the project root:
+
+    python benchmarks/session_overhead.py [--runs 1000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from flask import flash
+from flask.sessions import SecureCookieSessionInterface
+
+from app import create_app
+from models import db, User
+from sessions import (CURR_USER_KEY, DatabaseSessionStore, ServerSessionInterface,
+                      SessionCache)
+
+FLASHES = [('success', 'Hello, someone!'), ('danger', 'Access unauthorized.'),
+           ('message', 'Logout successful!')]
+
+
+def median_us(func, args):
+    timings = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1_000_000
+
+
+def session_cookie(app, contents):
+    """Save a session holding `contents`; return its cookie value."""
+
+    with app.test_request_context('/') as ctx:
+        session = app.session_interface.open_session(app, ctx.request)
+        session.update(contents)
+        response = app.response_class()
+        app.session_interface.save_session(app, session, response)
+
+    return response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+
+
+def measure(app, contents, runs):
+    """(cookie bytes, read us, write us) for the app's session interface.
+
+    Each write gets its own saved session, since saving a changed
+    server-side session deletes the one it was loaded from.
+    """
+
+    interface = app.session_interface
+    name = app.config['SESSION_COOKIE_NAME']
+    cookies = [session_cookie(app, contents) for _ in range(runs)]
+
+    def read(ctx):
+        interface.open_session(app, ctx.request)
+
+    def write(ctx):
+        ctx.session = interface.open_session(app, ctx.request)
+        flash('Warble posted!')
+        interface.save_session(app, ctx.session, app.response_class())
+
+    def requests(cookies):
+        for cookie in cookies:
+            with app.test_request_context('/', headers={'Cookie': f"{name}={cookie}"}) as ctx:
+                yield ctx
+
+    read_us = median_us(read, requests(cookies[:1] * runs))
+    write_us = median_us(write, requests(cookies))
+
+    return len(cookies[0]), read_us, write_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User.query.first() or User.signup('bench', 'bench@example.com', 'password', None)
+        db.session.commit()
+        user_id = user.id
+
+    backends = {
+        'signed cookie': SecureCookieSessionInterface(),
+        'server, cached': ServerSessionInterface(
+            DatabaseSessionStore(), SessionCache(max_size=10_000, max_age=30)),
+        'server, uncached': ServerSessionInterface(
+            DatabaseSessionStore(), SessionCache(max_size=0, max_age=0)),
+    }
+    sessions = {
+        'logged in': {CURR_USER_KEY: user_id},
+        '+3 flashes': {CURR_USER_KEY: user_id, '_flashes': FLASHES},
+    }
+
+    print(f"{'backend':<18} {'session':<11} {'cookie':>7} {'read':>9} {'write':>9}")
+
+    for backend, interface in backends.items():
+        app.session_interface = interface
+
+        with app.app_context():
+            for name, contents in sessions.items():
+                size, read_us, write_us = measure(app, contents, args.runs)
+                print(f"{backend:<18} {name:<11} {size:>6}B {read_us:>7.1f}us {write_us:>7.1f}us")
+
+
+if __name__ == '__main__':
+    main()
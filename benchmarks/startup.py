@@ -0,0 +1,82 @@
+"""Measure cold-start cost of each config profile.
+
+For every profile this spawns a fresh interpreter (so nothing is cached in
+sys.modules) and records:
+
+- import time of the app module
+- time spent in create_app()
+- latency of the first request to the anonymous homepage
+
+Run from the project root:
+
+    python benchmarks/startup.py [--runs 5] [profile ...]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config import CONFIGS
+
+# Runs inside the child interpreter; prints one JSON line of timings (ms)
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app as warbler
+imported = time.perf_counter()
+flask_app = warbler.create_app(sys.argv[1])
+created = time.perf_counter()
+resp = flask_app.test_client().get("/")
+served = time.perf_counter()
+assert resp.status_code == 200, resp.status_code
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "toolbar_loaded": "flask_debugtoolbar" in sys.modules,
+}))
+'''
+
+
+def probe(profile):
+    """Start a fresh interpreter for `profile` and return its timings."""
+
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE, profile],
+        cwd=PROJECT_ROOT,
+        env={**os.environ, 'WARBLER_SQL_ECHO': '0'},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('profiles', nargs='*', default=list(CONFIGS))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12} {'import':>9} {'create':>9} {'1st req':>9} {'total':>9}  toolbar")
+    for profile in args.profiles:
+        runs = [probe(profile) for _ in range(args.runs)]
+        medians = {
+            key: statistics.median(run[key] for run in runs)
+            for key in ('import_ms', 'create_app_ms', 'first_request_ms')
+        }
+        total = sum(medians.values())
+        print(f"{profile:<12} {medians['import_ms']:>7.1f}ms "
+              f"{medians['create_app_ms']:>7.1f}ms "
+              f"{medians['first_request_ms']:>7.1f}ms "
+              f"{total:>7.1f}ms  {runs[0]['toolbar_loaded']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Compressed HTML and JSON responses.
+
+Responses of a type in COMPRESS_MIMETYPES are compressed with brotli (if
+the brotli package is installed) or gzip, whichever the client prefers.
+Buffered responses under COMPRESS_MIN_SIZE bytes are sent as they are,
+since the savings wouldn't cover the encoding header and CPU.
+
+Streamed pages are compressed as they stream. The encoder is flushed each
+time COMPRESS_STREAM_FLUSH bytes have gone in, so the browser still gets
+the top of the page while the timeline query runs, without flushing so
+often that every small template chunk costs compression ratio.
+
+Already encoded responses, files (e.g. built assets, which are
+precompressed) and Server-Sent Events pass through untouched.
+"""
+
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts both equally
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+class Encoder:
+    """Incremental brotli or gzip compression."""
+
+    def __init__(self, encoding, config):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        else:
+            # wbits 31: deflate with a gzip header and trailer
+            self.compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, decodable by the client now."""
+
+        if self.encoding == 'br':
+            return self.compressor.flush()
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+def negotiate(accept_encodings):
+    """The best encoding we offer from a werkzeug Accept, or None."""
+
+    qualities = [(accept_encodings[encoding], -rank, encoding)
+                 for rank, encoding in enumerate(ENCODINGS)]
+    quality, _, encoding = max(qualities)
+
+    return encoding if quality > 0 else None
+
+
+def compress(data, encoding, config):
+    """`data` compressed in one go."""
+
+    encoder = Encoder(encoding, config)
+    return encoder.compress(data) + encoder.finish()
+
+
+def compress_stream(chunks, encoder, flush_every):
+    """Compress an iterable of bytes, flushing every `flush_every` bytes in."""
+
+    # Templates stream many tiny chunks, so compress them in batches
+    batch = []
+    pending = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        pending += len(chunk)
+
+        if pending >= flush_every:
+            yield encoder.compress(b''.join(batch)) + encoder.flush()
+            batch = []
+            pending = 0
+
+    yield encoder.compress(b''.join(batch)) + encoder.finish()
+
+
+def compressible(response, config):
+    return (response.mimetype in config['COMPRESS_MIMETYPES']
+            and 200 <= response.status_code < 300
+            and response.status_code != 204
+            and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and not response.cache_control.no_transform)
+
+
+def init_compression(app):
+    """Compress responses after every request, if enabled."""
+
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
+
+
+def compress_response(response):
+    """after_request hook: compress the response if worthwhile."""
+
+    config = current_app.config
+    if not compressible(response, config):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        original = response.response
+        response.response = compress_stream(
+            response.iter_encoded(), Encoder(encoding, config), config['COMPRESS_STREAM_FLUSH'])
+        response.headers.pop('Content-Length', None)
+        # The server now closes our generator, so pass that on
+        if hasattr(original, 'close'):
+            response.call_on_close(original.close)
+
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, config))
+
+    response.content_encoding = encoding
+
+    # The compressed body is a different representation of the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
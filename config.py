@@ -0,0 +1,204 @@
+"""Configuration profiles for Warbler.
+
+Pick a profile with the WARBLER_CONFIG environment variable
+(development, testing or production) or pass its name to `create_app`.
+"""
+
+import os
+import tempfile
+
+# Threads per gunicorn worker (see gunicorn.conf.py)
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 32))
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    # Dev-only extensions stay unloaded unless a profile turns them on
+    DEBUG_TB_ENABLED = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    WTF_CSRF_ENABLED = True
+
+    # bcrypt work factor for new password hashes (each step doubles it)
+    BCRYPT_LOG_ROUNDS = 12
+
+    # Compiled template bytecode is cached here when set, and every template
+    # is compiled at startup when JINJA_PRECOMPILE is on
+    JINJA_CACHE_DIR = None
+    JINJA_PRECOMPILE = False
+
+    # Rows fetched per server-side cursor round trip on streamed timelines
+    TIMELINE_YIELD_PER = 50
+
+    # Home feeds rendered in the background after login and posting (see
+    # timelines.py): at most WORKERS at once plus QUEUE waiting, each kept
+    # for SECONDS
+    TIMELINE_WARM_ENABLED = True
+    TIMELINE_WARM_WORKERS = 2
+    TIMELINE_WARM_QUEUE = 50
+    TIMELINE_WARM_SECONDS = 30
+
+    # Usernames allowed to download data exports (comma-separated env var)
+    ADMIN_USERNAMES = set(filter(None, os.environ.get('WARBLER_ADMINS', '').split(',')))
+
+    # Most messages accepted by one POST /api/messages/bulk
+    BULK_MESSAGES_MAX = 1000
+
+    # POST /api/messages/delete deletes this many messages per transaction,
+    # and at most MESSAGE_DELETE_MAX per request
+    MESSAGE_DELETE_CHUNK = 500
+    MESSAGE_DELETE_MAX = 10_000
+
+    # In-memory follow graph (see graph.py); each worker rebuilds its copy
+    # from the database once it is older than FOLLOW_GRAPH_MAX_AGE seconds
+    FOLLOW_GRAPH_ENABLED = os.environ.get('WARBLER_FOLLOW_GRAPH') == '1'
+    FOLLOW_GRAPH_MAX_AGE = 300
+
+    # "Who to follow": candidates stored per user by `flask recommend`, and
+    # how many of them the home page shows
+    RECOMMENDATIONS_TOP_K = 20
+    RECOMMENDATIONS_SHOWN = 5
+
+    # Message search results, and a user's likes, per page
+    SEARCH_PAGE_SIZE = 20
+    LIKES_PAGE_SIZE = 20
+
+    # Users per page of /api/users by default, and the most a 'limit'
+    # param can ask for
+    USERS_PAGE_SIZE = 50
+    USERS_PAGE_MAX = 200
+
+    # Trending messages: window name -> half-life in seconds of like scores
+    # (the first is the default), messages shown, scores kept per window,
+    # and how often each worker merges its likes with the others'
+    TRENDING_WINDOWS = {'hour': 3600, 'day': 86400}
+    TRENDING_SIZE = 50
+    TRENDING_CAPACITY = 1000
+    TRENDING_CHECKPOINT_SECONDS = 30
+
+    # Token buckets per client for write endpoints: (burst, seconds to refill),
+    # shared by all workers in the database ('ratelimit.InProcessStorage'
+    # keeps them per worker)
+    RATELIMIT_ENABLED = os.environ.get('WARBLER_RATELIMIT', '1') != '0'
+    RATELIMIT_BACKEND = 'ratelimit.DatabaseStorage'
+    RATELIMIT_MAX_KEYS = 100_000
+    RATELIMIT_POLICIES = {
+        'warbler.add_message': (10, 60),
+        'warbler.add_messages_bulk': (5, 60),
+        'warbler.delete_messages_bulk': (5, 60),
+        'warbler.handle_like': (60, 60),
+        'warbler.handle_likes': (60, 60),
+        'warbler.start_following': (30, 60),
+        'warbler.login': (5, 60),
+    }
+
+    # Shed those endpoints with a 503 while the average wait for a pooled
+    # DB connection is over this many seconds (None to never shed)
+    LOAD_SHED_POOL_WAIT = 0.5
+    LOAD_SHED_RETRY_AFTER = 5
+
+    # Server-side sessions (see sessions.py): the store's import path, or
+    # None for Flask's signed cookie; each worker caches loaded sessions
+    SESSION_BACKEND = 'sessions.DatabaseSessionStore'
+    SESSION_CACHE_SIZE = 10_000
+    SESSION_CACHE_SECONDS = 30
+
+    # Message snapshots cached per worker for permalinks and
+    # /api/messages/<id> (see permalinks.py); the TTL bounds how long other
+    # workers show a deleted message or an author's old name
+    PERMALINK_CACHE_SIZE = 10_000
+    PERMALINK_CACHE_SECONDS = 10
+
+    # Columnar activity snapshots for reports (see analytics.py; default:
+    # analytics/ in the instance folder)
+    ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR')
+
+    # Avatars and header images resized by the image proxy (see images.py):
+    # variant -> (width, height), sized for 2x displays
+    IMAGES_ENABLED = True
+    IMAGE_VARIANTS = {
+        'thumb': (144, 144),
+        'avatar': (400, 400),
+        'header': (1500, 500),
+    }
+    IMAGE_CACHE_DIR = os.environ.get(
+        'IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'warbler-images'))
+    IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # Uploaded originals (default: uploads/ in the instance folder)
+    IMAGE_UPLOAD_DIR = os.environ.get('IMAGE_UPLOAD_DIR')
+    IMAGE_MAX_BYTES = 5 * 1024 * 1024
+    IMAGE_WORKERS = 4
+    IMAGE_FETCH_TIMEOUT = 5
+    # Wait before retrying a source that couldn't be fetched or decoded
+    IMAGE_RETRY_SECONDS = 300
+    # Failed sources remembered per worker (the oldest are forgotten first)
+    IMAGE_FAILED_MAX = 10_000
+    IMAGE_MAX_AGE = 30 * 86400
+
+    # Compress responses of these types (see compression.py) that are at
+    # least COMPRESS_MIN_SIZE bytes; streamed pages are flushed to the client
+    # every COMPRESS_STREAM_FLUSH bytes of page
+    COMPRESS_ENABLED = True
+    COMPRESS_MIMETYPES = {'text/html', 'application/json'}
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    COMPRESS_STREAM_FLUSH = 4096
+
+    # Link to and serve the fingerprinted build from `flask build-assets`
+    # (see assets.py), cached by browsers for ASSET_MAX_AGE seconds
+    ASSET_MANIFEST = False
+    ASSET_MAX_AGE = 365 * 86400
+
+    # Realtime feed (Server-Sent Events); caps are per worker process. Under
+    # gunicorn each open stream holds one of the worker's WEB_THREADS
+    # threads, so half are kept for pages; under asgi.py streams wait on
+    # the event loop and the ASYNC cap applies
+    PUBSUB_BACKEND = 'pubsub.InProcessBroker'
+    SSE_MAX_CONNECTIONS = WEB_THREADS // 2
+    SSE_MAX_CONNECTIONS_ASYNC = 1000
+    SSE_MAX_PER_USER = 5
+    SSE_QUEUE_SIZE = 100
+    SSE_HEARTBEAT_SECONDS = 15
+
+
+class DevelopmentConfig(Config):
+    """Local development: debug toolbar and optional SQL echo."""
+
+    DEBUG = True
+    DEBUG_TB_ENABLED = True
+    SQLALCHEMY_ECHO = os.environ.get('WARBLER_SQL_ECHO') == '1'
+
+
+class TestingConfig(Config):
+    """Test runs: no toolbar, no CSRF (it's a pain to test)."""
+
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    # The lowest bcrypt allows; at 12 hashing users dominates the suite
+    BCRYPT_LOG_ROUNDS = 4
+    FOLLOW_GRAPH_ENABLED = False
+    RATELIMIT_ENABLED = False
+    TIMELINE_WARM_ENABLED = False
+
+
+class ProductionConfig(Config):
+    """Deployed workers: templates compiled up front and cached on disk."""
+
+    JINJA_CACHE_DIR = os.environ.get(
+        'JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'warbler-jinja'))
+    JINJA_PRECOMPILE = True
+    ASSET_MANIFEST = True
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+DEFAULT_CONFIG = 'development'
@@ -0,0 +1,53 @@
+"""pytest setup: a test database of its own for each pytest-xdist worker.
+
+Test modules drop and recreate every table in the test database when
+they're imported, so two processes sharing one would wipe each other's
+data. Under `pytest -n <workers>`, each worker runs against
+warbler_test_<worker id> (warbler_test_gw0, warbler_test_gw1, ...),
+created on first use and reused by later runs. A plain run (or unittest)
+keeps using warbler_test.
+
+Tests commit for real rather than running inside a rolled-back
+transaction, because several features read the database over connections
+other than the test's session: the session store (its own engine
+connections), the ASGI API (asyncpg), and feed warm-ups and follow graph
+rebuilds (background threads with their own sessions). None of them would
+see a test's uncommitted rows. The load shedding and fork safety tests
+also measure real pool checkouts. Tests stay on Postgres, not SQLite,
+because trending and recommendations upsert with PostgreSQL's INSERT ...
+ON CONFLICT.
+"""
+
+import os
+
+from sqlalchemy import create_engine, text
+
+TEST_DATABASE = 'warbler_test'
+
+# Any database on the server will do for CREATE DATABASE
+MAINTENANCE_URL = 'postgresql:///postgres'
+
+
+def pytest_configure(config):
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker is None:
+        return
+
+    name = f"{TEST_DATABASE}_{worker}"
+    create_database(name)
+    os.environ['WARBLER_TEST_DATABASE_URL'] = f"postgresql:///{name}"
+
+
+def create_database(name):
+    """Create database `name` unless it already exists."""
+
+    engine = create_engine(MAINTENANCE_URL, isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"), {'name': name}
+            ).scalar()
+            if not exists:
+                conn.execute(text(f'CREATE DATABASE "{name}"'))
+    finally:
+        engine.dispose()
@@ -0,0 +1,14 @@
+"""Local file helpers shared by the image cache and analytics snapshots."""
+
+import os
+import tempfile
+
+
+def write_file(path, data):
+    """Write `data` to `path` atomically."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+    os.replace(tmp, path)
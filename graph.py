@@ -0,0 +1,431 @@
+"""Compact in-memory index of who follows whom.
+
+Edges from the follows table are packed into CSR (compressed sparse row)
+form: for each direction, one int array of neighbour ids sorted per user and
+one array of offsets indexed by user id. That is about 8 bytes per follow
+for both directions, and lookups are a bisect or a slice.
+
+Follows and unfollows made through this process are applied to small
+overlay sets and folded back into the arrays once they grow. Each worker
+keeps its own index and rebuilds it from the database on a background
+thread when it is older than FOLLOW_GRAPH_MAX_AGE seconds, which bounds
+staleness from other workers; requests use the old index until the new
+one is swapped in.
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+
+from flask import current_app, g
+from sqlalchemy import func, select
+
+from models import db, Follows, User
+
+# Overlay size (as a share of all edges) that triggers folding it back in
+COMPACT_RATIO = 0.1
+COMPACT_MIN = 1000
+
+
+class CSR:
+    """Sorted adjacency lists packed into two int arrays."""
+
+    def __init__(self, edges):
+        """Build from distinct (source, target) pairs."""
+
+        # Sorting packed ints is much faster than sorting tuples
+        keys = sorted([source << 32 | target for source, target in edges])
+        size = (keys[-1] >> 32) + 2 if keys else 1
+
+        counts = [0] * size
+        for key in keys:
+            counts[(key >> 32) + 1] += 1
+
+        self.offsets = array('i', accumulate(counts))
+        self.targets = array('i', [key & 0xFFFFFFFF for key in keys])
+
+    def bounds(self, node):
+        if node + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def row(self, node):
+        start, end = self.bounds(node)
+        return self.targets[start:end]
+
+    def degree(self, node):
+        start, end = self.bounds(node)
+        return end - start
+
+    def contains(self, node, target):
+        start, end = self.bounds(node)
+        i = bisect_left(self.targets, target, start, end)
+        return i < end and self.targets[i] == target
+
+    def edges(self):
+        for node in range(len(self.offsets) - 1):
+            for target in self.row(node):
+                yield node, target
+
+    @property
+    def nbytes(self):
+        return (len(self.offsets) * self.offsets.itemsize
+                + len(self.targets) * self.targets.itemsize)
+
+
+class Adjacency:
+    """One direction of the graph: CSR arrays plus added/removed overlays."""
+
+    def __init__(self, edges):
+        self.csr = CSR(edges)
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.pending = 0
+
+    def __len__(self):
+        return (len(self.csr.targets)
+                + sum(map(len, self.added.values()))
+                - sum(map(len, self.removed.values())))
+
+    def contains(self, node, target):
+        if target in self.added.get(node, ()):
+            return True
+        if target in self.removed.get(node, ()):
+            return False
+        return self.csr.contains(node, target)
+
+    def neighbours(self, node):
+        found = set(self.csr.row(node))
+        found -= self.removed.get(node, set())
+        found |= self.added.get(node, set())
+        return found
+
+    def degree(self, node):
+        return (self.csr.degree(node)
+                + len(self.added.get(node, ()))
+                - len(self.removed.get(node, ())))
+
+    def add(self, node, target):
+        if target in self.removed.get(node, ()):
+            self.removed[node].discard(target)
+            self.pending -= 1
+        elif not self.csr.contains(node, target):
+            self.added[node].add(target)
+            self.pending += 1
+
+    def remove(self, node, target):
+        if target in self.added.get(node, ()):
+            self.added[node].discard(target)
+            self.pending -= 1
+        elif self.csr.contains(node, target):
+            self.removed[node].add(target)
+            self.pending += 1
+
+    def edges(self):
+        for node, target in self.csr.edges():
+            if target not in self.removed.get(node, ()):
+                yield node, target
+        for node, targets in self.added.items():
+            for target in targets:
+                yield node, target
+
+
+class FollowGraph:
+    """Follow relationships between user ids, both directions.
+
+    Reads and writes take the same lock, since writes change the overlay
+    sets and compaction replaces both directions.
+    """
+
+    def __init__(self, follows=()):
+        """Build from (follower id, followed id) pairs."""
+
+        follows = list(follows)
+        self.lock = threading.Lock()
+        self.following = Adjacency(follows)
+        self.followers = Adjacency((followed, follower) for follower, followed in follows)
+        self.built_at = time.monotonic()
+
+        # Follows and unfollows made while a replacement is being loaded,
+        # replayed onto it once loaded; None when not rebuilding. Changes
+        # made after that, through a stale reference, go to the successor.
+        self.changes = None
+        self.successor = None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.following)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the packed arrays (the overlays are extra)."""
+
+        with self.lock:
+            return self.following.csr.nbytes + self.followers.csr.nbytes
+
+    def is_following(self, follower_id, followed_id):
+        with self.lock:
+            return self.following.contains(follower_id, followed_id)
+
+    def following_ids(self, user_id):
+        with self.lock:
+            return self.following.neighbours(user_id)
+
+    def follower_ids(self, user_id):
+        with self.lock:
+            return self.followers.neighbours(user_id)
+
+    def following_count(self, user_id):
+        with self.lock:
+            return self.following.degree(user_id)
+
+    def follower_count(self, user_id):
+        with self.lock:
+            return self.followers.degree(user_id)
+
+    def mutual_ids(self, user_id):
+        """Users that `user_id` follows and who follow them back."""
+
+        with self.lock:
+            return self.following.neighbours(user_id) & self.followers.neighbours(user_id)
+
+    def followed_by_followees(self, viewer_id, user_id):
+        """Users that `viewer_id` follows who also follow `user_id`."""
+
+        with self.lock:
+            return self.following.neighbours(viewer_id) & self.followers.neighbours(user_id)
+
+    def follow(self, follower_id, followed_id):
+        with self.lock:
+            if self.successor is None:
+                self._apply(True, follower_id, followed_id)
+                return
+        self.successor.follow(follower_id, followed_id)
+
+    def unfollow(self, follower_id, followed_id):
+        with self.lock:
+            if self.successor is None:
+                self._apply(False, follower_id, followed_id)
+                return
+        self.successor.unfollow(follower_id, followed_id)
+
+    def remove_user(self, user_id):
+        """Drop every edge touching `user_id` (the user was deleted)."""
+
+        with self.lock:
+            if self.successor is None:
+                for followed_id in self.following.neighbours(user_id):
+                    self._apply(False, user_id, followed_id)
+                for follower_id in self.followers.neighbours(user_id):
+                    self._apply(False, follower_id, user_id)
+                return
+        self.successor.remove_user(user_id)
+
+    def _apply(self, followed, follower_id, followed_id):
+        """Add (or remove) one edge; the caller holds the lock."""
+
+        if followed:
+            self.following.add(follower_id, followed_id)
+            self.followers.add(followed_id, follower_id)
+        else:
+            self.following.remove(follower_id, followed_id)
+            self.followers.remove(followed_id, follower_id)
+
+        if self.changes is not None:
+            self.changes.append((followed, follower_id, followed_id))
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Fold the overlays back into fresh arrays once they grow large."""
+
+        pending = self.following.pending
+        if pending < max(COMPACT_MIN, COMPACT_RATIO * len(self.following.csr.targets)):
+            return
+
+        follows = list(self.following.edges())
+        self.following = Adjacency(follows)
+        self.followers = Adjacency((followed, follower) for follower, followed in follows)
+
+    def start_rebuild(self):
+        """Claim the rebuild of this graph; False if one is under way."""
+
+        with self.lock:
+            if self.changes is not None:
+                return False
+            self.changes = []
+            return True
+
+    def replace(self, graph):
+        """Replay changes made since the rebuild started onto `graph`, and
+        send later ones there too."""
+
+        with self.lock, graph.lock:
+            for followed, follower_id, followed_id in self.changes:
+                graph._apply(followed, follower_id, followed_id)
+            self.changes = None
+            self.successor = graph
+
+    def abandon_rebuild(self):
+        with self.lock:
+            self.changes = None
+
+
+def load_follow_graph():
+    """Build a FollowGraph from the follows table."""
+
+    rows = db.session.query(Follows.user_following_id, Follows.user_being_followed_id)
+    return FollowGraph(rows.yield_per(10000))
+
+
+def init_follow_graph(app):
+    """Register the follow template helpers on `app`, and enable the index
+    if FOLLOW_GRAPH_ENABLED (it is built on first use)."""
+
+    if app.config['FOLLOW_GRAPH_ENABLED']:
+        app.extensions['follow_graph'] = None
+
+    app.add_template_global(follow_counts)
+    app.add_template_global(viewer_follows)
+    app.add_template_global(known_followers)
+
+
+def get_follow_graph():
+    """The current app's FollowGraph, or None when the index is disabled.
+
+    The first call in a worker builds the index (once, under a lock). Once
+    it is older than FOLLOW_GRAPH_MAX_AGE, one background thread rebuilds
+    it while requests keep using the old one.
+    """
+
+    app = current_app._get_current_object()
+    extensions = app.extensions
+    if 'follow_graph' not in extensions:
+        return None
+
+    graph = extensions['follow_graph']
+    if graph is None:
+        with extensions.setdefault('follow_graph_lock', threading.Lock()):
+            graph = extensions['follow_graph']
+            if graph is None:
+                graph = extensions['follow_graph'] = load_follow_graph()
+        return graph
+
+    max_age = app.config['FOLLOW_GRAPH_MAX_AGE']
+    if time.monotonic() - graph.built_at > max_age and graph.start_rebuild():
+        threading.Thread(target=rebuild_follow_graph, args=(app, graph),
+                         name='follow-graph', daemon=True).start()
+
+    return graph
+
+
+def rebuild_follow_graph(app, old):
+    """Load a fresh index for `app` and swap it in for `old`."""
+
+    with app.app_context():
+        try:
+            graph = load_follow_graph()
+        except Exception:
+            app.logger.exception("Couldn't rebuild the follow graph")
+            old.abandon_rebuild()
+            return
+        finally:
+            db.session.remove()
+
+    old.replace(graph)
+    app.extensions['follow_graph'] = graph
+
+
+def built_follow_graph():
+    """The current app's FollowGraph if it has been built, else None."""
+
+    return current_app.extensions.get('follow_graph')
+
+
+def record_follow(follower_id, followed_id):
+    """Apply a committed follow to this worker's index."""
+
+    graph = built_follow_graph()
+    if graph is not None:
+        graph.follow(follower_id, followed_id)
+
+
+def record_unfollow(follower_id, followed_id):
+    """Apply a committed unfollow to this worker's index."""
+
+    graph = built_follow_graph()
+    if graph is not None:
+        graph.unfollow(follower_id, followed_id)
+
+
+def record_user_deleted(user_id):
+    """Drop a deleted user's follows from this worker's index."""
+
+    graph = built_follow_graph()
+    if graph is not None:
+        graph.remove_user(user_id)
+
+
+##############################################################################
+# Lookups used by views and templates: answered from the index when it is
+# enabled, from the database otherwise.
+
+def following_ids(user_id):
+    """Ids of the users `user_id` follows."""
+
+    graph = get_follow_graph()
+    if graph is not None:
+        return graph.following_ids(user_id)
+
+    return {followed_id for (followed_id,) in db.session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id)}
+
+
+def follow_counts(user):
+    """(following, followers) counts for `user`."""
+
+    graph = get_follow_graph()
+    if graph is not None:
+        return graph.following_count(user.id), graph.follower_count(user.id)
+
+    following = (select(func.count())
+                 .where(Follows.user_following_id == user.id)
+                 .scalar_subquery())
+    followers = (select(func.count())
+                 .where(Follows.user_being_followed_id == user.id)
+                 .scalar_subquery())
+
+    return tuple(db.session.execute(select(following, followers)).one())
+
+
+def viewer_follows(user):
+    """Is the logged-in user following `user`?"""
+
+    graph = get_follow_graph()
+    if graph is not None:
+        return graph.is_following(g.user.id, user.id)
+
+    return g.user.is_following(user)
+
+
+def known_followers(user, limit=3):
+    """Up to `limit` followers of `user` that the logged-in user follows."""
+
+    graph = get_follow_graph()
+    if graph is not None:
+        ids = sorted(graph.followed_by_followees(g.user.id, user.id))[:limit]
+        if not ids:
+            return []
+        query = User.query.filter(User.id.in_(ids))
+    else:
+        followees = (select(Follows.user_being_followed_id)
+                     .where(Follows.user_following_id == g.user.id))
+        query = (User.query
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user.id,
+                         User.id.in_(followees)))
+
+    return query.order_by(User.id).limit(limit).all()
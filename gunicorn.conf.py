@@ -0,0 +1,23 @@
+"""Gunicorn settings for Warbler.
+
+The app is preloaded in the master so workers fork with the code already
+imported; connect_db() gives each forked worker its own connection pool.
+
+Workers are threaded (gthread): the realtime feed keeps a request open for
+as long as a tab is, which would tie up a whole sync worker and get it
+killed at the timeout. A gthread worker stays alive while its threads
+wait, and holds up to WEB_THREADS requests at once; SSE_MAX_CONNECTIONS
+leaves half of those for pages.
+"""
+
+import multiprocessing
+import os
+
+from config import WEB_THREADS
+
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = WEB_THREADS
+preload_app = True
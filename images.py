@@ -0,0 +1,387 @@
+"""Resized, locally cached avatars and header images.
+
+Templates pass image URLs through the `image` filter, which rewrites them
+to /images/<variant>/<token>, where the token is the signed source URL
+(so the proxy only fetches URLs this app rendered). The first request for
+a source fetches it once (from the web, static/ or uploads), resizes it
+to every size in IMAGE_VARIANTS on a worker pool, and caches the results.
+Later requests are served from the cache with a long Cache-Control.
+While a source can't be fetched or decoded, its URL redirects to the
+original.
+
+The cache is content-addressed: variants are stored under the SHA-256 of
+the source image's bytes, so the same picture behind different URLs is
+resized and stored once. A small ref file maps each source URL to that
+digest. Once the cache outgrows IMAGE_CACHE_MAX_BYTES, the least
+recently used files are evicted (they're just made again when next
+needed). Uploaded originals live in IMAGE_UPLOAD_DIR, which isn't evicted.
+
+Resizing needs Pillow. Without it (or with IMAGES_ENABLED off), the
+filter leaves URLs alone and uploads are served as uploaded.
+"""
+
+import hashlib
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.client import HTTPConnection, HTTPSConnection
+from importlib.util import find_spec
+from io import BytesIO
+from urllib.parse import urlparse
+from urllib.request import (HTTPHandler, HTTPRedirectHandler, HTTPSHandler, Request,
+                            build_opener)
+
+from flask import abort, current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.security import safe_join
+
+from files import write_file
+
+UPLOADS_PATH = '/images/uploads/'
+
+# Don't touch a cached file's mtime (for LRU eviction) more often than this
+TOUCH_SECONDS = 3600
+
+
+class ImageCache:
+    """Resized variants on disk, keyed by the digest of their source."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def ref_path(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+        return os.path.join(self.directory, 'refs', key[:2], key)
+
+    def path(self, digest, variant):
+        return os.path.join(self.directory, digest[:2], f"{digest}.{variant}.jpg")
+
+    def lookup(self, source, variant):
+        """Path of the cached `variant` of `source`, or None."""
+
+        try:
+            with open(self.ref_path(source)) as ref:
+                path = self.path(ref.read(), variant)
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        if time.time() - stat.st_mtime > TOUCH_SECONDS:
+            os.utime(path)
+
+        return path
+
+    def has(self, digest, variants):
+        return all(os.path.exists(self.path(digest, variant)) for variant in variants)
+
+    def store(self, source, digest, variants):
+        """Cache `variants` (name -> JPEG bytes) of `source`'s image."""
+
+        for variant, data in variants.items():
+            write_file(self.path(digest, variant), data)
+        write_file(self.ref_path(source), digest.encode())
+
+        # Scanning the whole cache is slow, so only check its size every
+        # tenth of its budget written
+        with self.lock:
+            self.written += sum(len(data) for data in variants.values())
+            full = self.written > self.max_bytes / 10
+            if full:
+                self.written = 0
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used files until under budget."""
+
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class PublicRedirectHandler(HTTPRedirectHandler):
+    """Follows redirects only to http(s) URLs."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def check_public(url):
+    """Raise ValueError unless `url` is http(s) with a host.
+
+    Its addresses are checked as it's connected to (see public_connection).
+    """
+
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError(f"Not an http(s) URL: {url}")
+
+
+def public_connection(address, timeout, source_address=None):
+    """socket.create_connection, but only to public addresses.
+
+    Connects to the addresses it checked, rather than resolving the host
+    again, so DNS can't answer differently in between (DNS rebinding). Keeps
+    profile image URLs from reaching the server's own network.
+    """
+
+    host, port = address
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    for ip in addresses:
+        if not ipaddress.ip_address(ip).is_global:
+            raise ValueError(f"Not a public address: {host}")
+
+    error = None
+    for ip in addresses:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as exc:
+            error = exc
+    raise error
+
+
+class PublicHTTPConnection(HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPSConnection(HTTPSConnection):
+    # TLS still checks the certificate against the host name
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def __init__(self):
+        self.context = ssl.create_default_context()
+        super().__init__(context=self.context)
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self.context)
+
+
+def render_variants(data, sizes):
+    """`data` cropped and resized to each of `sizes` (name -> (w, h)), as JPEGs."""
+
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        variants = {}
+        for name, size in sizes.items():
+            out = BytesIO()
+            resized = ImageOps.fit(image, size, Image.LANCZOS)
+            resized.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+            variants[name] = out.getvalue()
+
+    return variants
+
+
+class ImagePipeline:
+    """Fetches, resizes and caches images on a pool of worker threads."""
+
+    def __init__(self, app):
+        config = app.config
+        self.sizes = config['IMAGE_VARIANTS']
+        self.cache = ImageCache(config['IMAGE_CACHE_DIR'], config['IMAGE_CACHE_MAX_BYTES'])
+        self.upload_dir = config['IMAGE_UPLOAD_DIR'] or os.path.join(app.instance_path, 'uploads')
+        self.static_folder = app.static_folder
+        self.workers = config['IMAGE_WORKERS']
+        self.timeout = config['IMAGE_FETCH_TIMEOUT']
+        self.max_bytes = config['IMAGE_MAX_BYTES']
+        self.retry_seconds = config['IMAGE_RETRY_SECONDS']
+        self.max_failed = config['IMAGE_FAILED_MAX']
+        self.enabled = config['IMAGES_ENABLED'] and find_spec('PIL') is not None
+
+        serializer = URLSafeSerializer(app.secret_key, salt='images')
+        self.token = lru_cache(maxsize=10_000)(serializer.dumps)
+        self.source = serializer.loads
+
+        self.opener = build_opener(PublicHTTPHandler, PublicHTTPSHandler, PublicRedirectHandler)
+        self.lock = threading.Lock()
+        self.pending = {}
+        # Source -> when it last failed, oldest first
+        self.failed = OrderedDict()
+        self.executor = None
+        self.pid = None
+
+    def url(self, source, variant):
+        """Where templates should load `variant` of the image at `source`."""
+
+        if not self.enabled or not source:
+            return source
+        return f"/images/{variant}/{self.token(source)}"
+
+    def fetch(self, source):
+        """The bytes of the image at `source`."""
+
+        if source.startswith('/static/'):
+            path = safe_join(self.static_folder, source[len('/static/'):])
+        elif source.startswith(UPLOADS_PATH):
+            path = safe_join(self.upload_dir, source[len(UPLOADS_PATH):])
+        else:
+            check_public(source)
+            request = Request(source, headers={'User-Agent': 'Warbler image proxy'})
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = response.read(self.max_bytes + 1)
+            if len(data) > self.max_bytes:
+                raise ValueError(f"Image too large: {source}")
+            return data
+
+        if path is None:
+            raise ValueError(f"Not a local image: {source}")
+        with open(path, 'rb') as file:
+            return file.read(self.max_bytes)
+
+    def process(self, source):
+        """Fetch `source` and cache every variant of it."""
+
+        data = self.fetch(source)
+        digest = hashlib.sha256(data).hexdigest()
+
+        variants = {}
+        if not self.cache.has(digest, self.sizes):
+            variants = render_variants(data, self.sizes)
+        self.cache.store(source, digest, variants)
+
+    def submit(self, source):
+        """A future for processing `source`, shared by concurrent requests."""
+
+        with self.lock:
+            # Threads don't survive a fork, so each worker makes its own pool
+            if self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='images')
+                self.pending = {}
+                self.pid = os.getpid()
+
+            future = self.pending.get(source)
+            started = future is None
+            if started:
+                future = self.pending[source] = self.executor.submit(self.process, source)
+
+        if started:
+            future.add_done_callback(lambda _: self.finished(source))
+
+        return future
+
+    def finished(self, source):
+        with self.lock:
+            self.pending.pop(source, None)
+
+    def get(self, source, variant):
+        """Path of `variant` of `source`, processing it if needed; None if
+        it can't be processed (or failed within IMAGE_RETRY_SECONDS)."""
+
+        path = self.cache.lookup(source, variant)
+        if path is not None:
+            return path
+
+        if self.recently_failed(source):
+            return None
+
+        try:
+            self.submit(source).result(self.timeout * 2)
+        except Exception:
+            current_app.logger.info("Couldn't process image %s", source, exc_info=True)
+            self.record_failure(source)
+            return None
+
+        return self.cache.lookup(source, variant)
+
+    def recently_failed(self, source):
+        """Did `source` fail within IMAGE_RETRY_SECONDS?"""
+
+        with self.lock:
+            failed_at = self.failed.get(source)
+            if failed_at is None:
+                return False
+            if time.monotonic() - failed_at < self.retry_seconds:
+                return True
+            del self.failed[source]
+            return False
+
+    def record_failure(self, source):
+        """Remember that `source` failed, forgetting the oldest failures
+        past IMAGE_FAILED_MAX."""
+
+        with self.lock:
+            self.failed[source] = time.monotonic()
+            self.failed.move_to_end(source)
+            while len(self.failed) > self.max_failed:
+                self.failed.popitem(last=False)
+
+    def save_upload(self, file):
+        """Store an uploaded file (a FileStorage); returns the URL it's
+        served at. Raises ValueError if it's over IMAGE_MAX_BYTES."""
+
+        data = file.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            raise ValueError("Image too large")
+
+        extension = os.path.splitext(file.filename)[1].lower()
+        name = hashlib.sha256(data).hexdigest() + extension
+        path = os.path.join(self.upload_dir, name)
+        if not os.path.exists(path):
+            write_file(path, data)
+
+        return UPLOADS_PATH + name
+
+
+def init_images(app):
+    """Set up the image pipeline and the `image` template filter."""
+
+    app.extensions['images'] = ImagePipeline(app)
+    app.add_template_filter(image_url, 'image')
+
+
+def image_url(source, variant):
+    """Template filter: where to load `variant` of the image at `source`."""
+
+    return current_app.extensions['images'].url(source, variant)
+
+
+def image_source(variant, token):
+    """The source URL signed into `token`; 404 if forged or `variant` is unknown."""
+
+    pipeline = current_app.extensions['images']
+    if variant not in pipeline.sizes:
+        abort(404)
+
+    try:
+        return pipeline.source(token)
+    except BadSignature:
+        abort(404)
@@ -1,9 +1,12 @@
 """SQLAlchemy models for Warbler."""
 
+import os
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects.postgresql import ARRAY
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -11,6 +14,8 @@ db = SQLAlchemy()
 DEFAULT_IMAGE_URL = "/static/images/default-pic.png"
 DEFAULT_HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
 
+MAX_MESSAGE_LENGTH = 140
+
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -149,7 +154,7 @@ class User(db.Model):
         return len(found_user_list) == 1
 
     def serialize(self):
-        '''Serialize to a dictionary'''
+        '''Serialize to a dictionary (without the password hash)'''
         return {
             "id": self.id,
             "email": self.email,
@@ -158,7 +163,6 @@ class User(db.Model):
             "header_image_url": self.header_image_url,
             "bio": self.bio,
             "location": self.location,
-            "password": self.password
         }
 
 
@@ -174,7 +178,7 @@ class Message(db.Model):
     )
 
     text = db.Column(
-        db.String(140),
+        db.String(MAX_MESSAGE_LENGTH),
         nullable=False,
     )
 
@@ -190,6 +194,43 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # A user's messages by date, for profiles and bulk deletes
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    @classmethod
+    def insert_many(cls, user_id, texts):
+        """Insert messages by `user_id` in one INSERT ... RETURNING statement.
+
+        Doesn't load the author's message collection. Returns rows of
+        (id, text, timestamp) in the same order as `texts`.
+        """
+
+        rows = db.session.execute(
+            insert(cls)
+            .values([{'user_id': user_id, 'text': text} for text in texts])
+            .returning(cls.id, cls.text, cls.timestamp)
+        ).all()
+
+        # Ids come from a sequence, so they follow VALUES order
+        return sorted(rows, key=lambda row: row.id)
+
+    @classmethod
+    def delete_owned(cls, user_id, message_ids):
+        """Delete those of `message_ids` written by `user_id` in one
+        DELETE ... RETURNING statement; returns the ids deleted.
+
+        Their likes and tags go with them (ON DELETE CASCADE).
+        """
+
+        return db.session.scalars(
+            delete(cls)
+            .where(cls.user_id == user_id, cls.id.in_(message_ids))
+            .returning(cls.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+
     def serialize(self):
         '''Serialize to a dictionary'''
         return {
@@ -221,12 +262,243 @@ class Like(db.Model):
         db.ForeignKey('messages.id', ondelete='CASCADE'),
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        # For the cascade when a message is deleted
+        db.Index('ix_likes_message_id', 'message_id'),
+        # A user's likes page, most recent first
+        db.Index('ix_likes_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+
+class MessageTag(db.Model):
+    """A hashtag (#tag) or mention (@user) found in a message, lowercased."""
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # For the cascade when a message is deleted
+    __table_args__ = (
+        db.Index('ix_message_tags_message_id', 'message_id'),
+    )
+
+
+class TrendingScore(db.Model):
+    """A message's checkpointed time-decayed like score in one window."""
+
+    __tablename__ = 'trending_scores'
+
+    window = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # Forward-decayed: log of the score as if measured at trending.EPOCH,
+    # so rows compare correctly whenever they were written
+    log_score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_trending_scores_window_log_score', 'window', 'log_score'),
+    )
+
+
+class Recommendation(db.Model):
+    """A precomputed "who to follow" candidate for a user."""
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    candidate_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # 'follows' (friend of friend) or 'likes' (likes the same messages)
+    reason = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+
+class StaleRecommendation(db.Model):
+    """A user whose recommendations are recomputed on the next batch run."""
+
+    __tablename__ = 'stale_recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # Bumped each time the user is queued again, so a batch run only
+    # dequeues the version it read
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        server_default='1',
+    )
+
+    # Set when the user (un)followed someone: their followers' friends of
+    # friends changed too, and the batch run recomputes them as well
+    include_followers = db.Column(
+        db.Boolean,
+        nullable=False,
+        server_default='false',
+    )
+
+
+class StoredSession(db.Model):
+    """A server-side session (see sessions.py)."""
+
+    __tablename__ = 'sessions'
+
+    # Random, and replaced whenever the session changes
+    id = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # Set while logged in, so deleting the user deletes their sessions
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        index=True,
+    )
+
+    data = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    expires = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        index=True,
+    )
+
+
+class RateLimitBucket(db.Model):
+    """A client's token bucket for one endpoint (see ratelimit.py)."""
+
+    __tablename__ = 'ratelimit_buckets'
+
+    # "<endpoint>:user:<id>" or "<endpoint>:ip:<address>"
+    key = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    tokens = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # Epoch seconds of the last token taken
+    updated = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # When the bucket is full again, after which the row can be dropped
+    full_at = db.Column(
+        db.Float,
+        nullable=False,
+        index=True,
+    )
+
+
+class WarmedFeed(db.Model):
+    """A user's home feed rendered ahead of their next visit (see
+    timelines.py), or a marker that it changed."""
+
+    __tablename__ = 'warmed_feeds'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # NULL for a marker left by a change to the user's feed
+    message_ids = db.Column(
+        ARRAY(db.Integer).with_variant(db.JSON, 'sqlite'),
+    )
+
+    html = db.Column(
+        db.Text,
+    )
+
+    # Epoch seconds the render started (or the change was made); a render
+    # started before the stored one is out of date and isn't kept
+    rendered_at = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # Epoch seconds after which the row can be dropped
+    expires = db.Column(
+        db.Float,
+        nullable=False,
+        index=True,
+    )
+
+
 def connect_db(app):
-    """Connect this database to provided Flask app.
+    """Connect this database (and password hashing settings) to provided Flask app.
+
+    You should call this in your Flask app. Connections are opened lazily,
+    and a forked child process (e.g. a gunicorn worker) starts with a fresh
+    pool rather than sharing its parent's sockets.
+    """
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    os.register_at_fork(after_in_child=lambda: dispose_engines(app))
+
+
+def dispose_engines(app):
+    """Drop this process's references to pooled connections for `app`.
 
-    You should call this in your Flask app.
+    Uses close=False so the parent's connections are left untouched for
+    the parent to keep using.
     """
 
-    app.app_context().push()
-    db.app = app
-    db.init_app(app)
\ No newline at end of file
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,170 @@
+"""Read-through cache of messages for permalink pages and the JSON API.
+
+A shared link to a popular message can bring thousands of requests for
+the same id at once. Each worker keeps up to PERMALINK_CACHE_SIZE
+message snapshots (the message_query row: text, timestamp and author)
+for PERMALINK_CACHE_SECONDS, missing ids included, so a hot permalink
+costs one query per worker per TTL.
+
+Concurrent misses for one id are coalesced: the first request loads it
+and the rest wait for that result, whether they're Flask threads or
+coroutines in asgi.py. Deleting a message or editing its author drops
+the affected snapshots in this worker (and a load already in flight
+won't be cached); other workers see the change within the TTL.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from flask import current_app
+
+from models import db
+from queries import message_query
+
+MISS = object()
+
+
+class PermalinkCache:
+    """LRU of message snapshots with a TTL and coalesced loads."""
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def cached(self, message_id, now):
+        """The fresh snapshot of `message_id` (None if it doesn't exist),
+        or MISS."""
+
+        with self.lock:
+            entry = self.entries.get(message_id)
+            if entry is None:
+                return MISS
+
+            row, stored = entry
+            if now - stored > self.max_age:
+                del self.entries[message_id]
+                return MISS
+
+            self.entries.move_to_end(message_id)
+            return row
+
+    def claim(self, message_id):
+        """(future, leader): the load of `message_id` to wait on, and
+        whether the caller must do it and settle it."""
+
+        with self.lock:
+            future = self.loading.get(message_id)
+            if future is not None:
+                return future, False
+
+            future = self.loading[message_id] = Future()
+            return future, True
+
+    def settle(self, message_id, future, row=None, error=None, now=None):
+        """Finish a claimed load, caching `row` unless it was invalidated."""
+
+        with self.lock:
+            current = self.loading.get(message_id) is future
+            if current:
+                del self.loading[message_id]
+                if error is None:
+                    self.entries[message_id] = (row, now)
+                    self.entries.move_to_end(message_id)
+                    if len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+
+        if error is None:
+            future.set_result(row)
+        else:
+            future.set_exception(error)
+
+    def get(self, message_id, load):
+        """The snapshot of `message_id`, calling `load()` for it on a miss."""
+
+        row = self.cached(message_id, time.monotonic())
+        if row is not MISS:
+            return row
+
+        future, leader = self.claim(message_id)
+        if not leader:
+            return future.result()
+
+        start = time.monotonic()
+        try:
+            row = load()
+        except BaseException as error:
+            self.settle(message_id, future, error=error)
+            raise
+
+        self.settle(message_id, future, row, now=start)
+        return row
+
+    async def get_async(self, message_id, load):
+        """As get(), awaiting the coroutine function `load` on a miss."""
+
+        row = self.cached(message_id, time.monotonic())
+        if row is not MISS:
+            return row
+
+        future, leader = self.claim(message_id)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        start = time.monotonic()
+        try:
+            row = await load()
+        except BaseException as error:
+            self.settle(message_id, future, error=error)
+            raise
+
+        self.settle(message_id, future, row, now=start)
+        return row
+
+    def invalidate(self, message_id):
+        with self.lock:
+            self.entries.pop(message_id, None)
+            self.loading.pop(message_id, None)
+
+    def invalidate_user(self, user_id):
+        """Drop snapshots of every message by `user_id`."""
+
+        with self.lock:
+            stale = [message_id for message_id, (row, _) in self.entries.items()
+                     if row is not None and row.user_id == user_id]
+            for message_id in stale:
+                del self.entries[message_id]
+
+            # Loads in flight may have read the old author
+            self.loading.clear()
+
+
+def init_permalinks(app):
+    """Give this app a permalink cache."""
+
+    app.extensions['permalinks'] = PermalinkCache(
+        app.config['PERMALINK_CACHE_SIZE'], app.config['PERMALINK_CACHE_SECONDS'])
+
+
+def get_message(message_id):
+    """Snapshot row of `message_id` with its author, or None."""
+
+    return current_app.extensions['permalinks'].get(
+        message_id, lambda: db.session.execute(message_query(message_id)).first())
+
+
+def message_changed(message_id):
+    """Call after deleting a message."""
+
+    current_app.extensions['permalinks'].invalidate(message_id)
+
+
+def user_changed(user_id):
+    """Call after editing or deleting a user; their messages show their name."""
+
+    current_app.extensions['permalinks'].invalidate_user(user_id)
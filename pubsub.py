@@ -0,0 +1,201 @@
+"""Publish/subscribe fan-out for realtime feed updates.
+
+The broker class is picked by the PUBSUB_BACKEND config value (an import
+path). InProcessBroker only reaches clients connected to the same worker
+process; a shared backend (e.g. Redis pub/sub) can subclass Broker to fan
+out across workers.
+
+Flask serves /stream from event_stream(), which holds a server thread per
+open stream; asgi.py serves it from async_event_stream() on the event
+loop instead.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+
+from werkzeug.utils import import_string
+
+
+class TooManySubscribers(Exception):
+    """Raised when a worker's connection caps are reached."""
+
+
+class Subscription:
+    """One connected client's bounded queue of pending events."""
+
+    def __init__(self, broker, user_id, queue_size, notify=None):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+        self.notify = notify
+
+    def put(self, event):
+        """Queue an event; a client too slow to keep up is marked overflowed."""
+
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+        if self.notify is not None:
+            self.notify()
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Interface shared by pub/sub backends."""
+
+    def __init__(self, max_connections, max_per_user, queue_size):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.queue_size = queue_size
+
+    def subscribe(self, user_id, notify=None):
+        """Return a new Subscription for `user_id`'s feed events; `notify()`
+        is called (from the publishing thread) after each one arrives."""
+
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, user_ids, event):
+        """Send `event` to every subscriber among `user_ids`."""
+
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    """Broker for subscribers connected to this worker process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.count = 0
+
+    def subscribe(self, user_id, notify=None):
+        with self.lock:
+            mine = self.subscribers.setdefault(user_id, set())
+
+            if self.count >= self.max_connections or len(mine) >= self.max_per_user:
+                raise TooManySubscribers()
+
+            subscription = Subscription(self, user_id, self.queue_size, notify)
+            mine.add(subscription)
+            self.count += 1
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            mine = self.subscribers.get(subscription.user_id, set())
+
+            if subscription in mine:
+                mine.remove(subscription)
+                self.count -= 1
+
+            if not mine:
+                self.subscribers.pop(subscription.user_id, None)
+
+    def publish(self, user_ids, event):
+        with self.lock:
+            targets = [subscription
+                       for user_id in user_ids
+                       for subscription in self.subscribers.get(user_id, ())]
+
+        for subscription in targets:
+            subscription.put(event)
+
+
+def init_pubsub(app):
+    """Create the configured broker and store it on the app."""
+
+    broker_class = import_string(app.config['PUBSUB_BACKEND'])
+    app.extensions['pubsub'] = broker_class(
+        max_connections=app.config['SSE_MAX_CONNECTIONS'],
+        max_per_user=app.config['SSE_MAX_PER_USER'],
+        queue_size=app.config['SSE_QUEUE_SIZE'],
+    )
+
+
+HEARTBEAT = ": heartbeat\n\n"
+RESET = "event: reset\ndata: {}\n\n"
+
+
+def event_data(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def event_stream(subscription, heartbeat):
+    """Yield Server-Sent Events for `subscription` until the client leaves.
+
+    Sends a comment line every `heartbeat` seconds of silence so proxies
+    keep the connection open. If the client falls behind and its queue
+    overflows, sends a 'reset' event and ends the stream; the client
+    reloads instead of receiving a partial feed.
+    """
+
+    try:
+        while not subscription.overflowed:
+            event = subscription.get(heartbeat)
+            yield HEARTBEAT if event is None else event_data(event)
+
+        yield RESET
+
+    finally:
+        subscription.close()
+
+
+def subscribe_async(broker, user_id):
+    """Subscribe from a coroutine. Returns (subscription, ready): `ready` is
+    an asyncio.Event set on this loop whenever an event arrives."""
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = broker.subscribe(user_id, lambda: loop.call_soon_threadsafe(ready.set))
+
+    return subscription, ready
+
+
+async def async_event_stream(subscription, ready, heartbeat):
+    """As event_stream(), for a subscribe_async() subscription, waiting on
+    the event loop instead of a thread. The caller closes the subscription."""
+
+    while not subscription.overflowed:
+        event = subscription.get_nowait()
+        if event is not None:
+            yield event_data(event)
+            continue
+
+        # Cleared before the queue is checked again, so an event published
+        # in between still wakes us
+        ready.clear()
+        if subscription.queue.qsize():
+            continue
+
+        try:
+            await asyncio.wait_for(ready.wait(), heartbeat)
+        except asyncio.TimeoutError:
+            yield HEARTBEAT
+
+    yield RESET
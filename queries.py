@@ -0,0 +1,144 @@
+"""Read queries for the JSON API.
+
+Each builder returns a SQLAlchemy Core statement over plain columns, so the
+same query runs on db.session (sync views) or an AsyncConnection (asgi.py)
+and never lazy-loads relationships.
+"""
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased
+
+from models import Follows, Like, Message, User
+
+TIMELINE_LIMIT = 100
+
+USER_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+    User.location,
+)
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.text,
+    Message.timestamp,
+    Message.user_id,
+    User.username,
+    User.image_url,
+)
+
+
+def user_exists_query(user_id):
+    """Id of `user_id` if that user exists."""
+
+    return select(User.id).where(User.id == user_id)
+
+
+def feed_query(user_id, limit=TIMELINE_LIMIT):
+    """Most recent messages by `user_id` and the users they follow."""
+
+    following = (select(Follows.user_being_followed_id)
+                 .where(Follows.user_following_id == user_id))
+
+    return (select(*MESSAGE_COLUMNS)
+            .join(User, Message.user_id == User.id)
+            .where(or_(Message.user_id == user_id,
+                       Message.user_id.in_(following)))
+            .order_by(Message.timestamp.desc())
+            .limit(limit))
+
+
+def timeline_query(user_ids, viewer_id, limit=TIMELINE_LIMIT):
+    """Most recent messages by any of `user_ids`, with whether `viewer_id`
+    liked each (as `liked`)."""
+
+    liked = (select(Like.id)
+             .where(Like.user_id == viewer_id, Like.message_id == Message.id)
+             .exists())
+
+    return (select(*MESSAGE_COLUMNS, liked.label('liked'))
+            .join(User, Message.user_id == User.id)
+            .where(Message.user_id.in_(user_ids))
+            .order_by(Message.timestamp.desc())
+            .limit(limit))
+
+
+def user_query(user_id):
+    """Public profile columns for `user_id`."""
+
+    return select(*USER_COLUMNS).where(User.id == user_id)
+
+
+def user_messages_query(user_id, limit=TIMELINE_LIMIT):
+    """Most recent messages written by `user_id`."""
+
+    return (select(*MESSAGE_COLUMNS)
+            .join(User, Message.user_id == User.id)
+            .where(Message.user_id == user_id)
+            .order_by(Message.timestamp.desc())
+            .limit(limit))
+
+
+def liked_messages_query(user_id, viewer_id):
+    """Messages `user_id` liked, most recently liked first, with whether
+    `viewer_id` liked each (as `liked`)."""
+
+    viewer_like = aliased(Like)
+    liked = (select(viewer_like.id)
+             .where(viewer_like.user_id == viewer_id, viewer_like.message_id == Message.id)
+             .exists())
+
+    return (select(*MESSAGE_COLUMNS, Like.created_at.label('liked_at'), liked.label('liked'))
+            .select_from(Like)
+            .join(Message, Like.message_id == Message.id)
+            .join(User, Message.user_id == User.id)
+            .where(Like.user_id == user_id)
+            .order_by(Like.created_at.desc(), Like.id.desc()))
+
+
+def users_query(search=None):
+    """All users, or those whose username contains `search`."""
+
+    query = select(*USER_COLUMNS).order_by(User.id)
+
+    if search:
+        query = query.where(User.username.like(f"%{search}%"))
+
+    return query
+
+
+def users_page_query(search, page, per_page):
+    """Page `page` of users_query(search), plus one more row to tell
+    whether there's a next page."""
+
+    return users_query(search).offset((page - 1) * per_page).limit(per_page + 1)
+
+
+def message_query(message_id):
+    """A single message joined with its author."""
+
+    return (select(*MESSAGE_COLUMNS)
+            .join(User, Message.user_id == User.id)
+            .where(Message.id == message_id))
+
+
+def messages_query(message_ids):
+    """Messages with the given ids joined with their authors, in no order."""
+
+    return (select(*MESSAGE_COLUMNS)
+            .join(User, Message.user_id == User.id)
+            .where(Message.id.in_(message_ids)))
+
+
+def to_dict(row):
+    """Turn a result row into a JSON-ready dictionary."""
+
+    data = dict(row._mapping)
+
+    if 'timestamp' in data:
+        data['timestamp'] = data['timestamp'].isoformat()
+
+    return data
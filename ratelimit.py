@@ -0,0 +1,248 @@
+"""Rate limiting and load shedding for write endpoints.
+
+Each endpoint in RATELIMIT_POLICIES gets a token bucket per client (the
+logged-in user, or the IP address when logged out): (capacity, period)
+allows bursts of `capacity` POSTs, refilled at capacity/period per second.
+Requests over the limit get a 429 with Retry-After before any view code,
+form validation or bcrypt runs.
+
+Buckets live in the store named by RATELIMIT_BACKEND (an import path).
+DatabaseStorage (the default) keeps them in the ratelimit_buckets table,
+so every worker shares one bucket per client; each token taken is one
+atomic upsert on its own connection. InProcessStorage keeps them in a
+dict, so its limits apply per worker process.
+
+The same endpoints are also shed with a 503 and Retry-After while the
+database connection pool is congested. Each admitted request times how
+long it waited to check out a connection. A time-decayed average over
+LOAD_SHED_POOL_WAIT seconds means the pool can't keep up, so new writes
+are turned away until the average decays back under it. Both happen in a
+hook that runs before every other one: later hooks (e.g. loading g.user)
+check out the request's connection themselves, which would leave nothing
+to time, and a shed request shouldn't wait for a connection at all.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app, g, jsonify, request
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.utils import import_string
+
+from models import db, RateLimitBucket
+
+
+class Storage:
+    """Interface shared by token bucket stores."""
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+    def consume(self, key, capacity, period, now):
+        """Take a token from bucket `key`.
+
+        Returns 0 if one was available, else the seconds until one will be.
+        """
+
+        raise NotImplementedError
+
+
+def refilled(tokens, updated, capacity, period, now):
+    """Tokens in a bucket left at `tokens` at `updated`, by `now`."""
+
+    return min(capacity, tokens + max(0, now - updated) * capacity / period)
+
+
+def wait_for_token(tokens, capacity, period):
+    return (1 - tokens) * period / capacity
+
+
+class InProcessStorage(Storage):
+    """Buckets in a dict, for one worker process.
+
+    Holds at most `max_keys` buckets; the least recently used are dropped
+    (which just gives that client a full bucket again).
+    """
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['RATELIMIT_MAX_KEYS'])
+
+    def consume(self, key, capacity, period, now):
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = refilled(tokens, updated, capacity, period, now)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = wait_for_token(tokens, capacity, period)
+
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+
+        return wait
+
+
+class DatabaseStorage(Storage):
+    """Buckets in the ratelimit_buckets table, shared by every worker.
+
+    Taking a token is one INSERT ... ON CONFLICT DO UPDATE ... RETURNING:
+    the row is created full, or refilled and decremented in place if a
+    token is available. The upsert's row lock serializes concurrent takes
+    from the same bucket. Buckets that are full again can be deleted with
+    `flask purge-ratelimits`; a missing bucket is a full one.
+    """
+
+    def consume(self, key, capacity, period, now):
+        rate = capacity / period
+        bucket = RateLimitBucket.__table__.c
+        tokens = func.least(capacity, bucket.tokens + func.greatest(0, now - bucket.updated) * rate)
+
+        stmt = pg_insert(RateLimitBucket).values(
+            key=key, tokens=capacity - 1, updated=now, full_at=now + 1 / rate)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'tokens': tokens - 1,
+                  'updated': now,
+                  'full_at': now + (capacity - (tokens - 1)) / rate},
+            where=tokens >= 1,
+        ).returning(bucket.key)
+
+        with db.engine.begin() as conn:
+            if conn.execute(stmt).first() is not None:
+                return 0
+
+            # No token: the row was left alone, so work out when there is one
+            row = conn.execute(
+                select(bucket.tokens, bucket.updated).where(bucket.key == key)).first()
+
+        if row is None:
+            # Purged meanwhile, so it's full by now
+            return 1 / rate
+        return wait_for_token(refilled(*row, capacity, period, now), capacity, period)
+
+    def purge(self, now):
+        """Delete buckets that are full again; returns how many there were."""
+
+        with db.engine.begin() as conn:
+            return conn.execute(
+                delete(RateLimitBucket).where(RateLimitBucket.full_at <= now)).rowcount
+
+
+class PoolWaitMonitor:
+    """Time-decayed average of connection pool checkout waits."""
+
+    def __init__(self, threshold, half_life=1.0):
+        self.threshold = threshold
+        self.half_life = half_life
+        self.average = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def decayed(self, now):
+        return self.average * 0.5 ** (max(0, now - self.updated) / self.half_life)
+
+    def record(self, wait, now):
+        with self.lock:
+            self.average = (self.decayed(now) + wait) / 2
+            self.updated = now
+
+    def overloaded(self, now):
+        return self.threshold is not None and self.decayed(now) > self.threshold
+
+
+def init_ratelimit(app):
+    """Create the configured bucket store and admit requests through it."""
+
+    storage_class = import_string(app.config['RATELIMIT_BACKEND'])
+    app.extensions['ratelimit'] = storage_class.from_config(app.config)
+    app.extensions['pool_wait'] = PoolWaitMonitor(app.config['LOAD_SHED_POOL_WAIT'])
+
+    app.before_request_funcs.setdefault(None, []).insert(0, shed_load)
+    app.before_request(admit_request)
+
+
+def client_key():
+    if g.get('user'):
+        return f"user:{g.user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+def reject(error, message, retry_after):
+    """`error` (a werkzeug HTTPException class) as JSON or an error page."""
+
+    if request.is_json:
+        response = jsonify(message=message)
+        response.status_code = error.code
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    return error(description=message, retry_after=retry_after).get_response()
+
+
+def limited():
+    """The rate limit policy for this request, if it's a POST with one."""
+
+    if request.method != 'POST':
+        return None
+    return current_app.config['RATELIMIT_POLICIES'].get(request.endpoint)
+
+
+def shed_load():
+    """First hook: turn away limited POSTs while the pool is congested,
+    else check out the request's connection, timing the wait for it."""
+
+    if limited() is None:
+        return None
+
+    monitor = current_app.extensions['pool_wait']
+    if monitor.overloaded(time.monotonic()):
+        return reject(ServiceUnavailable, 'Server busy, please try again shortly.',
+                      current_app.config['LOAD_SHED_RETRY_AFTER'])
+
+    start = time.monotonic()
+    db.session.connection()
+    monitor.record(time.monotonic() - start, start)
+
+    return None
+
+
+def admit_request():
+    """Turn away rate-limited POSTs to endpoints with a policy."""
+
+    policy = limited()
+    if policy is None or not current_app.config['RATELIMIT_ENABLED']:
+        return None
+
+    capacity, period = policy
+    wait = current_app.extensions['ratelimit'].consume(
+        f"{request.endpoint}:{client_key()}", capacity, period, time.time())
+
+    if wait:
+        return reject(TooManyRequests, 'Too many requests.', math.ceil(wait))
+
+    return None
+
+
+@click.command('purge-ratelimits')
+@with_appcontext
+def purge_ratelimits_command():
+    """Delete rate limit buckets that have refilled."""
+
+    purged = DatabaseStorage().purge(time.time())
+    click.echo(f"Purged {purged} full rate limit buckets")
@@ -0,0 +1,221 @@
+"""Precomputed "who to follow" recommendations.
+
+Candidates come from two sparse matrix products over user ids:
+
+- friends of friends, F·F: F is the follows matrix, and entry (u, c)
+  counts the people u follows who follow c
+- co-likers, L·Lᵀ: L is the user × message likes matrix, and entry (u, c)
+  counts the messages both u and c liked
+
+Each product is computed one row at a time (Gustavson's algorithm) over
+CSR arrays, so only one user's candidate scores are held at once. Each
+contribution is weighted down by the degree of the middle node, so that a
+celebrity everyone follows, or a viral message everyone liked, doesn't
+swamp the rest. The best RECOMMENDATIONS_TOP_K candidates per user go into
+the recommendations table, which the home page reads with one query.
+
+Follows and likes queue the acting user in stale_recommendations (one row
+per request), and `flask recommend` (run from cron) recomputes just those
+users, plus the followers of anyone who (un)followed someone.
+`flask recommend --full` recomputes everyone.
+"""
+
+import heapq
+import math
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from graph import CSR
+from models import db, Follows, Like, Recommendation, StaleRecommendation, User
+
+FOLLOWS_WEIGHT = 1.0
+LIKES_WEIGHT = 0.5
+
+# Users recomputed (and committed) per transaction
+REFRESH_BATCH_SIZE = 500
+
+
+def load_matrices():
+    """(follows, likes, likers) CSR matrices from the database.
+
+    `likers` is the transpose of `likes`: message id -> user ids.
+    """
+
+    follows = db.session.execute(
+        select(Follows.user_following_id, Follows.user_being_followed_id)
+        .execution_options(yield_per=10000))
+
+    likes = db.session.execute(
+        select(Like.user_id, Like.message_id)
+        .where(Like.user_id.is_not(None), Like.message_id.is_not(None))
+        .distinct()).all()
+
+    return (CSR(follows),
+            CSR(likes),
+            CSR((message_id, user_id) for user_id, message_id in likes))
+
+
+def weighted_row_sum(matrix, middles, scores):
+    """Add row `m` of `matrix` into `scores` for each `m` in `middles`.
+
+    Rows are weighted by 1 / log2(2 + row length).
+    """
+
+    for middle in middles:
+        row = matrix.row(middle)
+        weight = 1 / math.log2(2 + len(row))
+        for candidate in row:
+            scores[candidate] += weight
+
+
+def recommend_for(user_id, follows, likes, likers, top_k):
+    """The best `top_k` recommendation rows for `user_id`."""
+
+    followed = follows.row(user_id)
+
+    friends = defaultdict(float)
+    weighted_row_sum(follows, followed, friends)
+
+    colikers = defaultdict(float)
+    weighted_row_sum(likers, likes.row(user_id), colikers)
+
+    skip = set(followed)
+    skip.add(user_id)
+
+    scores = {}
+    for candidate in friends.keys() | colikers.keys():
+        if candidate not in skip:
+            scores[candidate] = (FOLLOWS_WEIGHT * friends.get(candidate, 0)
+                                 + LIKES_WEIGHT * colikers.get(candidate, 0))
+
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    rows = []
+    for candidate, score in best:
+        from_follows = FOLLOWS_WEIGHT * friends.get(candidate, 0)
+        rows.append({
+            'user_id': user_id,
+            'candidate_id': candidate,
+            'score': score,
+            'reason': 'follows' if from_follows >= score - from_follows else 'likes',
+        })
+
+    return rows
+
+
+def refresh_recommendations(full=False):
+    """Recompute recommendations for queued users (or everyone if `full`).
+
+    Returns how many users were recomputed. Users queued again while this
+    runs stay queued for the next run.
+    """
+
+    stale = db.session.execute(
+        select(StaleRecommendation.user_id, StaleRecommendation.version,
+               StaleRecommendation.include_followers)).all()
+    queued = {user_id: version for user_id, version, _ in stale}
+
+    if full:
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+    else:
+        followed = [user_id for user_id, _, include_followers in stale if include_followers]
+        followers = db.session.scalars(
+            select(Follows.user_following_id)
+            .where(Follows.user_being_followed_id.in_(followed))) if followed else []
+        user_ids = sorted(queued.keys() | set(followers))
+
+    if not user_ids:
+        return 0
+
+    follows, likes, likers = load_matrices()
+    top_k = current_app.config['RECOMMENDATIONS_TOP_K']
+
+    for start in range(0, len(user_ids), REFRESH_BATCH_SIZE):
+        batch = user_ids[start:start + REFRESH_BATCH_SIZE]
+        rows = [row for user_id in batch
+                for row in recommend_for(user_id, follows, likes, likers, top_k)]
+
+        db.session.execute(delete(Recommendation).where(Recommendation.user_id.in_(batch)))
+        if rows:
+            db.session.execute(insert(Recommendation), rows)
+        done = [(user_id, queued[user_id]) for user_id in batch if user_id in queued]
+        if done:
+            db.session.execute(
+                delete(StaleRecommendation)
+                .where(tuple_(StaleRecommendation.user_id, StaleRecommendation.version).in_(done)))
+        db.session.commit()
+
+    return len(user_ids)
+
+
+def queue_refresh(user_ids, include_followers=False):
+    """Queue the users selected by `user_ids` (a SELECT of one column).
+
+    With `include_followers`, the batch run recomputes their followers too.
+    """
+
+    stmt = pg_insert(StaleRecommendation).from_select(
+        ['user_id', 'include_followers'],
+        select(user_ids.subquery(), literal(include_followers)))
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'version': StaleRecommendation.version + 1,
+              'include_followers': (StaleRecommendation.include_followers
+                                    | stmt.excluded.include_followers)}))
+
+
+def likes_changed(user_id, message_id):
+    """Queue `user_id` after they liked or unliked `message_id`, and the
+    message's other likers, who gained or lost a co-liker."""
+
+    queue_refresh(select(literal(user_id)).union(
+        select(Like.user_id).where(Like.message_id == message_id, Like.user_id.is_not(None))))
+
+
+def likes_deleted(message_ids):
+    """Queue the users who liked `message_ids` (ids, or a SELECT of them)
+    before those messages are deleted, taking the likes with them."""
+
+    queue_refresh(select(Like.user_id).where(Like.message_id.in_(message_ids)).distinct())
+
+
+def follows_changed(user_id):
+    """Queue `user_id` after they (un)followed someone.
+
+    Their followers' friends of friends run through `user_id`, so the batch
+    run recomputes those followers as well; the request writes one row
+    however many followers there are.
+    """
+
+    queue_refresh(select(literal(user_id)), include_followers=True)
+
+
+def recommended_users(user_id):
+    """(User, reason) pairs to show `user_id`, best first.
+
+    Anyone followed since the last batch run is left out.
+    """
+
+    followed = select(Follows.user_being_followed_id).where(Follows.user_following_id == user_id)
+
+    return (db.session.query(User, Recommendation.reason)
+            .join(Recommendation, Recommendation.candidate_id == User.id)
+            .filter(Recommendation.user_id == user_id, User.id.not_in(followed))
+            .order_by(Recommendation.score.desc(), User.id)
+            .limit(current_app.config['RECOMMENDATIONS_SHOWN'])
+            .all())
+
+
+@click.command('recommend')
+@click.option('--full', is_flag=True, help='Recompute every user, not just queued ones.')
+@with_appcontext
+def recommend_command(full):
+    """Recompute "who to follow" recommendations."""
+
+    count = refresh_recommendations(full)
+    click.echo(f"Refreshed recommendations for {count} users")
@@ -0,0 +1,163 @@
+"""Full-text search over message text.
+
+On Postgres, messages are matched against a GIN index on
+to_tsvector('english', text) and ranked with ts_rank_cd. On SQLite (handy
+for quick local runs and tests), an FTS5 table over messages is used and
+ranked with bm25. Either way the index follows inserts, updates and
+deletes on its own: Postgres maintains expression indexes, and SQLite
+triggers keep the FTS5 table in step.
+
+Hashtags (#tag) and mentions (@user) are pulled out of new messages into
+message_tags, so that a `#tag` or `@user` term is an indexed lookup, not a
+text match. Those rows go when their message does (ON DELETE CASCADE).
+
+The index and triggers are created with the messages table. For an
+existing database, `flask init-db` adds them and `flask reindex-search`
+rebuilds tags and the SQLite FTS table.
+"""
+
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, column, delete, event, func, insert, literal_column, select, table, text
+
+from models import db, Message, MessageTag, User
+from queries import MESSAGE_COLUMNS
+
+TAG_PATTERN = re.compile(r'(?<!\w)([#@]\w{1,50})')
+
+# Postgres text search configuration; must match the index expression
+SEARCH_CONFIG = literal_column("'english'")
+
+POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_text_search "
+    "ON messages USING gin (to_tsvector('english', text))",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts "
+    "USING fts5(text, content='messages', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); END",
+]
+
+messages_fts = table('messages_fts', column('rowid'), column('rank'))
+
+
+def create_search_index(connection):
+    """Create the text index for this database (safe to run again)."""
+
+    statements = {'postgresql': POSTGRES_DDL, 'sqlite': SQLITE_DDL}
+    for statement in statements.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+
+event.listen(Message.__table__, 'after_create',
+             lambda target, connection, **kw: create_search_index(connection))
+event.listen(Message.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect='sqlite'))
+
+
+def extract_tags(body):
+    """Distinct lowercased hashtags and mentions in `body`."""
+
+    return {tag.lower() for tag in TAG_PATTERN.findall(body)}
+
+
+def index_tags(rows):
+    """Record the tags of new messages; `rows` have id and text."""
+
+    values = [{'message_id': row.id, 'tag': tag}
+              for row in rows for tag in extract_tags(row.text)]
+    if values:
+        db.session.execute(insert(MessageTag), values)
+
+
+def parse_query(q):
+    """Split a search string into (tags, words)."""
+
+    tags = extract_tags(q)
+    words = TAG_PATTERN.sub(' ', q).split()
+
+    return sorted(tags), words
+
+
+def fts5_query(words):
+    """Words as an FTS5 query that matches all of them, quoted so any
+    FTS5 syntax characters in user input are taken literally."""
+
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def search_query(q, dialect):
+    """Messages matching `q` as MESSAGE_COLUMNS plus rank, best first.
+
+    Every #tag and @mention in `q` must be on the message. The remaining
+    words are matched against the text and decide the ranking; with no
+    words, newer messages come first.
+    """
+
+    tags, words = parse_query(q)
+
+    stmt = select(*MESSAGE_COLUMNS).join(User, Message.user_id == User.id)
+
+    for tag in tags:
+        tagged = select(MessageTag.message_id).where(MessageTag.tag == tag)
+        stmt = stmt.where(Message.id.in_(tagged))
+
+    if not words:
+        return stmt.add_columns(literal_column('0').label('rank')).order_by(Message.id.desc())
+
+    if dialect == 'sqlite':
+        rank = (-messages_fts.c.rank).label('rank')
+        stmt = (stmt.join(messages_fts, messages_fts.c.rowid == Message.id)
+                .where(literal_column('messages_fts').op('MATCH')(fts5_query(words))))
+    else:
+        vector = func.to_tsvector(SEARCH_CONFIG, Message.text)
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, ' '.join(words))
+        rank = func.ts_rank_cd(vector, tsquery).label('rank')
+        stmt = stmt.where(vector.op('@@')(tsquery))
+
+    return stmt.add_columns(rank).order_by(rank.desc(), Message.id.desc())
+
+
+def search_messages(q, page, per_page):
+    """One page of messages matching `q`, and whether there's a next page."""
+
+    stmt = (search_query(q, db.engine.dialect.name)
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1))
+
+    rows = db.session.execute(stmt).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def rebuild_search_index():
+    """Rebuild message tags (and the SQLite FTS table) from scratch."""
+
+    create_search_index(db.session.connection())
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"))
+
+    db.session.execute(delete(MessageTag))
+
+    rows = db.session.execute(
+        select(Message.id, Message.text).execution_options(yield_per=1000))
+    for batch in rows.partitions():
+        index_tags(batch)
+
+
+@click.command('reindex-search')
+@with_appcontext
+def reindex_search_command():
+    """Rebuild message tags (and the SQLite FTS table) from scratch."""
+
+    rebuild_search_index()
+    db.session.commit()
+    click.echo("Rebuilt the search index")
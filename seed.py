@@ -1,19 +1,41 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
+Loads generator/*.csv by default, or the CSVs in a directory written by
+`flask export`:
+
+    python3 seed.py [directory]
+"""
+
+import os
+import sys
 from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from sqlalchemy import text
+from app import create_app
+from models import db, User, Message, Follows
+from search import rebuild_search_index
+
+create_app().app_context().push()
+
+data_dir = sys.argv[1] if len(sys.argv) > 1 else 'generator'
 
 db.drop_all()
 db.create_all()
 
-with open('generator/users.csv') as users:
+with open(os.path.join(data_dir, 'users.csv')) as users:
     db.session.bulk_insert_mappings(User, DictReader(users))
 
-with open('generator/messages.csv') as messages:
+with open(os.path.join(data_dir, 'messages.csv')) as messages:
     db.session.bulk_insert_mappings(Message, DictReader(messages))
 
-with open('generator/follows.csv') as follows:
+with open(os.path.join(data_dir, 'follows.csv')) as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
+# Exports (flask export) carry explicit ids; move sequences past them
+if db.engine.dialect.name == 'postgresql':
+    for table in ('users', 'messages'):
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"))
+
+rebuild_search_index()
 db.session.commit()
@@ -0,0 +1,273 @@
+"""Server-side sessions.
+
+Flask's default session is the whole session dict in a signed cookie, so
+every request re-verifies its HMAC and flashed messages ride along in the
+cookie. With SESSION_BACKEND set (an import path of a SessionStore), the
+cookie holds only a random session id, and the session is kept in the
+store: DatabaseSessionStore uses the sessions table, and a shared cache
+(e.g. Redis) can subclass SessionStore. SESSION_BACKEND = None keeps the
+signed cookie.
+
+Only logged-in sessions go to the store. Anonymous visitors (e.g. with
+just a CSRF token from the login form) get Flask's signed cookie, so
+pages anyone can load don't write a row for every visitor. Session ids
+never contain a '.' and signed cookies always do, so one cookie name
+serves both.
+
+A session is saved under a fresh id each time it changes, and the old id
+is deleted. Logging in changes the session, so an id planted before login
+(session fixation) is useless afterwards. And since the contents under an
+id never change, each worker caches loaded sessions for
+SESSION_CACHE_SECONDS without ever serving stale contents; the time limit
+only bounds how long an id deleted by another worker still works here.
+
+Stored sessions reference their user with ON DELETE CASCADE, so deleting
+a user ends all of their sessions without any per-request check.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from flask.json.tag import TaggedJSONSerializer
+from itsdangerous import BadSignature
+from flask.sessions import SecureCookieSessionInterface, SessionMixin
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import CallbackDict
+from werkzeug.utils import import_string
+
+from models import db, StoredSession
+
+CURR_USER_KEY = "curr_user"
+
+# Random bytes in a session id (the cookie is about 4/3 this long)
+SESSION_ID_BYTES = 24
+
+
+class SessionStore:
+    """Interface shared by server-side session stores.
+
+    Sessions are stored as serialized text under their id.
+    """
+
+    def load(self, sid, now):
+        """The session saved under `sid`, or None if missing or expired."""
+
+        raise NotImplementedError
+
+    def save(self, sid, data, user_id, expires):
+        """Save a session; returns False if its user no longer exists."""
+
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class DatabaseSessionStore(SessionStore):
+    """Sessions in the sessions table.
+
+    Uses its own connections, so saving a session never commits (or waits
+    on) the request's transaction.
+    """
+
+    def load(self, sid, now):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                select(StoredSession.data)
+                .where(StoredSession.id == sid, StoredSession.expires > now)
+            ).scalar()
+
+    def save(self, sid, data, user_id, expires):
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(StoredSession).values(
+                    id=sid, data=data, user_id=user_id, expires=expires))
+        except IntegrityError:
+            # The user was deleted meanwhile, which ends their sessions
+            return False
+
+        return True
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(delete(StoredSession).where(StoredSession.id == sid))
+
+    def purge(self, now):
+        """Delete expired sessions; returns how many there were."""
+
+        with db.engine.begin() as conn:
+            return conn.execute(
+                delete(StoredSession).where(StoredSession.expires <= now)).rowcount
+
+
+class SessionCache:
+    """This worker's recently loaded sessions, least recently used first."""
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, sid, now):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return None
+
+            data, cached_at = entry
+            if now - cached_at > self.max_age:
+                del self.entries[sid]
+                return None
+
+            self.entries.move_to_end(sid)
+            return data
+
+    def put(self, sid, data, now):
+        with self.lock:
+            self.entries[sid] = (data, now)
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session loaded from (or new to) the store; `sid` is None if new."""
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+
+
+def is_session_id(value):
+    return '.' not in value
+
+
+class ServerSessionInterface(SecureCookieSessionInterface):
+    """Keeps logged-in sessions in `store`, with `cache` in front of it;
+    anonymous ones stay in a signed cookie."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, cache):
+        self.store = store
+        self.cache = cache
+
+    def cached(self, sid):
+        """The session under `sid` if this worker has it cached, else None."""
+
+        data = self.cache.get(sid, time.monotonic())
+        return None if data is None else self.serializer.loads(data)
+
+    def load(self, sid):
+        """The session under `sid`, or None if there isn't a live one."""
+
+        if not is_session_id(sid):
+            return None
+
+        now = time.monotonic()
+        data = self.cache.get(sid, now)
+
+        if data is None:
+            data = self.store.load(sid, datetime.now(timezone.utc))
+            if data is None:
+                return None
+            self.cache.put(sid, data, now)
+
+        return self.serializer.loads(data)
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return ServerSession()
+
+        if is_session_id(value):
+            initial = self.load(value)
+            return ServerSession() if initial is None else ServerSession(initial, value)
+
+        # An anonymous session, signed
+        serializer = self.get_signing_serializer(app)
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        try:
+            return ServerSession(serializer.loads(value, max_age=max_age))
+        except BadSignature:
+            return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session.modified:
+            return
+
+        if session.sid is not None:
+            self.store.delete(session.sid)
+            self.cache.discard(session.sid)
+
+        if not session:
+            response.delete_cookie(name, domain=domain, path=path,
+                                   secure=self.get_cookie_secure(app),
+                                   samesite=self.get_cookie_samesite(app))
+            return
+
+        if CURR_USER_KEY not in session:
+            self.set_cookie(app, session, response,
+                            self.get_signing_serializer(app).dumps(dict(session)))
+            return
+
+        sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+        data = self.serializer.dumps(dict(session))
+        expires = datetime.now(timezone.utc) + app.permanent_session_lifetime
+        if not self.store.save(sid, data, session.get(CURR_USER_KEY), expires):
+            return
+        self.cache.put(sid, data, time.monotonic())
+        self.set_cookie(app, session, response, sid)
+
+    def set_cookie(self, app, session, response, value):
+        response.set_cookie(
+            self.get_cookie_name(app), value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_sessions(app):
+    """Keep sessions in the configured store, if there is one."""
+
+    if app.config['SESSION_BACKEND'] is None:
+        return
+
+    store = import_string(app.config['SESSION_BACKEND'])()
+    cache = SessionCache(app.config['SESSION_CACHE_SIZE'], app.config['SESSION_CACHE_SECONDS'])
+    app.session_interface = ServerSessionInterface(store, cache)
+
+
+@click.command('purge-sessions')
+@with_appcontext
+def purge_sessions_command():
+    """Delete expired server-side sessions."""
+
+    purged = DatabaseSessionStore().purge(datetime.now(timezone.utc))
+    click.echo(f"Purged {purged} expired sessions")
@@ -7,20 +7,15 @@ const $newMessageForm = $('#new-message-form');
 const $messages = $('#messages');
 const $nav = $('nav');
 
+// The page's CSRF token, sent with every request the scripts make
+axios.defaults.headers.common['X-CSRFToken'] = $('meta[name="csrf-token"]').attr('content');
+
 /** like: likes or unlikes a warble that is clicked on */
 async function like(evt) {
     evt.preventDefault();
     const msgId = evt.target.getAttribute('id');
-    const $csrfToken = $(evt.target).find('#csrf_token');
 
-    const fields = {
-        csrf_token: $csrfToken.val(),
-    }
-
-    const response = await axios.post(
-        `/messages/${msgId}/like`,
-        fields,
-        {headers: {'content-type': 'application/json'}});
+    const response = await axios.post(`/messages/${msgId}/like`);
 
     const $icon = $(evt.target).find('i');
 
@@ -29,51 +24,82 @@ async function like(evt) {
     }
 }
 
-/** addTweet: Adds a tweet to the database and updates the DOM accordingly */
+/** addTweet: Adds a tweet to the database; it reaches timelines via /stream */
 async function addTweet(evt) {
     evt.preventDefault();
     const $csrfToken = $(evt.target).find('#csrf_token');
     const $text = $(evt.target).find('#text');
-    const $location = $(evt.target).find('#location');
 
     const fields = {
         csrf_token: $csrfToken.val(),
-        text: $text.val(),
-        location: $location.val()
+        text: $text.val()
     }
 
-    const response = await axios.post(
+    await axios.post(
         '/messages/new',
         fields,
         {headers: {'content-type': 'application/json'}}
     );
-    const msg = response.data.msg;
-    const user = response.data.user;
+
+    $messageModal.after(
+        `<div class="alert alert-success mb-4">Message added!</div>`
+    )
+
+    $messageModal.modal('hide');
+}
+
+/** messageHTML: builds the timeline entry for a warble pushed over /stream */
+function messageHTML(msg) {
     const date = new Date(msg.timestamp);
     const months = ['January', 'February', 'March', 'April', 'May', 'June',
         'July', 'August', 'September', 'October', 'November', 'December']
 
-    if (response.data.modify_DOM === true) {
-        const $newMessage = $(`<li class="list-group-item">
+    const $newMessage = $(`<li class="list-group-item">
         <a href="/messages/${ msg.id }" class="message-link"/>
         <a href="/users/${ msg.user_id }">
-          <img src="${ user.image_url }" alt="" class="timeline-image">
+          <img alt="" class="timeline-image">
         </a>
         <div class="message-area">
-          <a href="/users/"${ msg.user_id }">@${ user.username }</a>
+          <a href="/users/${ msg.user_id }" class="message-username"></a>
           <span class="text-muted">${date.getDate()} ${months[date.getMonth()]} ${date.getFullYear()}</span>
-          <p>${ msg.text }</p>
+          <p></p>
         </div>
       </li>`);
-        $messages.prepend($newMessage);
 
+    $newMessage.find('img').attr('src', msg.thumb_url);
+    $newMessage.find('.message-username').text(`@${ msg.username }`);
+    $newMessage.find('p').text(msg.text);
+
+    return $newMessage;
+}
+
+/** listenForMessages: prepends warbles pushed over /stream to the timeline
+ *
+ * The timeline's data-stream says what belongs on it: "feed" for the home
+ * feed, "user-<id>" for one user's own profile page.
+ */
+function listenForMessages() {
+    const stream = $messages.data('stream');
+
+    if (!stream) {
+        return;
     }
 
-    $messageModal.after(
-        `<div class="alert alert-success mb-4">Message added!</div>`
-    )
+    const source = new EventSource('/stream');
 
-    $messageModal.modal('hide');
+    source.onmessage = function (evt) {
+        const msg = JSON.parse(evt.data);
+
+        if (stream === 'feed' || stream === `user-${ msg.user_id }`) {
+            $messages.prepend(messageHTML(msg));
+        }
+    };
+
+    // We fell too far behind the server; start over from a fresh page
+    source.addEventListener('reset', function () {
+        source.close();
+        window.location.reload();
+    });
 }
 
 $newMessageButton.on('click', function () {
@@ -82,4 +108,5 @@ $newMessageButton.on('click', function () {
 
 $likeForm.on('submit', like);
 $newMessageForm.on('submit', addTweet);
+listenForMessages();
 
@@ -0,0 +1,30 @@
+"""Template compilation caching and warm-up."""
+
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_templates(app):
+    """Set up the bytecode cache and precompile templates if configured.
+
+    With a preloaded gunicorn app the warm-up runs once in the master, so
+    forked workers start with every template already compiled; the disk
+    cache lets the next boot skip parsing altogether.
+    """
+
+    cache_dir = app.config['JINJA_CACHE_DIR']
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    if app.config['JINJA_PRECOMPILE']:
+        precompile_templates(app)
+
+
+def precompile_templates(app):
+    """Compile every template into the environment's in-memory cache."""
+
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
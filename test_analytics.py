@@ -0,0 +1,115 @@
+"""Analytics snapshot tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_analytics.py
+
+
+import os
+import tempfile
+from datetime import date, datetime
+from unittest import TestCase
+
+from models import db, Follows, Like, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from analytics import (Snapshot, daily_actives, follower_distribution, posting_rates,
+                       take_snapshot)
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class AnalyticsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        users = [User.signup(f"u{n}", f"u{n}@email.com", "password", None) for n in range(3)]
+        db.session.flush()
+        u0, u1, u2 = self.ids = [user.id for user in users]
+
+        m1 = Message(text="day one", user_id=u0, timestamp=datetime(2024, 3, 1, 9))
+        m2 = Message(text="day one again", user_id=u0, timestamp=datetime(2024, 3, 1, 23))
+        m3 = Message(text="day two", user_id=u1, timestamp=datetime(2024, 3, 2, 0, 30))
+        db.session.add_all([m1, m2, m3])
+        db.session.flush()
+
+        db.session.add_all([
+            Like(user_id=u2, message_id=m1.id, created_at=datetime(2024, 3, 1, 12)),
+            Like(user_id=u0, message_id=m3.id, created_at=datetime(2024, 3, 2, 8)),
+            Follows(user_being_followed_id=u0, user_following_id=u1),
+            Follows(user_being_followed_id=u0, user_following_id=u2),
+            Follows(user_being_followed_id=u1, user_following_id=u0),
+        ])
+        db.session.commit()
+
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.dir.cleanup()
+
+    def test_queries(self):
+        '''Tests daily actives, posting rates and follower counts'''
+        take_snapshot(self.dir.name)
+        snapshot = Snapshot(self.dir.name)
+
+        self.assertEqual(daily_actives(snapshot), {date(2024, 3, 1): 2, date(2024, 3, 2): 2})
+        self.assertEqual(posting_rates(snapshot), {date(2024, 3, 1): 2, date(2024, 3, 2): 1})
+        self.assertEqual(follower_distribution(snapshot), {0: 1, 1: 1, 2: 1})
+
+    def test_incremental(self):
+        '''Tests that a second snapshot only copies rows past the watermark'''
+        self.assertEqual(take_snapshot(self.dir.name),
+                         {'users': 3, 'messages': 3, 'likes': 2, 'follows': 3})
+
+        u0, u1, u2 = self.ids
+        db.session.add_all([
+            Message(text="later", user_id=u2, timestamp=datetime(2024, 3, 2, 10)),
+            Follows(user_being_followed_id=u2, user_following_id=u0),
+        ])
+        db.session.commit()
+
+        self.assertEqual(take_snapshot(self.dir.name),
+                         {'users': 0, 'messages': 1, 'likes': 0, 'follows': 4})
+
+        snapshot = Snapshot(self.dir.name)
+        self.assertEqual(len(snapshot.manifest['tables']['messages']['segments']), 2)
+        self.assertEqual(list(snapshot.column('messages', 'user_id')), [u0, u0, u1, u2])
+        self.assertEqual(posting_rates(snapshot)[date(2024, 3, 2)], 2)
+        self.assertEqual(follower_distribution(snapshot), {1: 2, 2: 1})
+
+    def test_null_likes_skipped(self):
+        '''Tests that likes missing their user or message aren't copied'''
+        db.session.add(Like(user_id=self.ids[0], message_id=None))
+        db.session.commit()
+
+        self.assertEqual(take_snapshot(self.dir.name)['likes'], 2)
+        self.assertEqual(len(Snapshot(self.dir.name).column('likes', 'message_id')), 2)
+
+    def test_full_rebuild(self):
+        '''Tests that --full drops deleted rows and the old segment files'''
+        take_snapshot(self.dir.name)
+        Message.query.filter_by(user_id=self.ids[1]).delete()
+        db.session.commit()
+
+        take_snapshot(self.dir.name)
+        self.assertEqual(len(Snapshot(self.dir.name).column('messages', 'id')), 3)
+
+        take_snapshot(self.dir.name, full=True)
+        snapshot = Snapshot(self.dir.name)
+        self.assertEqual(len(snapshot.column('messages', 'id')), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.dir.name, 'messages'))), 3)
+
+    def test_no_snapshot(self):
+        '''Tests that queries over a missing snapshot come back empty'''
+        snapshot = Snapshot(self.dir.name)
+
+        self.assertIsNone(snapshot.taken_at)
+        self.assertEqual(posting_rates(snapshot), {})
+        self.assertEqual(follower_distribution(snapshot), {})
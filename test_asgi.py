@@ -0,0 +1,172 @@
+"""ASGI layer tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asgi.py
+
+
+import asyncio
+import gzip
+import json
+import os
+from unittest import IsolatedAsyncioTestCase
+
+from models import db, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+import asgi
+from app import CURR_USER_KEY, create_app
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+async def call(path, user_id=None, query_string=b''):
+    '''Send one GET through the ASGI app; return (status, JSON body)'''
+
+    start, body = await send_request(path, user_id, query_string)
+    return start['status'], json.loads(body)
+
+
+def session_cookie(user_id):
+    '''Cookie header of a session logged in as `user_id`'''
+
+    client = asgi.flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+    [cookie] = client.cookie_jar
+    return (b'cookie', f"{cookie.name}={cookie.value}".encode())
+
+
+async def send_request(path, user_id=None, query_string=b'', headers=()):
+    '''Send one GET through the ASGI app; return (response start event, body)'''
+
+    headers = list(headers)
+    if user_id is not None:
+        headers.append(session_cookie(user_id))
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path,
+             'query_string': query_string, 'headers': headers}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(event):
+        sent.append(event)
+
+    await asgi.app(scope, receive, send)
+
+    return sent[0], sent[1]['body']
+
+
+class AsgiApiTestCase(IsolatedAsyncioTestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    async def asyncTearDown(self):
+        # Each test runs in its own event loop; don't reuse pooled connections
+        await asgi.get_engine().dispose()
+
+    async def test_show_message(self):
+        '''Tests that a message is read through the async engine'''
+        status, body = await call(f'/api/messages/{self.m1_id}', self.u1_id)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['message']['text'], 'm1-text')
+        self.assertEqual(body['message']['username'], 'u2')
+
+    async def test_feed_only_followed(self):
+        '''Tests that the async feed leaves out users not followed'''
+        status, body = await call('/api/feed', self.u1_id)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['messages'], [])
+
+    async def test_list_users_search(self):
+        '''Tests that the async user list filters by username'''
+        status, body = await call('/api/users', self.u1_id, b'q=u2')
+
+        self.assertEqual(status, 200)
+        self.assertEqual([user['username'] for user in body['users']], ['u2'])
+
+    async def test_list_users_paged(self):
+        '''Tests that the async user list comes a page at a time'''
+        status, body = await call('/api/users', self.u1_id, b'limit=1&page=2')
+
+        self.assertEqual((body['page'], body['has_next']), (2, False))
+        self.assertEqual([user['username'] for user in body['users']], ['u2'])
+
+    async def test_compressed(self):
+        '''Tests that large JSON responses are gzipped for clients that accept them'''
+        for n in range(20):
+            User.signup(f"user{n}", f"user{n}@email.com", "password", None)
+        db.session.commit()
+
+        start, body = await send_request('/api/users', self.u1_id,
+                                         headers=[(b'accept-encoding', b'gzip, deflate')])
+        headers = dict(start['headers'])
+
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(int(headers[b'content-length']), len(body))
+        self.assertEqual(len(json.loads(gzip.decompress(body))['users']), 22)
+
+        # Small responses aren't worth it
+        start, body = await send_request(f'/api/messages/{self.m1_id}', self.u1_id,
+                                         headers=[(b'accept-encoding', b'gzip')])
+        self.assertNotIn(b'content-encoding', dict(start['headers']))
+
+    async def test_logged_out(self):
+        '''Tests that the async endpoints reject logged out users'''
+        status, body = await call(f'/api/users/{self.u2_id}')
+
+        self.assertEqual(status, 401)
+        self.assertEqual(body['message'], 'Access unauthorized.')
+
+    async def test_stream(self):
+        '''Tests that /stream runs on the event loop until the client leaves'''
+        broker = asgi.flask_app.extensions['pubsub']
+        scope = {'type': 'http', 'method': 'GET', 'path': '/stream', 'query_string': b'',
+                 'headers': [session_cookie(self.u1_id)]}
+        left = asyncio.Event()
+        sent = []
+
+        async def receive():
+            await left.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(event):
+            sent.append(event)
+            if event.get('body', b'').startswith(b'data:'):
+                left.set()
+
+        task = asyncio.ensure_future(asgi.app(scope, receive, send))
+        while not broker.count:
+            await asyncio.sleep(0.01)
+
+        # Published from a Flask thread, as add_message does
+        await asyncio.to_thread(broker.publish, [self.u1_id], {'id': 1})
+        await asyncio.wait_for(task, 5)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[1]['body'], b'data: {"id": 1}\n\n')
+        self.assertEqual(broker.count, 0)
@@ -0,0 +1,129 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import url_for
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app
+from assets import build_assets, init_assets, minify_css
+
+
+class AssetBuildTestCase(TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+
+        with open(os.path.join(self.static, 'images', 'bg.png'), 'wb') as file:
+            file.write(b'\x89PNG not really')
+        with open(os.path.join(self.static, 'script.js'), 'w') as file:
+            file.write("function hello() {\n    return 'hello';\n}\n" * 20)
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'w') as file:
+            file.write('/* nav */\n.nav {\n  background: url("/static/images/bg.png");\n}\n'
+                       '.logo { background: url(../images/bg.png); color: red; }\n'
+                       '.remote { background: url(https://example.com/a.png); }\n')
+
+        self.app = create_app('testing')
+        self.app.static_folder = self.static
+        self.app.config['ASSET_MANIFEST'] = True
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def read(self, name):
+        with open(os.path.join(self.static, 'dist', name), 'rb') as file:
+            return file.read()
+
+    def test_minify_css(self):
+        '''Tests that comments and whitespace go but selectors keep their meaning'''
+        self.assertEqual(minify_css("/* x */\na :hover ,\nb > c {\n  color: red;\n}\n"),
+                         "a :hover,b > c{color: red}")
+
+    def test_build(self):
+        '''Tests fingerprinting, CSS url rewriting and precompression'''
+        manifest = build_assets(self.static)
+
+        self.assertRegex(manifest['script.js'], r'^script\.[0-9a-f]{8}\.js$')
+        self.assertEqual(json.loads(self.read('manifest.json')), manifest)
+
+        css = self.read(manifest['stylesheets/style.css']).decode()
+        image = manifest['images/bg.png']
+        self.assertEqual(css.count(f'url("../{image}")'), 2)
+        self.assertIn('url(https://example.com/a.png)', css)
+        self.assertNotIn('/*', css)
+        self.assertNotIn('\n', css)
+
+        script = self.read(manifest['script.js'])
+        self.assertEqual(gzip.decompress(self.read(manifest['script.js'] + '.gz')), script)
+        # Images aren't worth compressing
+        self.assertFalse(os.path.exists(os.path.join(self.static, 'dist', image + '.gz')))
+
+    def test_rebuild_is_stable(self):
+        '''Tests that unchanged files keep their names and changed ones don't'''
+        first = build_assets(self.static)
+        with open(os.path.join(self.static, 'script.js'), 'a') as file:
+            file.write("// changed\n")
+        second = build_assets(self.static)
+
+        self.assertEqual(first['stylesheets/style.css'], second['stylesheets/style.css'])
+        self.assertNotEqual(first['script.js'], second['script.js'])
+        # The old build stays for pages rendered before the deploy
+        self.assertTrue(self.read(first['script.js']))
+
+    def test_serving(self):
+        '''Tests that built files are linked and served compressed and immutable'''
+        manifest = build_assets(self.static)
+        init_assets(self.app)
+        client = self.app.test_client()
+
+        with self.app.test_request_context():
+            url = url_for('static', filename='script.js')
+        self.assertEqual(url, f"/static/dist/{manifest['script.js']}")
+
+        resp = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(resp.mimetype, 'text/javascript')
+        self.assertEqual(gzip.decompress(resp.data), self.read(manifest['script.js']))
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertEqual(resp.cache_control.max_age, self.app.config['ASSET_MAX_AGE'])
+        self.assertFalse(resp.cache_control.no_store)
+        self.assertIn('Accept-Encoding', resp.vary)
+        resp.close()
+
+        resp = client.get(url)
+        self.assertIsNone(resp.content_encoding)
+        self.assertEqual(resp.data, self.read(manifest['script.js']))
+        resp.close()
+
+        # Files outside the build are served as before
+        resp = client.get('/static/script.js')
+        self.assertTrue(resp.cache_control.no_store)
+        resp.close()
+
+    def test_pages_link_built_assets(self):
+        '''Tests that templates link the built stylesheet and script'''
+        manifest = build_assets(self.static)
+        init_assets(self.app)
+
+        html = self.app.test_client().get('/login').get_data(as_text=True)
+        self.assertIn(f"/static/dist/{manifest['stylesheets/style.css']}", html)
+        self.assertIn(f"/static/dist/{manifest['script.js']}", html)
+
+    def test_unbuilt(self):
+        '''Tests that without a build, static files are linked as they are'''
+        init_assets(self.app)
+
+        html = self.app.test_client().get('/login').get_data(as_text=True)
+        self.assertIn('href="/static/stylesheets/style.css"', html)
@@ -0,0 +1,111 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+import os
+import re
+import zlib
+from unittest import TestCase
+
+from werkzeug.http import parse_accept_header
+
+from models import db, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from compression import ENCODINGS, Encoder, compress_stream, negotiate
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+GZIP = {'Accept-Encoding': 'gzip, deflate'}
+
+# CSRF tokens are masked differently on every page
+TOKEN_RE = re.compile(rb'(name="csrf-token" content|name="csrf_token" type="hidden" value)="[^"]+"')
+
+
+def without_tokens(html):
+    return TOKEN_RE.sub(rb'\1=""', html)
+
+
+class EncodingTestCase(TestCase):
+    def test_negotiate(self):
+        '''Tests picking an encoding from Accept-Encoding'''
+        self.assertEqual(negotiate(parse_accept_header('gzip, deflate')), 'gzip')
+        self.assertEqual(negotiate(parse_accept_header('*')), ENCODINGS[0])
+        self.assertIsNone(negotiate(parse_accept_header('identity')))
+        self.assertIsNone(negotiate(parse_accept_header('gzip;q=0, deflate')))
+
+    def test_stream_flushes(self):
+        '''Tests that a stream is decodable at every flush, not only at the end'''
+        chunks = [f"<li>message {n}</li>".encode() * 50 for n in range(10)]
+        out = list(compress_stream(chunks, Encoder('gzip', app.config), flush_every=2000))
+
+        # Everything up to the last flush decodes before the stream ends
+        page = b''.join(chunks)
+        decoded = zlib.decompressobj(31).decompress(b''.join(out[:-1]))
+        self.assertTrue(page.startswith(decoded))
+        self.assertGreater(len(decoded), len(page) - 2000)
+
+        self.assertEqual(gzip.decompress(b''.join(out)), b''.join(chunks))
+
+
+class CompressedViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.flush()
+        db.session.add_all([Message(text=f"warble {n}", user_id=u1.id) for n in range(30)])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_page_compressed(self):
+        '''Tests that HTML pages are gzipped for clients that accept it'''
+        plain = self.client.get('/users')
+        resp = self.client.get('/users', headers=GZIP)
+
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertEqual(without_tokens(gzip.decompress(resp.data)), without_tokens(plain.data))
+        self.assertLess(len(resp.data), len(plain.data))
+        self.assertIsNone(plain.content_encoding)
+
+    def test_streamed_page_compressed(self):
+        '''Tests that streamed timelines are compressed as they stream'''
+        plain = self.client.get('/')
+        resp = self.client.get('/', headers=GZIP)
+
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(without_tokens(gzip.decompress(resp.data)), without_tokens(plain.data))
+        self.assertIn(b'warble 29', plain.data)
+
+    def test_small_and_other_responses_untouched(self):
+        '''Tests that small JSON, errors and static files aren't compressed'''
+        resp = self.client.get('/api/trending', headers=GZIP)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.content_encoding)
+
+        resp = self.client.get('/api/search', headers=GZIP)
+        self.assertEqual(resp.status_code, 400)
+        self.assertIsNone(resp.content_encoding)
+
+        resp = self.client.get('/static/script.js', headers=GZIP)
+        self.assertIsNone(resp.content_encoding)
+        resp.close()
@@ -0,0 +1,102 @@
+"""Data export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_exports.py
+
+
+import csv
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, Follows, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from exports import export_chunks
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        db.session.add_all([
+            Message(text="m1-text", user_id=u1.id),
+            Follows(user_being_followed_id=u1.id, user_following_id=u2.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        app.config['ADMIN_USERNAMES'] = {"u1"}
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['ADMIN_USERNAMES'] = set()
+
+    def test_csv_matches_seed_format(self):
+        '''Tests that CSV exports have the seed file headers and every row'''
+        rows = list(csv.DictReader(''.join(export_chunks('users', 'csv', include_secrets=True))
+                                   .splitlines()))
+
+        self.assertEqual([row['username'] for row in rows], ["u1", "u2"])
+        self.assertTrue(rows[0]['password'].startswith('$2b$'))
+
+        with open('generator/users.csv') as seed_file:
+            seed_headers = next(csv.reader(seed_file))
+        self.assertTrue(set(seed_headers) <= set(rows[0]))
+
+    def test_ndjson(self):
+        '''Tests that NDJSON exports one JSON object per line'''
+        lines = ''.join(export_chunks('follows', 'ndjson')).splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"user_being_followed_id": self.u1_id, "user_following_id": self.u2_id}])
+
+    def test_cli_export(self):
+        '''Tests that flask export writes one file per table'''
+        with tempfile.TemporaryDirectory() as out_dir:
+            result = app.test_cli_runner().invoke(
+                args=['export', '--output-dir', out_dir])
+
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(sorted(os.listdir(out_dir)),
+                             ['follows.csv', 'messages.csv', 'users.csv'])
+
+    def test_http_export_admin(self):
+        '''Tests that admins can download exports, without password hashes'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get('/admin/export/users.csv')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("u2@email.com", html)
+            self.assertNotIn("password", html)
+
+    def test_http_export_not_admin(self):
+        '''Tests that other users cannot download exports'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.get('/admin/export/users.csv')
+
+            self.assertEqual(resp.status_code, 302)
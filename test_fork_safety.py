@@ -0,0 +1,66 @@
+"""Fork safety tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fork_safety.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+
+
+def backend_pid():
+    '''Postgres server process serving this session's connection'''
+
+    pid = db.session.execute(text("SELECT pg_backend_pid()")).scalar()
+    db.session.commit()
+    return pid
+
+
+class ForkSafetyTestCase(TestCase):
+    def tearDown(self):
+        db.session.remove()
+
+    def test_create_app_opens_no_connections(self):
+        '''Building an app doesn't check out a connection before fork'''
+        new_app = create_app('testing')
+
+        with new_app.app_context():
+            self.assertEqual(db.engine.pool.checkedin(), 0)
+            self.assertEqual(db.engine.pool.checkedout(), 0)
+
+    def test_forked_child_gets_own_connection(self):
+        '''A forked worker never reuses the parent's pooled connection'''
+        parent_pid = backend_pid()
+        db.session.remove()
+
+        read_fd, write_fd = os.pipe()
+        child = os.fork()
+
+        if child == 0:
+            os.close(read_fd)
+            try:
+                os.write(write_fd, str(backend_pid()).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as reader:
+            child_pid = int(reader.read())
+        os.waitpid(child, 0)
+
+        self.assertNotEqual(child_pid, parent_pid)
+
+        # The parent's connection must still be usable after the child ran
+        self.assertEqual(backend_pid(), parent_pid)
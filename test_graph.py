@@ -0,0 +1,225 @@
+"""Follow graph index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Follows, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+import graph
+from graph import FollowGraph
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class FollowGraphTestCase(TestCase):
+    def setUp(self):
+        # 1 -> 2, 1 -> 3, 2 -> 1, 3 -> 2, 4 -> 2
+        self.graph = FollowGraph([(1, 2), (1, 3), (2, 1), (3, 2), (4, 2)])
+
+    def test_lookups(self):
+        '''Tests membership, neighbours and counts in both directions'''
+        self.assertTrue(self.graph.is_following(1, 2))
+        self.assertFalse(self.graph.is_following(2, 3))
+        self.assertFalse(self.graph.is_following(99, 1))
+
+        self.assertEqual(self.graph.following_ids(1), {2, 3})
+        self.assertEqual(self.graph.follower_ids(2), {1, 3, 4})
+        self.assertEqual(self.graph.following_count(4), 1)
+        self.assertEqual(self.graph.follower_count(2), 3)
+        self.assertEqual(self.graph.follower_count(99), 0)
+
+    def test_mutuals_and_known_followers(self):
+        '''Tests mutual follows and followers among the people you follow'''
+        self.assertEqual(self.graph.mutual_ids(1), {2})
+        self.assertEqual(self.graph.followed_by_followees(1, 2), {3})
+        self.assertEqual(self.graph.followed_by_followees(4, 3), set())
+
+    def test_incremental_updates(self):
+        '''Tests that follow/unfollow apply on top of the packed arrays'''
+        self.graph.follow(2, 3)
+        self.graph.unfollow(1, 2)
+        self.graph.follow(1, 2)
+        self.graph.unfollow(4, 2)
+        self.graph.follow(5, 1)
+
+        self.assertTrue(self.graph.is_following(2, 3))
+        self.assertTrue(self.graph.is_following(1, 2))
+        self.assertFalse(self.graph.is_following(4, 2))
+        self.assertEqual(self.graph.follower_ids(2), {1, 3})
+        self.assertEqual(self.graph.follower_ids(1), {2, 5})
+        self.assertEqual(self.graph.following_count(2), 2)
+        self.assertEqual(len(self.graph), 6)
+
+    def test_remove_user(self):
+        '''Tests that deleting a user drops edges in both directions'''
+        self.graph.remove_user(2)
+
+        self.assertEqual(self.graph.following_ids(1), {3})
+        self.assertEqual(self.graph.follower_ids(2), set())
+        self.assertEqual(self.graph.following_ids(3), set())
+
+    def test_compaction(self):
+        '''Tests that a large overlay is folded back into the arrays'''
+        for user_id in range(10, 10 + graph.COMPACT_MIN):
+            self.graph.follow(user_id, 1)
+
+        self.assertEqual(self.graph.followers.pending, 0)
+        self.assertEqual(self.graph.follower_count(1), graph.COMPACT_MIN + 1)
+        self.assertTrue(self.graph.is_following(10, 1))
+        self.assertTrue(self.graph.is_following(1, 3))
+
+    def test_reads_during_writes(self):
+        '''Tests that reads in one thread are safe while another thread
+        writes and compacts'''
+        errors = []
+
+        def read():
+            try:
+                for _ in range(2000):
+                    self.graph.follower_ids(1)
+                    self.graph.followed_by_followees(2, 1)
+            except Exception as exc:
+                errors.append(exc)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        for user_id in range(10, 10 + 3 * graph.COMPACT_MIN):
+            self.graph.follow(user_id, 1)
+        reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.graph.follower_count(1), 3 * graph.COMPACT_MIN + 1)
+
+    def test_changes_during_rebuild_replayed(self):
+        '''Tests that changes made while a rebuild loads reach the new graph,
+        including ones made through the old graph after the swap'''
+        self.assertTrue(self.graph.start_rebuild())
+        self.assertFalse(self.graph.start_rebuild())
+
+        # Loaded from the database before these changes landed
+        new = FollowGraph([(1, 2), (1, 3), (2, 1), (3, 2), (4, 2)])
+        self.graph.follow(5, 1)
+        self.graph.unfollow(1, 2)
+        self.graph.replace(new)
+        self.graph.follow(6, 1)
+
+        self.assertEqual(new.follower_ids(1), {2, 5, 6})
+        self.assertFalse(new.is_following(1, 2))
+
+
+class FollowGraphViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        db.session.add_all([
+            Follows(user_following_id=u1.id, user_being_followed_id=u2.id),
+            Follows(user_following_id=u2.id, user_being_followed_id=u3.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        # Enabled for this app only; built on first use
+        app.extensions['follow_graph'] = None
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        del app.extensions['follow_graph']
+
+    def test_follow_updates_index(self):
+        '''Tests that following and unfollowing update the built index'''
+        self.client.get('/')
+        index = app.extensions['follow_graph']
+
+        self.client.post(f'/users/follow/{self.u3_id}')
+        self.assertTrue(index.is_following(self.u1_id, self.u3_id))
+
+        self.client.post(f'/users/stop-following/{self.u2_id}')
+        self.assertFalse(index.is_following(self.u1_id, self.u2_id))
+        self.assertIs(app.extensions['follow_graph'], index)
+
+    def test_profile_counts_and_known_followers(self):
+        '''Tests that profile stats and "Followed by" come from the index'''
+        resp = self.client.get(f'/users/{self.u3_id}')
+        html = resp.get_data(as_text=True)
+
+        self.assertIn('Followed by', html)
+        self.assertIn('@u2</a>', html)
+        self.assertIsNotNone(app.extensions['follow_graph'])
+
+    def test_stale_index_rebuilt(self):
+        '''Tests that an index older than FOLLOW_GRAPH_MAX_AGE is rebuilt
+        once, in the background, while requests use the old one'''
+        self.client.get('/')
+        index = app.extensions['follow_graph']
+        index.built_at -= app.config['FOLLOW_GRAPH_MAX_AGE'] + 1
+
+        started, release = threading.Event(), threading.Event()
+        loads = []
+        load = graph.load_follow_graph
+
+        def slow_load():
+            loads.append(threading.current_thread())
+            started.set()
+            release.wait(5)
+            return load()
+
+        with patch('graph.load_follow_graph', slow_load):
+            self.client.get('/')
+            started.wait(5)
+            self.client.get('/')
+            self.client.post(f'/users/follow/{self.u3_id}')
+            self.assertIs(app.extensions['follow_graph'], index)
+
+            release.set()
+            loads[0].join(5)
+
+        self.assertEqual(len(loads), 1)
+        self.assertIsNot(app.extensions['follow_graph'], index)
+        self.assertTrue(app.extensions['follow_graph'].is_following(self.u1_id, self.u3_id))
+
+
+class FollowFallbackTestCase(TestCase):
+    def test_known_followers_without_index(self):
+        '''Tests the SQL fallback for followers among the people you follow'''
+        User.query.delete()
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        u1.following.append(u2)
+        u2.following.append(u3)
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = u1.id
+
+        html = client.get(f'/users/{u3.id}').get_data(as_text=True)
+        self.assertIn('@u2</a>', html)
+        db.session.rollback()
@@ -0,0 +1,207 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_images.py
+
+
+import hashlib
+import os
+import socket
+import tempfile
+from importlib.util import find_spec
+from io import BytesIO
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from urllib.error import URLError
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from images import ImageCache, ImagePipeline
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+with open(os.path.join(app.static_folder, 'images', 'default-pic.png'), 'rb') as file:
+    DEFAULT_PIC = file.read()
+
+
+class ImageCacheTestCase(TestCase):
+    def test_store_lookup_evict(self):
+        '''Tests that the least recently used variants are evicted first'''
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ImageCache(directory, max_bytes=450)
+            cache.store('/a.png', 'a' * 64, {'thumb': b'x' * 100})
+            cache.store('/b.png', 'b' * 64, {'thumb': b'x' * 100})
+            self.assertTrue(cache.lookup('/a.png', 'thumb').endswith('.thumb.jpg'))
+            self.assertIsNone(cache.lookup('/a.png', 'header'))
+
+            os.utime(cache.path('a' * 64, 'thumb'), (0, 0))
+            cache.store('/c.png', 'c' * 64, {'thumb': b'x' * 100})
+
+            self.assertIsNone(cache.lookup('/a.png', 'thumb'))
+            self.assertIsNotNone(cache.lookup('/b.png', 'thumb'))
+            self.assertIsNotNone(cache.lookup('/c.png', 'thumb'))
+
+    def test_only_public_urls_fetched(self):
+        '''Tests that the proxy won't fetch from the server's own network'''
+        pipeline = ImagePipeline(app)
+        with patch('images.socket.create_connection') as connect:
+            for url in ["http://127.0.0.1/a.png", "http://10.0.0.1/a.png",
+                        "http://169.254.169.254/latest/meta-data", "https://[::1]/a.png",
+                        "file:///etc/passwd"]:
+                with self.assertRaises(ValueError):
+                    pipeline.fetch(url)
+        connect.assert_not_called()
+
+    def test_connects_to_checked_address(self):
+        '''Tests that the fetch connects to the address it checked, not a fresh lookup'''
+        lookups = iter([[(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 80))],
+                        [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 80))]])
+
+        with patch('images.socket.getaddrinfo', lambda *args, **kwargs: next(lookups)), \
+                patch('images.socket.create_connection', side_effect=OSError) as connect:
+            with self.assertRaises(URLError):
+                ImagePipeline(app).fetch("http://rebind.example/a.png")
+
+        self.assertEqual(connect.call_args[0][0], ('93.184.216.34', 80))
+
+    def test_failures_bounded(self):
+        '''Tests that only the most recent failures are remembered'''
+        app.config['IMAGE_FAILED_MAX'] = 2
+        try:
+            pipeline = ImagePipeline(app)
+        finally:
+            app.config['IMAGE_FAILED_MAX'] = 10_000
+
+        for source in ["/a.png", "/b.png", "/c.png"]:
+            pipeline.record_failure(source)
+
+        self.assertEqual(list(pipeline.failed), ["/b.png", "/c.png"])
+        self.assertTrue(pipeline.recently_failed("/c.png"))
+        self.assertFalse(pipeline.recently_failed("/a.png"))
+
+
+class ImageViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        self.dirs = tempfile.TemporaryDirectory()
+        app.config['IMAGE_CACHE_DIR'] = os.path.join(self.dirs.name, 'cache')
+        app.config['IMAGE_UPLOAD_DIR'] = os.path.join(self.dirs.name, 'uploads')
+        self.pipeline = app.extensions['images'] = ImagePipeline(app)
+        self.pipeline.enabled = True
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        self.dirs.cleanup()
+
+    def edit_profile(self, **files):
+        return self.client.post('/users/profile', content_type='multipart/form-data', data={
+            "username": "u1", "email": "u1@email.com", "password": "password", **files})
+
+    def test_urls_rewritten(self):
+        '''Tests that pages link to resized variants of avatars'''
+        html = self.client.get(f'/users/{self.u1_id}').get_data(as_text=True)
+        url = self.pipeline.url("/static/images/default-pic.png", 'avatar')
+
+        self.assertTrue(url.startswith("/images/avatar/"))
+        self.assertIn(url, html)
+        self.assertNotIn('src="/static/images/default-pic.png"', html)
+
+        self.pipeline.enabled = False
+        self.assertEqual(self.pipeline.url("/a.png", 'avatar'), "/a.png")
+
+    def test_forged_urls_rejected(self):
+        '''Tests that only signed sources and known variants are served'''
+        token = self.pipeline.token("http://example.com/a.png")
+
+        self.assertEqual(self.client.get(f'/images/huge/{token}').status_code, 404)
+        self.assertEqual(self.client.get(f'/images/thumb/{token}x').status_code, 404)
+
+    def test_serves_from_cache(self):
+        '''Tests that a cached variant is served with a long max-age'''
+        source = "/static/images/default-pic.png"
+        self.pipeline.cache.store(source, 'd' * 64, {'thumb': b'small jpeg'})
+
+        resp = self.client.get(self.pipeline.url(source, 'thumb'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/jpeg')
+        self.assertEqual(resp.data, b'small jpeg')
+        self.assertEqual(resp.cache_control.max_age, app.config['IMAGE_MAX_AGE'])
+        resp.close()
+
+    def test_same_image_processed_once(self):
+        '''Tests that variants are shared by sources with the same bytes'''
+        digest = hashlib.sha256(DEFAULT_PIC).hexdigest()
+        self.pipeline.cache.store("/static/images/default-pic.png", digest,
+                                  {name: b'resized' for name in self.pipeline.sizes})
+
+        self.edit_profile(image_file=(BytesIO(DEFAULT_PIC), "me.png"))
+        upload = User.query.get(self.u1_id).image_url
+
+        resp = self.client.get(self.pipeline.url(upload, 'thumb'))
+        self.assertEqual(resp.data, b'resized')
+        resp.close()
+
+    def test_unprocessable_image_redirects(self):
+        '''Tests that an image that can't be resized falls back to the original'''
+        source = "/static/script.js"
+        url = self.pipeline.url(source, 'thumb')
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, source)
+        self.assertIn(source, self.pipeline.failed)
+
+    def test_upload(self):
+        '''Tests that uploads are stored by content and served'''
+        resp = self.edit_profile(image_file=(BytesIO(b'not really a png'), "me.png"),
+                                 header_image_file=(BytesIO(b'header'), "header.jpg"))
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.get(self.u1_id)
+        self.assertEqual(user.image_url,
+                         f"/images/uploads/{hashlib.sha256(b'not really a png').hexdigest()}.png")
+        self.assertTrue(user.header_image_url.endswith(".jpg"))
+
+        resp = self.client.get(user.image_url)
+        self.assertEqual(resp.data, b'not really a png')
+        resp.close()
+
+    def test_upload_rejected(self):
+        '''Tests that non-images and oversized uploads are refused'''
+        html = self.edit_profile(image_file=(BytesIO(b'x'), "me.exe")).get_data(as_text=True)
+        self.assertIn("Images only!", html)
+
+        self.pipeline.max_bytes = 10
+        html = self.edit_profile(image_file=(BytesIO(b'x' * 11), "me.png")).get_data(as_text=True)
+        self.assertIn("Images can be at most", html)
+        self.assertEqual(User.query.get(self.u1_id).image_url, "/static/images/default-pic.png")
+
+    @skipUnless(find_spec('PIL'), "needs Pillow")
+    def test_resize(self):
+        '''Tests that sources are resized to every variant'''
+        from PIL import Image
+
+        resp = self.client.get(self.pipeline.url("/static/images/warbler-hero.jpg", 'header'))
+        with Image.open(BytesIO(resp.data)) as image:
+            self.assertEqual(image.size, app.config['IMAGE_VARIANTS']['header'])
+        resp.close()
+
+        path = self.pipeline.cache.lookup("/static/images/warbler-hero.jpg", 'thumb')
+        with Image.open(path) as image:
+            self.assertEqual(image.size, app.config['IMAGE_VARIANTS']['thumb'])
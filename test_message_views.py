@@ -7,39 +7,36 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, Message, User, connect_db
+from datetime import datetime
+
+from models import db, Follows, Like, Message, StaleRecommendation, User
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
 # before we import our app, since that will have already
 # connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
-
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+from app import create_app, CURR_USER_KEY
 
-# This is a bit of hack, but don't use Flask DebugToolbar
+# The testing profile leaves out the debug toolbar and turns off WTForms
+# CSRF (it's a pain to test)
 
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app('testing')
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-connect_db(app)
-
 db.drop_all()
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class MessageBaseViewTestCase(TestCase):
     def setUp(self):
@@ -69,9 +66,97 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             resp = c.post("/messages/new", json={"text": "Hello", "location": "http://localhost:5001/"}, headers={"Content-Type": "application/json"})
 
             self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('password', resp.json['user'])
 
             Message.query.filter_by(text="Hello").one()
 
+    def test_add_message_publishes(self):
+        '''Tests that a new message is pushed to the author's and followers' streams'''
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=self.u1_id, user_following_id=u2.id))
+        db.session.commit()
+
+        broker = app.extensions['pubsub']
+        own = broker.subscribe(self.u1_id)
+        follower = broker.subscribe(u2.id)
+        stranger = broker.subscribe(u3.id)
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                c.post("/messages/new", json={"text": "Hello"})
+
+            self.assertEqual(own.get(0)['text'], "Hello")
+            self.assertEqual(follower.get(0)['username'], "u1")
+            self.assertIsNone(stranger.get(0))
+        finally:
+            for subscription in (own, follower, stranger):
+                subscription.close()
+
+    def test_add_message_too_long(self):
+        '''Tests that a message over the length limit is rejected'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/messages/new", json={"text": "x" * 141})
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('text', resp.json['errors'])
+
+    def test_add_messages_bulk(self):
+        '''Tests that bulk posting inserts valid items and reports invalid ones'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            items = [{"text": "one"}, {"text": ""}, {"text": "two"}, "three"]
+            resp = c.post("/api/messages/bulk", json={"messages": items})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['created'], 2)
+
+            results = resp.json['results']
+            self.assertEqual(Message.query.get(results[0]['id']).text, "one")
+            self.assertIn('errors', results[1])
+            self.assertEqual(Message.query.get(results[2]['id']).text, "two")
+            self.assertIn('errors', results[3])
+
+    def test_add_messages_bulk_bad_body(self):
+        '''Tests that bulk posting requires a list of messages'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/api/messages/bulk", json={"messages": "one"})
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(Message.query.count(), 1)
+
+    def test_stream_logged_out(self):
+        '''Tests that the message stream rejects logged out users'''
+        with self.client as c:
+            resp = c.get("/stream")
+            self.assertEqual(resp.status_code, 401)
+
+    def test_stream_head_releases_slot(self):
+        '''Tests that a HEAD to the stream doesn't keep a connection slot'''
+        broker = app.extensions['pubsub']
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            for _ in range(app.config['SSE_MAX_PER_USER'] + 1):
+                resp = c.head("/stream")
+                resp.close()
+                self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(broker.count, 0)
+
     def test_add_message_logged_out(self):
         '''Tests that adding a message while logged out is unsuccessful'''
         with self.client as c:
@@ -130,6 +215,65 @@ class MessageDeleteViewTestCase(MessageBaseViewTestCase):
             message = Message.query.get(self.m1_id)
             self.assertIsNotNone(message)
 
+    def test_delete_message_not_owner(self):
+        '''Tests that a user can't delete someone else's message'''
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u2.id
+
+            resp = c.post(f'messages/{self.m1_id}/delete', follow_redirects=True, buffered=True)
+            self.assertIn('Access unauthorized.', resp.get_data(as_text=True))
+
+            self.assertIsNotNone(Message.query.get(self.m1_id))
+
+    def test_delete_messages_in_range(self):
+        '''Tests that bulk deletes take only the user's messages in range, in chunks'''
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        mine = [Message(text=f"old {n}", user_id=self.u1_id, timestamp=datetime(2020, 1, n + 1))
+                for n in range(5)]
+        theirs = Message(text="theirs", user_id=u2.id, timestamp=datetime(2020, 1, 2))
+        db.session.add_all([*mine, theirs])
+        db.session.flush()
+        db.session.add(Like(user_id=u2.id, message_id=mine[0].id))
+        db.session.commit()
+        liked_id = mine[0].id
+        app.extensions['trending'].record(liked_id, 1)
+
+        config = {'MESSAGE_DELETE_CHUNK': 2, 'MESSAGE_DELETE_MAX': 3}
+        body = {'start': '2020-01-01T00:00:00Z', 'end': '2020-02-01T00:00:00Z'}
+        with patch.dict(app.config, config), self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post('/api/messages/delete', json=body)
+            self.assertEqual(resp.json, {'deleted': 3, 'more': True})
+
+            resp = c.post('/api/messages/delete', json=body)
+            self.assertEqual(resp.json, {'deleted': 2, 'more': False})
+
+        remaining = {msg.text for msg in Message.query.all()}
+        self.assertEqual(remaining, {"m1-text", "theirs"})
+        self.assertEqual(Like.query.count(), 0)
+
+        # The liker's recommendations are queued, and trending forgets it
+        self.assertIsNotNone(StaleRecommendation.query.get(u2.id))
+        self.assertNotIn(liked_id, app.extensions['trending'].windows['day'].scores)
+
+    def test_delete_messages_bad_range(self):
+        '''Tests that bulk deletes need a start and end'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post('/api/messages/delete', json={'start': 'yesterday'})
+            self.assertEqual(resp.status_code, 400)
+
+        self.assertIsNotNone(Message.query.get(self.m1_id))
+
 class MessageShowViewTestCase(MessageBaseViewTestCase):
     '''Tests view functions that show messages'''
     def test_show_message(self):
@@ -162,3 +306,39 @@ class MessageShowViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('Access unauthorized.', html)
 
+
+class MessageApiViewTestCase(MessageBaseViewTestCase):
+    '''Tests JSON read endpoints'''
+    def test_api_feed(self):
+        '''Tests that the feed endpoint returns own messages with author'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get('/api/feed')
+            self.assertEqual(resp.status_code, 200)
+
+            messages = resp.json['messages']
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(messages[0]['text'], 'm1-text')
+            self.assertEqual(messages[0]['username'], 'u1')
+
+    def test_api_show_message(self):
+        '''Tests that the message endpoint returns the message'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f'/api/messages/{self.m1_id}')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['message']['id'], self.m1_id)
+
+            resp = c.get('/api/messages/1234356')
+            self.assertEqual(resp.status_code, 404)
+
+    def test_api_logged_out(self):
+        '''Tests that JSON endpoints reject logged out users'''
+        with self.client as c:
+            resp = c.get(f'/api/messages/{self.m1_id}')
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json['message'], 'Access unauthorized.')
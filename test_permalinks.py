@@ -0,0 +1,169 @@
+"""Permalink cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_permalinks.py
+
+
+import asyncio
+import os
+import threading
+from collections import namedtuple
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from models import db, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from permalinks import MISS, PermalinkCache
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+Row = namedtuple('Row', ['id', 'user_id', 'username'])
+
+
+class PermalinkCacheTestCase(TestCase):
+    def test_ttl_and_lru(self):
+        '''Tests that snapshots expire and the least recently used go first'''
+        cache = PermalinkCache(max_size=2, max_age=10)
+        for message_id in (1, 2):
+            future, _ = cache.claim(message_id)
+            cache.settle(message_id, future, Row(message_id, 1, 'u1'), now=0)
+
+        self.assertEqual(cache.cached(1, 5).id, 1)
+        future, _ = cache.claim(3)
+        cache.settle(3, future, None, now=5)
+
+        self.assertIs(cache.cached(2, 5), MISS)
+        self.assertIsNone(cache.cached(3, 5))
+        self.assertIs(cache.cached(1, 11), MISS)
+
+    def test_concurrent_misses_load_once(self):
+        '''Tests that threads missing on the same id share one load'''
+        cache = PermalinkCache(max_size=10, max_age=60)
+        release = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(1)
+            release.wait(5)
+            return Row(1, 1, 'u1')
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(1, load)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual([row.id for row in results], [1] * 5)
+
+    def test_failed_load_not_cached(self):
+        '''Tests that a load error reaches the caller and isn't cached'''
+        cache = PermalinkCache(max_size=10, max_age=60)
+
+        def load():
+            raise RuntimeError("database down")
+
+        with self.assertRaises(RuntimeError):
+            cache.get(1, load)
+        self.assertEqual(cache.get(1, lambda: Row(1, 1, 'u1')).id, 1)
+
+    def test_invalidated_load_not_cached(self):
+        '''Tests that a load racing an invalidation isn't kept'''
+        cache = PermalinkCache(max_size=10, max_age=60)
+        future, leader = cache.claim(1)
+        cache.invalidate_user(1)
+        cache.settle(1, future, Row(1, 1, 'old name'), now=0)
+
+        self.assertTrue(leader)
+        self.assertEqual(future.result().username, 'old name')
+        self.assertIs(cache.cached(1, 0), MISS)
+
+
+class PermalinkCacheAsyncTestCase(IsolatedAsyncioTestCase):
+    async def test_coroutines_share_a_load(self):
+        '''Tests that concurrent coroutines missing on one id load it once'''
+        cache = PermalinkCache(max_size=10, max_age=60)
+        loads = []
+
+        async def load():
+            loads.append(1)
+            await asyncio.sleep(0.01)
+            return Row(1, 1, 'u1')
+
+        rows = await asyncio.gather(*(cache.get_async(1, load) for _ in range(5)))
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual({row.id for row in rows}, {1})
+
+
+class PermalinkViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        msg = Message(text="going viral", user_id=u2.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        app.extensions['permalinks'] = PermalinkCache(max_size=100, max_age=60)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_page_and_json_share_snapshot(self):
+        '''Tests that the permalink and JSON endpoint read one cached snapshot'''
+        self.login(self.u1_id)
+        html = self.client.get(f'/messages/{self.msg_id}').get_data(as_text=True)
+        self.assertIn('going viral', html)
+        self.assertIn('@u2', html)
+
+        # Changed behind the cache's back, so only a cache hit shows the old text
+        Message.query.filter_by(id=self.msg_id).update({'text': 'edited'})
+        db.session.commit()
+
+        resp = self.client.get(f'/api/messages/{self.msg_id}')
+        self.assertEqual(resp.json['message']['text'], 'going viral')
+        self.assertEqual(resp.json['message']['username'], 'u2')
+
+    def test_author_edit_invalidates(self):
+        '''Tests that editing a profile updates the author on their permalinks'''
+        self.login(self.u1_id)
+        self.client.get(f'/messages/{self.msg_id}')
+
+        self.login(self.u2_id)
+        self.client.post('/users/profile', data={
+            'username': 'renamed', 'email': 'u2@email.com', 'password': 'password'})
+
+        html = self.client.get(f'/messages/{self.msg_id}').get_data(as_text=True)
+        self.assertIn('@renamed', html)
+
+    def test_delete_invalidates(self):
+        '''Tests that a deleted message's permalink stops resolving'''
+        self.login(self.u2_id)
+        self.assertEqual(self.client.get(f'/messages/{self.msg_id}').status_code, 200)
+
+        self.client.post(f'/messages/{self.msg_id}/delete')
+
+        self.assertEqual(self.client.get(f'/messages/{self.msg_id}').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/messages/{self.msg_id}').status_code, 404)
@@ -0,0 +1,88 @@
+"""Pub/sub broker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pubsub.py
+
+
+import threading
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from pubsub import (InProcessBroker, TooManySubscribers, async_event_stream, event_stream,
+                    subscribe_async)
+
+
+class InProcessBrokerTestCase(TestCase):
+    def setUp(self):
+        self.broker = InProcessBroker(max_connections=3, max_per_user=2, queue_size=2)
+
+    def test_publish_reaches_only_recipients(self):
+        '''Tests that events go to subscribers of the listed users only'''
+        s1 = self.broker.subscribe(1)
+        s2 = self.broker.subscribe(2)
+
+        self.broker.publish([1], {'id': 10})
+
+        self.assertEqual(s1.get(0), {'id': 10})
+        self.assertIsNone(s2.get(0))
+
+    def test_connection_caps(self):
+        '''Tests that per-user and per-worker caps reject new subscribers'''
+        self.broker.subscribe(1)
+        self.broker.subscribe(1)
+
+        with self.assertRaises(TooManySubscribers):
+            self.broker.subscribe(1)
+
+        self.broker.subscribe(2)
+
+        with self.assertRaises(TooManySubscribers):
+            self.broker.subscribe(3)
+
+    def test_unsubscribe_frees_slot(self):
+        '''Tests that closing a subscription lets another client connect'''
+        subscriptions = [self.broker.subscribe(user_id) for user_id in (1, 2, 3)]
+        subscriptions[0].close()
+
+        self.broker.subscribe(4)
+        self.assertEqual(self.broker.count, 3)
+
+    def test_overflow_resets_stream(self):
+        '''Tests that a client too slow to drain its queue gets a reset event'''
+        subscription = self.broker.subscribe(1)
+        for i in range(3):
+            self.broker.publish([1], {'id': i})
+
+        events = list(event_stream(subscription, heartbeat=0))
+
+        self.assertEqual(events, ["event: reset\ndata: {}\n\n"])
+        self.assertEqual(self.broker.count, 0)
+
+    def test_heartbeat_and_data(self):
+        '''Tests that silence yields heartbeats and events yield data lines'''
+        subscription = self.broker.subscribe(1)
+        events = event_stream(subscription, heartbeat=0)
+
+        self.assertEqual(next(events), ": heartbeat\n\n")
+
+        self.broker.publish([1], {'id': 1})
+        self.assertEqual(next(events), 'data: {"id": 1}\n\n')
+
+        events.close()
+        self.assertEqual(self.broker.count, 0)
+
+
+class AsyncEventStreamTestCase(IsolatedAsyncioTestCase):
+    async def test_heartbeat_and_data(self):
+        '''Tests that a coroutine stream wakes for events published from other threads'''
+        broker = InProcessBroker(max_connections=3, max_per_user=2, queue_size=2)
+        subscription, ready = subscribe_async(broker, 1)
+        events = async_event_stream(subscription, ready, heartbeat=0.01)
+
+        self.assertEqual(await anext(events), ": heartbeat\n\n")
+
+        threading.Thread(target=broker.publish, args=([1], {'id': 1})).start()
+        chunk = await anext(events)
+        while chunk == ": heartbeat\n\n":
+            chunk = await anext(events)
+        self.assertEqual(chunk, 'data: {"id": 1}\n\n')
@@ -0,0 +1,186 @@
+"""Rate limiting and load shedding tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, Message, RateLimitBucket, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from ratelimit import DatabaseStorage, InProcessStorage, PoolWaitMonitor
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class TokenBucketTestCase(TestCase):
+    def test_burst_then_refill(self):
+        '''Tests that a bucket allows a burst, then refills over the period'''
+        storage = InProcessStorage(max_keys=10)
+
+        self.assertEqual([storage.consume('k', 3, 60, 0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(storage.consume('k', 3, 60, 0), 20)
+        self.assertAlmostEqual(storage.consume('k', 3, 60, 10), 10)
+        self.assertEqual(storage.consume('k', 3, 60, 20), 0)
+
+    def test_buckets_are_per_key_and_bounded(self):
+        '''Tests that clients don't share buckets and old buckets are dropped'''
+        storage = InProcessStorage(max_keys=2)
+        storage.consume('a', 1, 60, 0)
+
+        self.assertEqual(storage.consume('b', 1, 60, 0), 0)
+        storage.consume('c', 1, 60, 0)
+        self.assertEqual(list(storage.buckets), ['b', 'c'])
+
+    def test_database_buckets(self):
+        '''Tests the shared store's burst, refill and purge'''
+        RateLimitBucket.query.delete()
+        db.session.commit()
+        storage = DatabaseStorage()
+
+        self.assertEqual([storage.consume('k', 3, 60, 0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(storage.consume('k', 3, 60, 0), 20)
+        self.assertAlmostEqual(storage.consume('k', 3, 60, 10), 10)
+        self.assertEqual(storage.consume('k', 3, 60, 20), 0)
+        self.assertEqual(storage.consume('other', 3, 60, 20), 0)
+
+        # 'other' is full again 20s after its one token was taken, and the
+        # emptied 'k' after 60s
+        self.assertEqual(storage.purge(79), 1)
+        self.assertEqual(storage.purge(80), 1)
+
+    def test_pool_wait_monitor_decays(self):
+        '''Tests that slow checkouts trip the monitor until they decay away'''
+        monitor = PoolWaitMonitor(threshold=0.5, half_life=1.0)
+        monitor.record(2.0, now=100)
+
+        self.assertTrue(monitor.overloaded(100))
+        self.assertFalse(monitor.overloaded(102))
+        self.assertFalse(PoolWaitMonitor(threshold=None).overloaded(100))
+
+
+class RateLimitViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        msg = Message(text="likeable", user_id=u2.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.msg_id = msg.id
+
+        app.config['RATELIMIT_ENABLED'] = True
+        app.extensions['ratelimit'] = InProcessStorage(max_keys=100)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['RATELIMIT_ENABLED'] = False
+        app.extensions['pool_wait'].average = 0.0
+
+    def test_login_limited_by_ip(self):
+        '''Tests that login attempts past the burst get a 429 page'''
+        burst, _ = app.config['RATELIMIT_POLICIES']['warbler.login']
+        data = {"username": "u1", "password": "wrong"}
+
+        for _ in range(burst):
+            self.assertEqual(self.client.post('/login', data=data).status_code, 200)
+
+        resp = self.client.post('/login', data=data)
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp.headers['Retry-After']), 0)
+
+        # Viewing the form isn't limited
+        self.assertEqual(self.client.get('/login').status_code, 200)
+
+    def test_likes_limited_per_user_as_json(self):
+        '''Tests that AJAX likes past the burst get a JSON 429'''
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        # Refilling slowly, so a slow (e.g. parallel) run can't earn a token back
+        burst = 5
+        with patch.dict(app.config['RATELIMIT_POLICIES'], {'warbler.handle_likes': (burst, 3600)}):
+            for _ in range(burst):
+                self.client.post(f'/messages/{self.msg_id}/likes', json={})
+
+            resp = self.client.post(f'/messages/{self.msg_id}/likes', json={})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.json, {'message': 'Too many requests.'})
+
+    def test_workers_share_database_buckets(self):
+        '''Tests that two app instances (as two workers) draw from one bucket'''
+        RateLimitBucket.query.delete()
+        db.session.commit()
+
+        other = create_app('testing')
+        other.config['RATELIMIT_ENABLED'] = True
+        app.extensions['ratelimit'] = DatabaseStorage()
+        other.extensions['ratelimit'] = DatabaseStorage()
+
+        burst, _ = app.config['RATELIMIT_POLICIES']['warbler.login']
+        data = {"username": "u1", "password": "wrong"}
+        clients = [app.test_client(), other.test_client()]
+
+        for n in range(burst):
+            self.assertEqual(clients[n % 2].post('/login', data=data).status_code, 200)
+
+        self.assertEqual(clients[0].post('/login', data=data).status_code, 429)
+        self.assertEqual(clients[1].post('/login', data=data).status_code, 429)
+
+    def test_load_shedding(self):
+        '''Tests that writes get a 503 while pool waits are high'''
+        monitor = app.extensions['pool_wait']
+        monitor.record(10.0, time.monotonic())
+
+        resp = self.client.post('/login', data={"username": "u1", "password": "password"})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'],
+                         str(app.config['LOAD_SHED_RETRY_AFTER']))
+
+        # Reads aren't shed
+        self.assertEqual(self.client.get('/login').status_code, 200)
+
+    def test_slow_checkouts_shed_logged_in_writes(self):
+        '''Tests that slow pool checkouts are measured for logged-in users and shed writes'''
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        def slow_checkout(*args):
+            time.sleep(0.3)
+
+        app.extensions['pool_wait'] = PoolWaitMonitor(threshold=0.05)
+        # Another test module's app context may be the current one
+        with app.app_context():
+            engine = db.engine
+        # Requests may share the test's app context; start them without a
+        # connection, as a real request does
+        db.session.remove()
+        event.listen(engine, 'checkout', slow_checkout)
+        try:
+            first = self.client.post(f'/messages/{self.msg_id}/likes', json={})
+            second = self.client.post(f'/messages/{self.msg_id}/likes', json={})
+        finally:
+            event.remove(engine, 'checkout', slow_checkout)
+            app.extensions['pool_wait'] = PoolWaitMonitor(app.config['LOAD_SHED_POOL_WAIT'])
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 503)
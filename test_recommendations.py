@@ -0,0 +1,162 @@
+"""Who-to-follow recommendation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Follows, Like, Message, Recommendation, StaleRecommendation, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from graph import CSR
+import recommendations
+from recommendations import likes_changed, recommend_for, refresh_recommendations
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class RecommendForTestCase(TestCase):
+    def test_friends_of_friends_and_colikers(self):
+        '''Tests candidate scoring from follows and shared likes'''
+        # 1 follows 2 and 3; both follow 4; 3 also follows 5
+        follows = CSR([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5)])
+        # 1 and 6 both liked message 100
+        likes = CSR([(1, 100), (6, 100)])
+        likers = CSR([(100, 1), (100, 6)])
+
+        rows = recommend_for(1, follows, likes, likers, top_k=10)
+
+        self.assertEqual([row['candidate_id'] for row in rows], [4, 5, 6])
+        self.assertEqual([row['reason'] for row in rows], ['follows', 'follows', 'likes'])
+
+    def test_skips_self_and_followed(self):
+        '''Tests that users already followed (and yourself) are left out'''
+        follows = CSR([(1, 2), (2, 1), (2, 3), (1, 3)])
+        empty = CSR([])
+
+        self.assertEqual(recommend_for(1, follows, empty, empty, top_k=10), [])
+
+    def test_top_k(self):
+        '''Tests that only the best top_k candidates are kept'''
+        follows = CSR([(1, 2)] + [(2, n) for n in range(10, 20)])
+        empty = CSR([])
+
+        self.assertEqual(len(recommend_for(1, follows, empty, empty, top_k=3)), 3)
+
+
+class RecommendationViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        users = [User.signup(f"u{n}", f"u{n}@email.com", "password", None)
+                 for n in range(1, 5)]
+        db.session.flush()
+        self.u1, self.u2, self.u3, self.u4 = [user.id for user in users]
+
+        # u1 -> u2 -> u3: u3 is a friend of a friend of u1
+        db.session.add_all([
+            Follows(user_following_id=self.u1, user_being_followed_id=self.u2),
+            Follows(user_following_id=self.u2, user_being_followed_id=self.u3),
+        ])
+        message = Message(text="liked", user_id=self.u4)
+        db.session.add(message)
+        db.session.commit()
+        self.message_id = message.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_full_refresh_shown_on_home(self):
+        '''Tests that a full batch run fills the home page aside'''
+        self.assertEqual(refresh_recommendations(full=True), 4)
+
+        html = self.client.get('/').get_data(as_text=True)
+
+        self.assertIn('Who to follow', html)
+        self.assertIn('@u3', html)
+        self.assertIn('Followed by people you follow', html)
+
+    def test_followed_candidates_hidden(self):
+        '''Tests that a candidate followed after the batch run isn't shown'''
+        refresh_recommendations(full=True)
+        self.client.post(f'/users/follow/{self.u3}')
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('Who to follow', html)
+
+    def test_follow_refreshes_followers(self):
+        '''Tests that following someone queues only you, and the batch run
+        recomputes your followers too'''
+        # u2 is followed by u1 only, so u2 following someone refreshes u1 too
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2
+        self.client.post(f'/users/follow/{self.u4}')
+
+        queued = [(row.user_id, row.include_followers) for row in StaleRecommendation.query]
+        self.assertEqual(queued, [(self.u2, True)])
+
+        # A later like keeps the followers flag
+        likes_changed(self.u2, self.message_id)
+        db.session.commit()
+        self.assertTrue(StaleRecommendation.query.get(self.u2).include_followers)
+
+        self.assertEqual(refresh_recommendations(), 2)
+        self.assertEqual(StaleRecommendation.query.count(), 0)
+
+    def test_incremental_refresh(self):
+        '''Tests that a plain run recomputes only queued users'''
+        self.client.post(f'/messages/{self.message_id}/likes')
+        self.assertEqual(refresh_recommendations(), 1)
+
+        self.assertEqual(StaleRecommendation.query.count(), 0)
+        self.assertEqual({rec.user_id for rec in Recommendation.query}, {self.u1})
+        self.assertEqual(refresh_recommendations(), 0)
+
+    def test_like_queues_colikers(self):
+        '''Tests that (un)liking a message queues its other likers too'''
+        db.session.add(Like(user_id=self.u3, message_id=self.message_id))
+        db.session.commit()
+
+        for _ in range(2):
+            self.client.post(f'/messages/{self.message_id}/likes')
+            queued = {row.user_id for row in StaleRecommendation.query}
+            self.assertEqual(queued, {self.u1, self.u3})
+            StaleRecommendation.query.delete()
+            db.session.commit()
+
+    def test_requeued_during_run(self):
+        '''Tests that a user queued again mid-run stays queued'''
+        likes_changed(self.u1, self.message_id)
+        db.session.commit()
+
+        load_matrices = recommendations.load_matrices
+
+        def requeue_then_load():
+            likes_changed(self.u1, self.message_id)
+            return load_matrices()
+
+        with patch('recommendations.load_matrices', requeue_then_load):
+            refresh_recommendations()
+
+        self.assertEqual(StaleRecommendation.query.get(self.u1).version, 2)
+
+    def test_cli(self):
+        '''Tests that flask recommend --full runs the batch job'''
+        result = app.test_cli_runner().invoke(args=['recommend', '--full'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('4 users', result.output)
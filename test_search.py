@@ -0,0 +1,134 @@
+"""Message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, insert
+
+from models import db, Message, MessageTag, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from search import extract_tags, parse_query, search_query
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class TagsTestCase(TestCase):
+    def test_extract_tags(self):
+        '''Tests hashtag and mention extraction'''
+        self.assertEqual(extract_tags("Hi @Bob, #Flask is #fun! email@example.com #fun"),
+                         {"@bob", "#flask", "#fun"})
+
+    def test_parse_query(self):
+        '''Tests splitting a search into tags and words'''
+        self.assertEqual(parse_query("#flask fast @bob apps"),
+                         (["#flask", "@bob"], ["fast", "apps"]))
+
+
+class SearchViewsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        for text in ["Flask apps are fast, flask is fun #python",
+                     "Cooking dinner tonight @u1",
+                     "Learning flask #python #web",
+                     "Running in the park"]:
+            self.client.post('/messages/new', data={"text": text})
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search(self, q, page=1):
+        resp = self.client.get('/api/search', query_string={'q': q, 'page': page})
+        return [msg['text'] for msg in resp.json['messages']]
+
+    def test_ranked_text_search(self):
+        '''Tests that matches are stemmed and ranked by relevance'''
+        self.assertEqual(self.search("flask"), [
+            "Flask apps are fast, flask is fun #python",
+            "Learning flask #python #web",
+        ])
+        self.assertEqual(self.search("runs"), ["Running in the park"])
+        self.assertEqual(self.search("knitting"), [])
+
+    def test_tags_and_mentions(self):
+        '''Tests #tag and @mention terms, alone and with words'''
+        self.assertEqual(len(self.search("#python")), 2)
+        self.assertEqual(self.search("#python #web"), ["Learning flask #python #web"])
+        self.assertEqual(self.search("#python fun"), ["Flask apps are fast, flask is fun #python"])
+        self.assertEqual(self.search("@U1"), ["Cooking dinner tonight @u1"])
+
+    def test_pagination(self):
+        '''Tests paging through results'''
+        app.config['SEARCH_PAGE_SIZE'] = 1
+        try:
+            first = self.client.get('/api/search?q=flask').json
+            second = self.client.get('/api/search?q=flask&page=2').json
+        finally:
+            app.config['SEARCH_PAGE_SIZE'] = 20
+
+        self.assertTrue(first['has_next'])
+        self.assertFalse(second['has_next'])
+        self.assertEqual(second['messages'][0]['text'], "Learning flask #python #web")
+
+    def test_delete_removes_from_results(self):
+        '''Tests that deleted messages and their tags drop out'''
+        msg = Message.query.filter_by(text="Learning flask #python #web").one()
+        self.client.post(f'/messages/{msg.id}/delete')
+
+        self.assertEqual(self.search("#web"), [])
+        self.assertEqual(MessageTag.query.filter_by(tag="#web").count(), 0)
+
+    def test_search_page(self):
+        '''Tests the HTML results page and its empty state'''
+        html = self.client.get('/search?q=park').get_data(as_text=True)
+        self.assertIn("Running in the park", html)
+
+        html = self.client.get('/search?q=zebra').get_data(as_text=True)
+        self.assertIn("no warbles found", html)
+
+    def test_api_requires_query(self):
+        '''Tests that an empty search is a 400'''
+        self.assertEqual(self.client.get('/api/search').status_code, 400)
+
+
+class SqliteSearchTestCase(TestCase):
+    def test_fts5_fallback(self):
+        '''Tests ranked search through the SQLite FTS5 table and triggers'''
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+
+        with engine.begin() as conn:
+            conn.execute(insert(User).values(
+                id=1, email="u@email.com", username="u", password="x"))
+            conn.execute(insert(Message), [
+                {'id': 1, 'text': 'flask flask flask', 'user_id': 1},
+                {'id': 2, 'text': 'one flask among many other words here', 'user_id': 1},
+                {'id': 3, 'text': 'nothing to see "here"', 'user_id': 1},
+            ])
+            conn.execute(Message.__table__.delete().where(Message.id == 3))
+
+            ids = [row.id for row in conn.execute(search_query('flask', 'sqlite'))]
+            self.assertEqual(ids, [1, 2])
+            # Quotes in input are literal, and the deleted message is gone
+            ids = [row.id for row in conn.execute(search_query('"here', 'sqlite'))]
+            self.assertEqual(ids, [2])
@@ -0,0 +1,159 @@
+"""Server-side session tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sessions.py
+
+
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from models import db, StoredSession, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from sessions import DatabaseSessionStore, SessionCache
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+def session_id(client):
+    '''The session cookie's value, or None'''
+
+    for cookie in client.cookie_jar:
+        if cookie.name == app.config['SESSION_COOKIE_NAME']:
+            return cookie.value
+    return None
+
+
+class SessionCacheTestCase(TestCase):
+    def test_lru_and_max_age(self):
+        '''Tests that the cache drops old and least recently used sessions'''
+        cache = SessionCache(max_size=2, max_age=30)
+        cache.put('a', 'A', now=0)
+        cache.put('b', 'B', now=0)
+        cache.get('a', now=1)
+        cache.put('c', 'C', now=1)
+
+        self.assertIsNone(cache.get('b', now=1))
+        self.assertEqual(cache.get('a', now=30), 'A')
+        self.assertIsNone(cache.get('a', now=31))
+
+
+class ServerSessionTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+        StoredSession.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, client):
+        return client.post('/login', data={"username": "u1", "password": "password"},
+                           follow_redirects=True)
+
+    def test_cookie_holds_only_an_id(self):
+        '''Tests that logging in stores the session server-side'''
+        client = app.test_client()
+        resp = self.login(client)
+
+        self.assertIn("Hello, u1!", resp.get_data(as_text=True))
+        sid = session_id(client)
+        self.assertEqual(len(sid), 32)
+        self.assertEqual(StoredSession.query.filter_by(user_id=self.u1_id).count(), 1)
+
+        with client.session_transaction() as sess:
+            self.assertEqual(sess[CURR_USER_KEY], self.u1_id)
+
+    def test_login_rotates_session_id(self):
+        '''Tests that a session id from before login stops working'''
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['planted'] = True
+        planted = session_id(client)
+        self.assertIsNotNone(planted)
+
+        self.login(client)
+        self.assertNotEqual(session_id(client), planted)
+        self.assertIsNone(db.session.get(StoredSession, planted))
+        with client.session_transaction() as sess:
+            self.assertNotIn('planted', sess)
+
+        attacker = app.test_client()
+        attacker.set_cookie('localhost', app.config['SESSION_COOKIE_NAME'], planted)
+        self.assertIn("Sign up", attacker.get('/').get_data(as_text=True))
+
+    def test_unchanged_session_not_rewritten(self):
+        '''Tests that requests which don't change the session keep its id'''
+        client = app.test_client()
+        self.login(client)
+        sid = session_id(client)
+
+        client.get('/')
+        client.get('/users')
+        self.assertEqual(session_id(client), sid)
+
+    def test_logout_deletes_session(self):
+        '''Tests that logging out removes the stored session'''
+        client = app.test_client()
+        self.login(client)
+        sid = session_id(client)
+
+        client.post('/logout')
+        self.assertIsNone(db.session.get(StoredSession, sid))
+        self.assertEqual(StoredSession.query.filter_by(user_id=self.u1_id).count(), 0)
+
+    def test_deleting_user_ends_all_sessions(self):
+        '''Tests that deleting a user deletes their sessions everywhere'''
+        laptop, phone = app.test_client(), app.test_client()
+        self.login(laptop)
+        self.login(phone)
+        self.assertEqual(StoredSession.query.filter_by(user_id=self.u1_id).count(), 2)
+
+        laptop.post('/users/delete')
+        self.assertEqual(StoredSession.query.count(), 0)
+        self.assertIn("Sign up", phone.get('/').get_data(as_text=True))
+
+    def test_anonymous_sessions_not_stored(self):
+        '''Tests that anonymous visitors get a signed cookie, not a stored session'''
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            client = app.test_client()
+            for _ in range(5):
+                html = client.get('/login').get_data(as_text=True)
+
+            self.assertEqual(StoredSession.query.count(), 0)
+            self.assertIn('.', session_id(client))
+
+            # The token in the signed cookie still validates the login
+            token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', html).group(1)
+            resp = client.post('/login', data={"username": "u1", "password": "password",
+                                               "csrf_token": token})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(StoredSession.query.filter_by(user_id=self.u1_id).count(), 1)
+        self.assertNotIn('.', session_id(client))
+
+    def test_purge_expired(self):
+        '''Tests that expired sessions are ignored and purged'''
+        now = datetime.now(timezone.utc)
+        store = DatabaseSessionStore()
+        store.save('old', '{}', None, now - timedelta(seconds=1))
+        store.save('new', '{}', None, now + timedelta(days=1))
+
+        self.assertIsNone(store.load('old', now))
+        self.assertEqual(store.purge(now), 1)
+        self.assertEqual(store.load('new', now), '{}')
@@ -0,0 +1,37 @@
+"""Template caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_templating.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app
+from templating import init_templates
+
+
+class TemplateWarmupTestCase(TestCase):
+    def test_precompile_fills_caches(self):
+        '''Tests that warm-up compiles every template and writes bytecode'''
+        app = create_app('testing')
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            app.config['JINJA_CACHE_DIR'] = cache_dir
+            app.config['JINJA_PRECOMPILE'] = True
+            init_templates(app)
+
+            templates = app.jinja_env.list_templates(extensions=['html'])
+            self.assertEqual(len(app.jinja_env.cache), len(templates))
+            self.assertEqual(len(os.listdir(cache_dir)), len(templates))
+
+    def test_testing_profile_skips_warmup(self):
+        '''Tests that templates compile lazily unless configured otherwise'''
+        app = create_app('testing')
+
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+        self.assertEqual(len(app.jinja_env.cache), 0)
@@ -0,0 +1,183 @@
+"""Home feed warm-up tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Follows, Message, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from timelines import TimelineWarmer, render_feed
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineWarmerTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        msg = Message(text="fresh off the press", user_id=u2.id)
+        db.session.add_all([msg, Follows(user_being_followed_id=u2.id, user_following_id=u1.id)])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        app.config['TIMELINE_WARM_ENABLED'] = True
+        app.config['ADMIN_USERNAMES'] = {"u2"}
+        self.warmer = app.extensions['timelines'] = TimelineWarmer(app)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_WARM_ENABLED'] = False
+        app.config['ADMIN_USERNAMES'] = set()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_warm_and_take_once(self):
+        '''Tests that a warmed feed is rendered in the background and used once'''
+        self.warmer.warm(self.u1_id).result(5)
+
+        feed = self.warmer.take(self.u1_id)
+        self.assertEqual(feed.message_ids, [self.msg_id])
+        self.assertIn('fresh off the press', feed.html)
+        self.assertIsNone(self.warmer.take(self.u1_id))
+
+        metrics = self.warmer.metrics()
+        self.assertEqual((metrics['warmed'], metrics['hits'], metrics['misses']), (1, 1, 1))
+
+    def test_other_worker_takes_feed(self):
+        '''Tests that a feed warmed by one worker is served by another'''
+        self.warmer.warm(self.u1_id).result(5)
+
+        other_worker = TimelineWarmer(app)
+        feed = other_worker.take(self.u1_id)
+        self.assertIn('fresh off the press', feed.html)
+        self.assertIsNone(self.warmer.take(self.u1_id))
+
+    def test_other_worker_invalidates_warm_up(self):
+        '''Tests that a change in another worker keeps a running warm-up from being stored'''
+        started, release = threading.Event(), threading.Event()
+
+        def slow_render(user_id):
+            started.set()
+            release.wait(5)
+            return render_feed(user_id)
+
+        with patch('timelines.render_feed', slow_render):
+            future = self.warmer.warm(self.u1_id)
+            started.wait(5)
+            TimelineWarmer(app).invalidate(self.u1_id)
+            release.set()
+            future.result(5)
+
+        self.assertIsNone(self.warmer.take(self.u1_id))
+        self.assertEqual(self.warmer.metrics()['discarded'], 1)
+
+    def test_ajax_post_not_warmed(self):
+        '''Tests that posting from the AJAX form doesn't warm the feed'''
+        self.login(self.u1_id)
+        self.client.post('/messages/new', json={"text": "Hello"})
+        self.assertNotIn('queued', self.warmer.metrics())
+
+        self.client.post('/messages/new', data={"text": "Hello"})
+        self.assertEqual(self.warmer.metrics()['queued'], 1)
+
+    def test_invalidated_warm_up_discarded(self):
+        '''Tests that a change while a warm-up runs keeps it from being stored'''
+        started, release = threading.Event(), threading.Event()
+
+        def slow_render(user_id):
+            started.set()
+            release.wait(5)
+            return render_feed(user_id)
+
+        with patch('timelines.render_feed', slow_render):
+            future = self.warmer.warm(self.u1_id)
+            started.wait(5)
+            self.warmer.invalidate(self.u1_id)
+            release.set()
+            future.result(5)
+
+        self.assertIsNone(self.warmer.take(self.u1_id))
+        self.assertEqual(self.warmer.metrics()['discarded'], 1)
+
+    def test_drops_past_limit(self):
+        '''Tests that warm-ups past the worker and queue limits are dropped'''
+        app.config['TIMELINE_WARM_WORKERS'] = 1
+        app.config['TIMELINE_WARM_QUEUE'] = 0
+        warmer = TimelineWarmer(app)
+        app.config['TIMELINE_WARM_WORKERS'] = 2
+        app.config['TIMELINE_WARM_QUEUE'] = 50
+
+        release = threading.Event()
+        with patch('timelines.render_feed', lambda user_id: release.wait(5)):
+            first = warmer.warm(self.u1_id)
+            self.assertIsNone(warmer.warm(self.u2_id))
+            release.set()
+            first.result(5)
+
+        self.assertEqual(warmer.metrics()['dropped'], 1)
+
+    def test_login_warms_homepage(self):
+        '''Tests that the first page after login is the feed warmed at login'''
+        resp = self.client.post('/login', data={'username': 'u1', 'password': 'password'})
+        self.assertEqual(resp.status_code, 302)
+        self.warmer.executor.shutdown(wait=True)
+
+        # Changed behind the warmer's back, so only a warmed feed shows the old text
+        Message.query.filter_by(id=self.msg_id).update({'text': 'edited'})
+        db.session.commit()
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('fresh off the press', html)
+        self.assertIn('edited', self.client.get('/').get_data(as_text=True))
+
+    def test_like_invalidates(self):
+        '''Tests that liking a message drops the warmed feed showing it unliked'''
+        self.login(self.u1_id)
+        self.warmer.warm(self.u1_id).result(5)
+
+        self.client.post(f'/messages/{self.msg_id}/likes')
+
+        self.assertIsNone(self.warmer.take(self.u1_id))
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('bi-heart-fill', html)
+
+    def test_deleted_message_drops_feeds(self):
+        '''Tests that deleting a message drops the warmed feeds showing it'''
+        self.warmer.warm(self.u1_id).result(5)
+        self.warmer.invalidate_messages([self.msg_id + 1])
+        self.warmer.invalidate_messages([self.msg_id])
+
+        self.assertIsNone(self.warmer.take(self.u1_id))
+        self.assertEqual(self.warmer.metrics()['invalidated'], 1)
+
+    def test_metrics_admins_only(self):
+        '''Tests that warm-up counters are only shown to admins'''
+        self.login(self.u1_id)
+        self.assertEqual(self.client.get('/admin/metrics/timelines').status_code, 401)
+
+        self.login(self.u2_id)
+        resp = self.client.get('/admin/metrics/timelines')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('in_flight', resp.json)
@@ -0,0 +1,229 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, Message, TrendingScore, User
+
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+from app import create_app, CURR_USER_KEY
+from trending import Trending
+
+app = create_app('testing')
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+HOUR = 3600
+NOW = 1700000000
+
+
+def new_trending(capacity=100):
+    return Trending({'hour': HOUR}, capacity=capacity, checkpoint_seconds=3600)
+
+
+class TrendingScoresTestCase(TestCase):
+    def test_decay(self):
+        '''Tests that a like's score halves every half-life'''
+        trending = new_trending()
+        trending.record(1, 1, now=NOW)
+        window = trending.windows['hour']
+
+        [(_, log_score)] = window.top(1)
+        self.assertAlmostEqual(window.score(log_score, NOW), 1)
+        self.assertAlmostEqual(window.score(log_score, NOW + HOUR), 0.5)
+
+    def test_recent_likes_outrank_old_ones(self):
+        '''Tests that two old likes lose to one new one'''
+        trending = new_trending()
+        trending.record(1, 1, now=NOW)
+        trending.record(1, 1, now=NOW)
+        trending.record(2, 1, now=NOW + 2 * HOUR)
+
+        self.assertEqual([message_id for message_id, _ in trending.windows['hour'].top(2)], [2, 1])
+
+    def test_unlike(self):
+        '''Tests that unliking takes a like back out'''
+        trending = new_trending()
+        trending.record(1, 1, now=NOW)
+        trending.record(2, 1, now=NOW)
+        trending.record(2, 1, now=NOW)
+        trending.record(2, -1, now=NOW)
+        trending.record(1, -1, now=NOW)
+
+        self.assertEqual([message_id for message_id, _ in trending.windows['hour'].top(5)], [2])
+
+    def test_capacity(self):
+        '''Tests that a window keeps a bounded number of scores'''
+        trending = new_trending(capacity=10)
+        for message_id in range(100):
+            trending.record(message_id, 1, now=NOW + message_id)
+
+        window = trending.windows['hour']
+        self.assertLessEqual(len(window.scores), 12)
+        self.assertEqual(window.top(1)[0][0], 99)
+
+    def test_pending_capped(self):
+        '''Tests that likes waiting for a checkpoint are bounded too'''
+        trending = new_trending(capacity=10)
+        for message_id in range(100):
+            trending.record(message_id, 1 + (message_id == 50))
+
+        pending = trending.windows['hour'].pending
+        self.assertLessEqual(len(pending), 20)
+        self.assertIn(50, pending)
+
+
+class TrendingCheckpointTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        messages = [Message(text=f"m{n}", user_id=u1.id) for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.message_ids = [message.id for message in messages]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_workers_merge_through_checkpoints(self):
+        '''Tests that checkpoints combine likes counted by different workers'''
+        m1, m2, _ = self.message_ids
+        worker1, worker2 = new_trending(), new_trending()
+
+        worker1.record(m1, 1)
+        worker2.record(m1, 1)
+        worker2.record(m2, 1)
+        worker1.checkpoint()
+        worker2.checkpoint()
+
+        self.assertEqual([message_id for message_id, _ in worker2.top('hour', 5)], [m1, m2])
+        [(_, score), _] = worker2.top('hour', 5)
+        self.assertAlmostEqual(score, 2, places=3)
+
+        # Worker 1 sees worker 2's likes after its next checkpoint
+        worker1.checkpoint()
+        self.assertEqual(len(worker1.top('hour', 5)), 2)
+
+    def test_concurrent_checkpoints_add_up(self):
+        '''Tests that workers checkpointing the same message at once both count'''
+        m1 = self.message_ids[0]
+        workers = [new_trending() for _ in range(4)]
+        for worker in workers:
+            worker.record(m1, 1)
+
+        def checkpoint(worker):
+            with app.app_context():
+                try:
+                    worker.checkpoint()
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=checkpoint, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        [(_, score)] = new_trending().top('hour', 5)
+        self.assertAlmostEqual(score, 4, places=3)
+
+    def test_unliked_scores_removed(self):
+        '''Tests that a score unliked back to zero leaves the table'''
+        m1 = self.message_ids[0]
+        trending = new_trending()
+
+        trending.record(m1, 1)
+        trending.checkpoint()
+        trending.record(m1, -1)
+        trending.checkpoint()
+
+        self.assertEqual(TrendingScore.query.count(), 0)
+        self.assertEqual(trending.top('hour', 5), [])
+
+    def test_table_trimmed_to_capacity(self):
+        '''Tests that checkpoints keep only the best scores per window'''
+        trending = new_trending(capacity=2)
+        for message_id in self.message_ids:
+            trending.record(message_id, 1)
+        trending.checkpoint()
+
+        self.assertEqual(TrendingScore.query.count(), 2)
+
+    def test_deleted_message_skipped(self):
+        '''Tests that likes on a since-deleted message aren't checkpointed'''
+        m1 = self.message_ids[0]
+        trending = new_trending()
+        trending.record(m1, 1)
+        Message.query.filter_by(id=m1).delete()
+        db.session.commit()
+
+        trending.checkpoint()
+        self.assertEqual(TrendingScore.query.count(), 0)
+
+    def test_likes_checkpoint_without_reads(self):
+        '''Tests that liking checkpoints once due, with nothing reading /trending'''
+        m1, m2, m3 = self.message_ids
+        trending = app.extensions['trending'] = new_trending(capacity=2)
+        trending.checkpointed_at = time.monotonic()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        client.post(f'/messages/{m1}/likes')
+        self.assertIsNone(trending.checkpointer)
+
+        # Pending likes reaching the capacity make a checkpoint due early
+        client.post(f'/messages/{m2}/likes')
+        trending.checkpointer.join()
+        self.assertEqual(TrendingScore.query.count(), 2)
+        self.assertEqual(trending.windows['hour'].pending, {})
+
+        # As does the interval passing
+        trending.checkpointed_at -= 3600
+        client.post(f'/messages/{m3}/likes')
+        trending.checkpointer.join()
+        db.session.rollback()
+        self.assertEqual(TrendingScore.query.count(), 2)
+        self.assertEqual(trending.windows['hour'].pending, {})
+
+    def test_trending_page_and_api(self):
+        '''Tests that likes show up on /trending and /api/trending'''
+        m1, m2, _ = self.message_ids
+        app.extensions['trending'] = new_trending()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        client.post(f'/messages/{m2}/likes')
+        client.post(f'/messages/{m1}/likes')
+        client.post(f'/messages/{m1}/likes')
+        client.post(f'/messages/{m1}/likes')
+
+        resp = client.get('/api/trending?window=hour')
+        self.assertEqual([msg['id'] for msg in resp.json['messages']], [m1, m2])
+        self.assertEqual(resp.json['messages'][0]['username'], "u1")
+
+        html = client.get('/trending').get_data(as_text=True)
+        self.assertIn('<p>m1</p>', html)
+        self.assertIn('bi-heart-fill', html)
+
+        self.assertEqual(client.get('/trending?window=decade').status_code, 404)
@@ -6,40 +6,43 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, Message, User, connect_db, Follows
+from flask import g
+
+from models import db, Follows, Like, Message, User
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
 # before we import our app, since that will have already
 # connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['DATABASE_URL'] = os.environ.get('WARBLER_TEST_DATABASE_URL', "postgresql:///warbler_test")
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY
+from forms import unmask_token
 
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+# The testing profile leaves out the debug toolbar and turns off WTForms
+# CSRF (it's a pain to test)
 
-# This is a bit of hack, but don't use Flask DebugToolbar
+app = create_app('testing')
+app.app_context().push()
 
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+# Timelines are streamed responses. When one is reached through a redirect,
+# pass buffered=True: Flask 2.2's test client re-pushes the contexts it
+# preserved while the stream still holds its own, and unwinding them fails
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
-connect_db(app)
-
 db.drop_all()
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class UserBaseViewTestCase(TestCase):
     def setUp(self):
@@ -92,13 +95,25 @@ class UserAuthorizationTestUseCase(UserBaseViewTestCase):
         '''Tests that correct HTML is returned when logging in'''
         with self.client as c:
             data = {"username": "u2", "password": "password"}
-            resp = c.post('/login', data=data, follow_redirects=True)
+            resp = c.post('/login', data=data, follow_redirects=True, buffered=True)
 
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Hello, u2!", html)
 
+    def test_login_flash_shown_once(self):
+        '''Tests that a flash read by a streamed page is not shown again'''
+        with self.client as c:
+            data = {"username": "u2", "password": "password"}
+            resp = c.post('/login', data=data, follow_redirects=True, buffered=True)
+
+            self.assertIn("Hello, u2!", resp.get_data(as_text=True))
+
+            resp = c.get('/')
+            self.assertTrue(resp.is_streamed)
+            self.assertNotIn("Hello, u2!", resp.get_data(as_text=True))
+
     def test_login_bad_pass(self):
         '''Tests that correct HTML is returning when logging in with bad password'''
         with self.client as c:
@@ -148,7 +163,7 @@ class UserAuthorizationTestUseCase(UserBaseViewTestCase):
         with self.client as c:
             data = {"username": "u3", "password": "password",
                 "email": "u3@email.com", "image_url": None}
-            resp = c.post('/signup', data=data, follow_redirects=True)
+            resp = c.post('/signup', data=data, follow_redirects=True, buffered=True)
 
             html = resp.get_data(as_text=True)
 
@@ -213,6 +228,28 @@ class UserProfileViewTestCase(UserBaseViewTestCase):
             self.assertIn('@u1', html)
             self.assertIn('@u2', html)
 
+    def test_api_list_users_paged(self):
+        '''Tests that the JSON user list comes a page at a time, with a capped limit'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get('/api/users?limit=1')
+            self.assertEqual(resp.json['page'], 1)
+            self.assertTrue(resp.json['has_next'])
+            self.assertEqual([user['username'] for user in resp.json['users']], ['u1'])
+
+            resp = c.get('/api/users?limit=1&page=2')
+            self.assertFalse(resp.json['has_next'])
+            self.assertEqual([user['username'] for user in resp.json['users']], ['u2'])
+
+            app.config['USERS_PAGE_MAX'] = 1
+            try:
+                resp = c.get('/api/users?limit=1000&page=x')
+            finally:
+                app.config['USERS_PAGE_MAX'] = 200
+            self.assertEqual((resp.json['page'], len(resp.json['users'])), (1, 1))
+
     def test_list_users_not_logged_in(self):
         '''Tests that list users returns correct html when logged out'''
         with self.client as c:
@@ -228,7 +265,7 @@ class UserProfileViewTestCase(UserBaseViewTestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1_id
             data = {"username": "new", "password": "password"}
-            resp = c.post('/users/profile', data=data, follow_redirects=True)
+            resp = c.post('/users/profile', data=data, follow_redirects=True, buffered=True)
             html = resp.get_data(as_text=True)
             self.assertIn('@new', html)
 
@@ -319,6 +356,18 @@ class LikeViewTestCase(UserBaseViewTestCase):
             self.assertIn("Access unauthorized", html)
             self.assertEqual(len(user.liked_messages), 1)
 
+    def test_like_own_message_or_as_guest(self):
+        '''Tests that liking your own message, or liking over AJAX logged out, is refused'''
+        with self.client as c:
+            resp = c.post(f'/messages/{self.m2_id}/likes')
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.post(f'/messages/{self.m2_id}/like')
+            self.assertEqual(resp.status_code, 403)
+
     def test_remove_like(self):
         '''Tests to show that proper HTML is returned when liking message'''
         with self.client as c:
@@ -335,19 +384,112 @@ class LikeViewTestCase(UserBaseViewTestCase):
             self.assertIn("Success!", html)
             self.assertEqual(len(user.liked_messages), 0)
 
+    def test_like_with_page_token(self):
+        '''Tests that likes take the page's one CSRF token as a header'''
+        app.config['WTF_CSRF_ENABLED'] = True
+        # g outlives requests under this module's app context, so drop the
+        # token an earlier test's page left there
+        g.pop('csrf_token', None)
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                html = c.get(f'/users/{self.u2_id}', buffered=True).get_data(as_text=True)
+                self.assertEqual(html.count('csrf-token'), 1)
+                self.assertNotIn('csrf_token', html.split('id="messages"')[1])
+                token = html.split('name="csrf-token" content="')[1].split('"')[0]
+
+                resp = c.post(f'/messages/{self.m2_id}/like')
+                self.assertEqual(resp.status_code, 400)
+                resp = c.post(f'/messages/{self.m2_id}/likes', headers={'X-CSRFToken': 'forged'})
+                self.assertEqual(resp.status_code, 400)
+
+                resp = c.post(f'/messages/{self.m2_id}/like', headers={'X-CSRFToken': token})
+                self.assertIn("Success!", resp.get_data(as_text=True))
+                resp = c.post(f'/messages/{self.m1_id}/likes', headers={'X-CSRFToken': token})
+                self.assertEqual(resp.json, {'message': 'Like removed'})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+        user = User.query.get(self.u1_id)
+        self.assertEqual([msg.id for msg in user.liked_messages], [self.m2_id])
+
+    def test_page_token_masked(self):
+        '''Tests that each page carries the CSRF token in different bytes, all valid'''
+        app.config['WTF_CSRF_ENABLED'] = True
+        g.pop('csrf_token', None)
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                tokens = []
+                for _ in range(2):
+                    html = c.get('/search?q=csrf', buffered=True).get_data(as_text=True)
+                    tokens.append(html.split('name="csrf-token" content="')[1].split('"')[0])
+                    g.pop('csrf_token', None)
+                self.assertNotEqual(tokens[0], tokens[1])
+                # Nor does the unmasked token appear anywhere on the page
+                self.assertNotIn(unmask_token(tokens[1]), html)
+
+                for token in tokens:
+                    resp = c.post(f'/messages/{self.m2_id}/like', headers={'X-CSRFToken': token})
+                    self.assertIn("Success!", resp.get_data(as_text=True))
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+    def test_profile_likes_and_counts(self):
+        '''Tests that a profile marks the viewer's likes and counts messages'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get(f'/users/{self.u2_id}').get_data(as_text=True)
+
+            self.assertEqual(html.count('bi-heart-fill'), 1)
+            self.assertEqual(html.count('class="bi bi-heart"'), 1)
+            self.assertRegex(html, rf'href="/users/{self.u2_id}">\s*2\s*</a>')
+
     def test_show_likes(self):
         '''Test to show that show likes function returns correct HTML'''
         with self.client as c:
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1_id
 
-            resp = c.get(f'/users/{self.u1_id}/likes', follow_redirects=True)
+            resp = c.get(f'/users/{self.u1_id}/likes')
+            self.assertTrue(resp.is_streamed)
 
             html = resp.get_data(as_text=True)
 
             self.assertIn("@u2", html)
+            self.assertIn("bi-heart-fill", html)
             self.assertEqual(resp.status_code, 200)
 
+    def test_show_other_users_likes_paginated(self):
+        '''Tests that the likes page shows the requested user's likes, newest first, a page at a time'''
+        u2 = User.query.get(self.u2_id)
+        for n in range(3):
+            msg = Message(text=f"liked {n}", user_id=self.u1_id)
+            db.session.add(msg)
+            db.session.flush()
+            db.session.add(Like(user_id=u2.id, message_id=msg.id,
+                                created_at=datetime(2023, 1, 1, n)))
+        db.session.commit()
+
+        with patch.dict(app.config, {'LIKES_PAGE_SIZE': 2}), self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get(f'/users/{self.u2_id}/likes').get_data(as_text=True)
+            self.assertLess(html.index("liked 2"), html.index("liked 1"))
+            self.assertNotIn("liked 0", html)
+            self.assertNotIn(">text<", html)
+            self.assertIn("?page=2", html)
+
+            html = c.get(f'/users/{self.u2_id}/likes?page=2').get_data(as_text=True)
+            self.assertIn("liked 0", html)
+            self.assertNotIn("?page=3", html)
 
     def test_show_likes_as_guest(self):
         '''Test to show that show likes function returns correct HTML when not logged in'''
@@ -421,4 +563,17 @@ class FollowUserViewTestCase(UserBaseViewTestCase):
             html = resp.get_data(as_text=True)
 
             self.assertIn("@u2", html)
-            self.assertEqual(resp.status_code, 200)
\ No newline at end of file
+            self.assertEqual(resp.status_code, 200)
+
+    def test_unfollow_missing_user(self):
+        '''Tests that unfollowing an unknown or unfollowed user doesn't error'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.post(f'/users/stop-following/{self.u1_id + self.u2_id}')
+            self.assertEqual(resp.status_code, 404)
+
+            resp = c.post(f'/users/stop-following/{self.u2_id}')
+            self.assertEqual(resp.status_code, 302)
+
@@ -0,0 +1,243 @@
+"""Home feeds rendered ahead of the user's next visit.
+
+Logging in (or posting from the form) queues a warm-up of the user's home
+feed on a small per-worker thread pool: the first page is queried and its
+message cards rendered, and the result (message ids plus HTML) is saved in
+the warmed_feeds table for TIMELINE_WARM_SECONDS. The user's next /
+request, in whichever worker it lands, takes it instead of running the
+query, so the page after login isn't a cold one. Each warmed feed is used
+once.
+
+At most TIMELINE_WARM_WORKERS warm-ups run at once and TIMELINE_WARM_QUEUE
+more wait; past that, requests are dropped and the page renders as usual.
+The user's own likes, follows and deletes drop their warmed feed, and
+leave a marker so a warm-up already running (in any worker) isn't kept.
+Messages posted meanwhile by people they follow aren't added, which the
+TTL bounds.
+
+Counters for all of this are served at /admin/metrics/timelines.
+"""
+
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, render_template
+from markupsafe import Markup
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from graph import following_ids
+from models import db, WarmedFeed
+from queries import timeline_query
+
+Feed = namedtuple('Feed', ['message_ids', 'html'])
+
+
+def timeline_rows(user_id):
+    """First page of `user_id`'s home feed (timeline_query rows), off a
+    server-side cursor."""
+
+    return db.session.execute(
+        timeline_query([*following_ids(user_id), user_id], user_id)
+        .execution_options(yield_per=current_app.config['TIMELINE_YIELD_PER']))
+
+
+def render_feed(user_id):
+    """`user_id`'s home feed cards, rendered now."""
+
+    rows = timeline_rows(user_id).all()
+    html = render_template('messages/feed-items.html', messages=rows, viewer_id=user_id)
+
+    return Feed([row.id for row in rows], Markup(html))
+
+
+class TimelineWarmer:
+    """Renders feeds on a bounded thread pool and saves them until used.
+
+    Uses its own connections, like DatabaseSessionStore, so saving or
+    taking a feed never commits the request's transaction.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.app = app
+        self.enabled = config['TIMELINE_WARM_ENABLED']
+        self.workers = config['TIMELINE_WARM_WORKERS']
+        self.max_pending = self.workers + config['TIMELINE_WARM_QUEUE']
+        self.max_age = config['TIMELINE_WARM_SECONDS']
+
+        self.lock = threading.Lock()
+        self.running = 0
+        self.stats = Counter()
+        self.executor = None
+        self.pid = None
+
+    def warm(self, user_id):
+        """Queue a warm-up of `user_id`'s feed; returns its future, or None
+        if it was dropped."""
+
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            # Threads don't survive a fork, so each worker makes its own pool
+            if self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='timelines')
+                self.running = 0
+                self.pid = os.getpid()
+
+            if self.running >= self.max_pending:
+                self.stats['dropped'] += 1
+                return None
+
+            self.running += 1
+            self.stats['queued'] += 1
+            return self.executor.submit(self.run, user_id)
+
+    def run(self, user_id):
+        start = time.monotonic()
+        rendered_at = time.time()
+        try:
+            with self.app.app_context():
+                kept = self.store(user_id, render_feed(user_id), rendered_at)
+        except Exception:
+            self.app.logger.exception("Couldn't warm the feed of user %s", user_id)
+            kept = None
+
+        with self.lock:
+            self.running -= 1
+
+            if kept is None:
+                self.stats['failed'] += 1
+                return
+
+            self.stats['render_seconds'] += time.monotonic() - start
+            self.stats['warmed' if kept else 'discarded'] += 1
+
+    def store(self, user_id, feed, rendered_at):
+        """Save `feed` unless `user_id`'s feed changed (or a later warm-up
+        was saved) since `rendered_at`; returns whether it was kept."""
+
+        now = time.time()
+        stmt = pg_insert(WarmedFeed).values(
+            user_id=user_id,
+            message_ids=feed.message_ids,
+            html=str(feed.html),
+            rendered_at=rendered_at,
+            expires=rendered_at + self.max_age,
+        )
+        with db.engine.begin() as conn:
+            # Feeds nobody came back for, and markers no warm-up can predate
+            expired = conn.execute(delete(WarmedFeed).where(WarmedFeed.expires <= now)).rowcount
+            kept = conn.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=['user_id'],
+                    set_={name: stmt.excluded[name]
+                          for name in ('message_ids', 'html', 'rendered_at', 'expires')},
+                    where=WarmedFeed.rendered_at <= stmt.excluded.rendered_at)
+                .returning(WarmedFeed.user_id)
+            ).first() is not None
+
+        with self.lock:
+            self.stats['expired'] += expired
+
+        return kept
+
+    def take(self, user_id):
+        """`user_id`'s warmed feed, if fresh, or None. Either way it's gone
+        afterwards."""
+
+        if not self.enabled:
+            return None
+
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                delete(WarmedFeed)
+                .where(WarmedFeed.user_id == user_id, WarmedFeed.html.is_not(None))
+                .returning(WarmedFeed.message_ids, WarmedFeed.html, WarmedFeed.expires)
+            ).first()
+
+        with self.lock:
+            feed = None
+            if row is not None and row.expires <= time.time():
+                self.stats['expired'] += 1
+            elif row is not None:
+                feed = Feed(row.message_ids, Markup(row.html))
+
+            self.stats['hits' if feed is not None else 'misses'] += 1
+            return feed
+
+    def invalidate(self, user_id):
+        """Drop `user_id`'s warmed feed, and mark it changed so a warm-up
+        already running isn't kept."""
+
+        if not self.enabled:
+            return
+
+        now = time.time()
+        stmt = pg_insert(WarmedFeed).values(user_id=user_id, rendered_at=now,
+                                            expires=now + self.max_age)
+        with db.engine.begin() as conn:
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={'message_ids': None, 'html': None,
+                      'rendered_at': stmt.excluded.rendered_at, 'expires': stmt.excluded.expires}))
+
+        with self.lock:
+            self.stats['invalidated'] += 1
+
+    def invalidate_messages(self, message_ids):
+        """Drop every warmed feed showing any of `message_ids`."""
+
+        if not self.enabled:
+            return
+
+        with db.engine.begin() as conn:
+            dropped = conn.execute(
+                delete(WarmedFeed).where(WarmedFeed.message_ids.overlap(list(message_ids)))
+            ).rowcount
+
+        with self.lock:
+            self.stats['invalidated'] += dropped
+
+    def metrics(self):
+        entries = db.session.scalar(
+            select(func.count())
+            .where(WarmedFeed.html.is_not(None), WarmedFeed.expires > time.time()))
+
+        with self.lock:
+            return {**self.stats, 'in_flight': self.running, 'entries': entries}
+
+
+def init_timelines(app):
+    """Give this app a feed warmer."""
+
+    app.extensions['timelines'] = TimelineWarmer(app)
+
+
+def warm_feed(user_id):
+    """Call once `user_id` is likely to load / soon (after login or posting
+    from the form)."""
+
+    current_app.extensions['timelines'].warm(user_id)
+
+
+def take_feed(user_id):
+    return current_app.extensions['timelines'].take(user_id)
+
+
+def feed_changed(user_id):
+    """Call after `user_id` likes, follows or deletes something."""
+
+    current_app.extensions['timelines'].invalidate(user_id)
+
+
+def messages_deleted(message_ids):
+    current_app.extensions['timelines'].invalidate_messages(message_ids)
+
+
+def timeline_metrics():
+    return current_app.extensions['timelines'].metrics()
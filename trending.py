@@ -0,0 +1,329 @@
+"""Trending messages, ranked by time-decayed likes.
+
+TRENDING_WINDOWS maps each window name to a half-life in seconds. A like
+adds 1 to a message's score in every window and an unlike takes 1 away;
+after that the score halves every half-life.
+
+Scores are kept in forward-decay form: log(score) plus the time since EPOCH
+in units of the decay constant. That number never has to be updated as
+time passes and compares correctly between any two messages. Recording a
+like is O(1), and ranking is a heap selection.
+
+Each worker holds up to TRENDING_CAPACITY scores per window and applies its
+own likes right away. Every TRENDING_CHECKPOINT_SECONDS (checked on each
+like, which starts a background thread, and each read), or sooner once
+TRENDING_CAPACITY messages have likes pending, it merges the likes since
+the last checkpoint into trending_scores, trims that table back to
+capacity, and reloads from it, which brings in other workers' likes. The
+merge adds to each stored score in SQL, so checkpoints racing on the same
+message both count. If checkpoints keep failing, only the largest pending
+changes are kept. The trending page and JSON read the in-memory scores and
+then the messages they show. They never scan the likes table.
+"""
+
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from operator import itemgetter
+
+from flask import current_app
+from sqlalchemy import Float, Integer, column, delete, func, literal, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, Message, TrendingScore
+
+# 2023-01-01 UTC; any fixed instant works
+EPOCH = 1672531200
+
+# Scores at or under this are zero (e.g. a like taken back)
+EMPTY = 1e-9
+
+
+def shift(log_score, delta, clock):
+    """`log_score` with `delta` likes added at `clock`; None once it hits zero."""
+
+    value = math.exp(log_score - clock) if log_score is not None else 0.0
+    value += delta
+
+    return clock + math.log(value) if value > EMPTY else None
+
+
+class Window:
+    """Bounded scores for one half-life, plus likes not yet checkpointed."""
+
+    def __init__(self, name, half_life, capacity, now):
+        self.name = name
+        self.tau = half_life / math.log(2)
+        self.capacity = capacity
+        self.scores = {}
+
+        # Net likes since the last checkpoint, decayed to `pending_clock`
+        self.pending = defaultdict(float)
+        self.pending_clock = self.clock(now)
+
+    def clock(self, now):
+        return (now - EPOCH) / self.tau
+
+    def record(self, message_id, delta, now):
+        clock = self.clock(now)
+        self.pending[message_id] += delta * math.exp(clock - self.pending_clock)
+
+        log_score = shift(self.scores.get(message_id), delta, clock)
+        if log_score is None:
+            self.scores.pop(message_id, None)
+        else:
+            self.scores[message_id] = log_score
+
+        # Trim in batches rather than on every like past capacity
+        if len(self.scores) > self.capacity * 5 // 4:
+            self.scores = dict(self.top(self.capacity))
+        self.trim_pending()
+
+    def trim_pending(self):
+        """Keep the largest pending changes once checkpoints fall behind."""
+
+        if len(self.pending) > self.capacity * 2:
+            self.pending = defaultdict(float, heapq.nlargest(
+                self.capacity, self.pending.items(), key=lambda item: abs(item[1])))
+
+    def top(self, n):
+        """The `n` best (message id, log score) pairs, best first."""
+
+        return heapq.nlargest(n, self.scores.items(), key=itemgetter(1))
+
+    def score(self, log_score, now):
+        """The decayed score a forward-decayed `log_score` is worth at `now`."""
+
+        return math.exp(log_score - self.clock(now))
+
+    def take_pending(self, now):
+        """Hand over the pending likes and their clock, and start afresh."""
+
+        taken = (self.pending, self.pending_clock)
+        self.pending = defaultdict(float)
+        self.pending_clock = self.clock(now)
+
+        return taken
+
+    def restore_pending(self, pending, pending_clock):
+        """Put back pending likes a failed checkpoint didn't save."""
+
+        for message_id, delta in pending.items():
+            self.pending[message_id] += delta * math.exp(pending_clock - self.pending_clock)
+        self.trim_pending()
+
+    def load(self, scores):
+        """Replace scores with checkpointed ones, keeping our pending likes."""
+
+        self.scores = scores
+        for message_id, delta in self.pending.items():
+            log_score = shift(self.scores.get(message_id), delta, self.pending_clock)
+            if log_score is None:
+                self.scores.pop(message_id, None)
+            else:
+                self.scores[message_id] = log_score
+
+
+class Trending:
+    """This worker's trending windows and their checkpointing."""
+
+    def __init__(self, windows, capacity, checkpoint_seconds):
+        now = time.time()
+
+        self.lock = threading.Lock()
+        self.windows = {name: Window(name, half_life, capacity, now)
+                        for name, half_life in windows.items()}
+        self.capacity = capacity
+        self.checkpoint_seconds = checkpoint_seconds
+        self.checkpointed_at = None
+        # The last background checkpoint's thread, if any
+        self.checkpointer = None
+
+    def record(self, message_id, delta, now=None):
+        """Count a like (delta=1) or unlike (delta=-1) of `message_id`."""
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            for window in self.windows.values():
+                window.record(message_id, delta, now)
+
+    def forget(self, message_ids):
+        """Drop deleted messages, so they stop taking up top places."""
+
+        with self.lock:
+            for window in self.windows.values():
+                for message_id in message_ids:
+                    window.scores.pop(message_id, None)
+                    window.pending.pop(message_id, None)
+
+    def top(self, name, n, now=None):
+        """The `n` hottest messages in window `name` as (message id, score)."""
+
+        self.maybe_checkpoint()
+        now = time.time() if now is None else now
+
+        with self.lock:
+            window = self.windows[name]
+            return [(message_id, window.score(log_score, now))
+                    for message_id, log_score in window.top(n)]
+
+    def claim_checkpoint(self):
+        """Is a checkpoint due (the interval has passed or too many likes
+        are pending)? If so, it's claimed, so other threads don't start one."""
+
+        with self.lock:
+            due = (self.checkpointed_at is None
+                   or time.monotonic() - self.checkpointed_at >= self.checkpoint_seconds
+                   or any(len(window.pending) >= self.capacity
+                          for window in self.windows.values()))
+            if due:
+                self.checkpointed_at = time.monotonic()
+            return due
+
+    def maybe_checkpoint(self):
+        """Checkpoint now if one is due. A failed checkpoint is logged and
+        its likes kept pending."""
+
+        if self.claim_checkpoint():
+            self.try_checkpoint(current_app.logger)
+
+    def checkpoint_in_background(self, app):
+        """Checkpoint on a thread of its own if one is due."""
+
+        if self.claim_checkpoint():
+            self.checkpointer = threading.Thread(
+                target=self.checkpoint_in_app, args=(app,), name='trending', daemon=True)
+            self.checkpointer.start()
+
+    def checkpoint_in_app(self, app):
+        with app.app_context():
+            try:
+                self.try_checkpoint(app.logger)
+            finally:
+                db.session.remove()
+
+    def try_checkpoint(self, logger):
+        try:
+            self.checkpoint()
+        except Exception:
+            logger.exception("Trending checkpoint failed")
+
+    def checkpoint(self, now=None):
+        """Merge pending likes into trending_scores and reload from it."""
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            self.checkpointed_at = time.monotonic()
+            taken = {name: window.take_pending(now) for name, window in self.windows.items()}
+
+        try:
+            for name, (pending, pending_clock) in taken.items():
+                if pending:
+                    self.merge(name, pending, pending_clock)
+                self.trim(name)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                for name, (pending, pending_clock) in taken.items():
+                    self.windows[name].restore_pending(pending, pending_clock)
+            raise
+
+        loaded = defaultdict(dict)
+        for name, message_id, log_score in db.session.execute(
+                select(TrendingScore.window, TrendingScore.message_id, TrendingScore.log_score)
+                .where(TrendingScore.window.in_(self.windows))):
+            loaded[name][message_id] = log_score
+
+        with self.lock:
+            for name, window in self.windows.items():
+                window.load(loaded[name])
+
+    def merge(self, name, pending, pending_clock):
+        """Add `pending` likes into window `name`'s checkpointed scores.
+
+        Done in SQL on each row, so workers checkpointing the same message
+        at once add up rather than overwrite each other.
+        """
+
+        table = TrendingScore.__table__.c
+
+        # Likes: insert, or log-sum-exp into the stored score. Messages
+        # deleted since they were liked have no row to join, and are skipped.
+        added = [(message_id, pending_clock + math.log(delta))
+                 for message_id, delta in pending.items() if delta > EMPTY]
+        if added:
+            rows = values(column('message_id', Integer), column('log_score', Float),
+                          name='added').data(added)
+            stmt = pg_insert(TrendingScore).from_select(
+                ['window', 'message_id', 'log_score'],
+                select(literal(name), rows.c.message_id, rows.c.log_score)
+                .join(Message, Message.id == rows.c.message_id))
+            high = func.greatest(table.log_score, stmt.excluded.log_score)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['window', 'message_id'],
+                set_={'log_score': high + func.ln(func.exp(table.log_score - high)
+                                                  + func.exp(stmt.excluded.log_score - high))}))
+
+        # Net unlikes: subtract from stored scores, dropping those used up
+        removed = [(message_id, delta) for message_id, delta in pending.items() if delta < -EMPTY]
+        if removed:
+            rows = values(column('message_id', Integer), column('delta', Float),
+                          name='removed').data(removed)
+            value = func.exp(table.log_score - pending_clock) + rows.c.delta
+            db.session.execute(
+                update(TrendingScore)
+                .where(table.window == name, table.message_id == rows.c.message_id)
+                .values(log_score=pending_clock + func.ln(func.greatest(value, EMPTY)))
+                .execution_options(synchronize_session=False))
+            db.session.execute(
+                delete(TrendingScore)
+                .where(table.window == name,
+                       table.message_id.in_([message_id for message_id, _ in removed]),
+                       table.log_score <= pending_clock + math.log(2 * EMPTY))
+                .execution_options(synchronize_session=False))
+
+    def trim(self, name):
+        """Drop checkpointed scores in window `name` beyond the capacity."""
+
+        cutoff = (select(TrendingScore.log_score)
+                  .where(TrendingScore.window == name)
+                  .order_by(TrendingScore.log_score.desc())
+                  .offset(self.capacity)
+                  .limit(1)
+                  .scalar_subquery())
+
+        db.session.execute(
+            delete(TrendingScore)
+            .where(TrendingScore.window == name, TrendingScore.log_score <= cutoff)
+            .execution_options(synchronize_session=False))
+
+
+def init_trending(app):
+    """Create this app's trending windows and store them on the app."""
+
+    app.extensions['trending'] = Trending(
+        windows=app.config['TRENDING_WINDOWS'],
+        capacity=app.config['TRENDING_CAPACITY'],
+        checkpoint_seconds=app.config['TRENDING_CHECKPOINT_SECONDS'],
+    )
+
+
+def record_like(message_id, delta):
+    """Count a committed like (1) or unlike (-1) of `message_id`, and
+    checkpoint in the background if one is due, so workers that never serve
+    /trending still hand over their likes (without the like waiting)."""
+
+    trending = current_app.extensions['trending']
+    trending.record(message_id, delta)
+    trending.checkpoint_in_background(current_app._get_current_object())
+
+
+def record_deleted(message_ids):
+    """Forget messages that were deleted (their likes went with them)."""
+
+    current_app.extensions['trending'].forget(message_ids)
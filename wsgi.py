@@ -0,0 +1,13 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py
+
+Importing this module builds the app but opens no database connections,
+so it is safe to preload in a forking server's master process.
+"""
+
+import os
+
+from app import create_app
+
+app = create_app(os.environ.get('WARBLER_CONFIG', 'production'))